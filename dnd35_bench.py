@@ -0,0 +1,397 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import timeit
+import dnd35_defs as dnd
+import dnd35_generator as generator
+import dnd35_service as service
+
+# owwww|====================> Benchmarks <======================|wwwwo
+#
+#   rpc    Round-trip latency of the Unix socket JSON-RPC server, e.g.
+#
+#          python dnd35_bench.py rpc --requests 500 --depth 8
+#
+#          starts a local server unless --socket names a running one.
+#
+#   abilities
+#          Cost of the ability modifier updates of a 40-level character:
+#          the lookup table against the scoretable built on every call.
+#
+#   feats  Draws saved by picking feats from the eligible set instead of
+#          drawing and checking prerequisites until one qualifies.
+#
+#   increases
+#          Checks that the ability increase decision lists decide as the
+#          former rule passes for every score of each ability and every
+#          combination of the score codes the former rules tell apart,
+#          then times batches of epic characters with both. With
+#          --exhaustive every combination of score codes is checked,
+#          which takes about an hour for all classes.
+#
+# #####################################################################
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def report(name, latencies, elapsed):
+    print('%-10s n=%i  p50 %.2f ms  p99 %.2f ms  max %.2f ms  %.0f req/s'
+          % (name, len(latencies), percentile(latencies, 50) * 1000,
+             percentile(latencies, 99) * 1000, max(latencies) * 1000,
+             len(latencies) / elapsed))
+
+def rpc_round_trips(client, method, params, requests, depth, seeds):
+    """ Send ´requests´ requests keeping ´depth´ of them in flight and
+    return the latency of each. Every request has a new seed from
+    ´seeds´, thus none is answered from the cache of the server """
+    sent = {}
+    latencies = []
+    while len(latencies) < requests:
+        while len(sent) < depth and len(latencies) + len(sent) < requests:
+            id = client.send(method, seed=next(seeds), **params)
+            sent[id] = time.time()
+        response = client.receive()
+        latencies.append(time.time() - sent.pop(response['id']))
+        if 'error' in response:
+            raise ValueError(response['error']['message'])
+    return latencies
+
+def bench_rpc(args):
+    tmp = None
+    server = None
+    path = args.socket
+    if path is None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'dnd35.sock')
+        server = service.RPCServer(path, args.jobs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+    try:
+        client = service.RPCClient(path)
+        params = {'spec': {'level_type': args.level_type}}
+        if args.method == 'generate_batch':
+            params['count'] = args.count
+        seeds = itertools.count()
+        # Warm up the workers
+        rpc_round_trips(client, args.method, params, args.jobs * 2, 1, seeds)
+        for depth in sorted(set([1, args.depth])):
+            start = time.time()
+            latencies = rpc_round_trips(client, args.method, params,
+                                        args.requests, depth, seeds)
+            report('depth %i' % depth, latencies, time.time() - start)
+        client.close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(tmp)
+
+def legacy_ability_mods(npc):
+    """ Ability modifier update before dnd.ability_modifiers """
+    scoretable = dict()
+    sco = 0
+    min_mod = -5
+    while sco < 50:
+        if sco in range(1, 51, 2): min_mod += 1
+        sco += 1
+        scoretable[sco] = min_mod
+    for key in npc.abilities:
+        npc.ability_mods[key] = scoretable[npc.abilities[key]]
+
+def bench_abilities(args):
+    # Scores of a finished demi-god
+    seed = 0
+    while True:
+        npc = generator.build_npc({'level_type': 'demi-god'}, seed)
+        if sum(npc.level) == 40:
+            break
+        seed += 1
+    builder = generator.NPCBuilder(npc)
+    builder.current_level = 40
+    for key in npc.abilities:
+        assert dnd.ability_modifiers[npc.abilities[key]]\
+            == npc.ability_mods[key]
+
+    old = min(timeit.repeat(lambda: legacy_ability_mods(npc),
+                            number=args.number, repeat=3)) / args.number
+    new = min(timeit.repeat(builder.update_ability_mods,
+                            number=args.number, repeat=3)) / args.number
+    # Updates per level: three before, two now
+    print('per update   scoretable %.2f us  table %.2f us'
+          % (old * 1e6, new * 1e6))
+    print('per level    scoretable %.2f us  table %.2f us'
+          % (3 * old * 1e6, 2 * new * 1e6))
+    print('40 levels    scoretable %.1f us  table %.1f us  (%.0fx)'
+          % (120 * old * 1e6, 80 * new * 1e6, 3 * old / (2 * new)))
+
+def bench_feats(args):
+    for level_type in args.level_types:
+        spec = generator.make_spec({'level_type': level_type})
+        avoided = 0.0
+        start = time.time()
+        for seed in range(args.count):
+            builder = generator.NPCBuilder(rng=seed)
+            generator.UIBuilder(False, False, builder.npc, builder.rng,
+                                spec).generate_menu()
+            builder.generate()
+            avoided += builder.eligible_feats.retries_avoided
+        elapsed = time.time() - start
+        print('%-10s n=%i  retries avoided %.1f per character  %.2f ms '
+              'per character' % (level_type, args.count, avoided / args.count,
+                                 elapsed / args.count * 1000))
+
+class LegacyBuilder(generator.NPCBuilder):
+
+    def check_ability_increase(self, level, active_class):
+        """ Ability increases before dnd.ability_increase """
+        legacy_ability_increase(self.npc, active_class, self.rng)
+
+def legacy_ability_increase(npc, active_class, rng):
+    primary_abilities = dnd.class_specs[active_class]\
+                        ['ability_priorization'][0:3]
+    all_abilities = dnd.class_specs[active_class]\
+                    ['ability_priorization'][0:6]
+
+    irrelevant = npc.priority_order[-2:]
+    stat_increased = False
+    if not stat_increased:
+        for key in all_abilities:
+            if npc.abilities[key] < 8 and key not in irrelevant\
+            and key not in ['cha', 'wis', 'dex']:
+                npc.abilities[key] += 1
+                stat_increased = True
+                break
+    if not stat_increased:
+        if active_class in dnd.classes['spellcaster']\
+            and npc.abilities[primary_abilities[0]] < 19:
+            npc.abilities[primary_abilities[0]] += 1
+            stat_increased = True
+        elif active_class in ['bard', 'adept']\
+            and npc.abilities[primary_abilities[0]] < 16:
+            npc.abilities[primary_abilities[0]] += 1
+            stat_increased = True
+    if not stat_increased:
+        for key in primary_abilities:
+            if npc.abilities[key] in range(1,11,2)\
+            and key not in irrelevant:
+                npc.abilities[key] += 1
+                stat_increased = True
+                break
+    if not stat_increased:
+        for key in all_abilities:
+            if npc.abilities[key] in [9]:
+                npc.abilities[key] += 1
+                stat_increased = True
+                break
+    if not stat_increased:
+        for key in primary_abilities:
+            if npc.abilities[key] in sorted(range(11,41,2),
+                                               reverse=True):
+                npc.abilities[key] += 1
+                stat_increased = True
+                break
+    if not stat_increased:
+        for key in primary_abilities:
+            if npc.abilities[key] < 16\
+            and active_class not in dnd.classes['armor_user']\
+            and key != 'dex':
+                npc.abilities[key] += 1
+                stat_increased = True
+                break
+    if not stat_increased:
+        # The caster test compares the ability name with 19, which never
+        # holds, thus the primary ability is always chosen at random
+        for c in npc.Class:
+            caster_primary = dnd.class_specs[c]['ability_priorization'][0]
+            if c in dnd.classes['spellcaster']\
+            and caster_primary < 19:
+                npc.abilities[caster_primary] += 1
+                break
+        else:
+            npc.abilities[rng.choice(primary_abilities[0:2])] += 1
+
+class RecordingRandom(object):
+    """ Remembers what it was asked to choose from """
+    def __init__(self):
+        self.choices = None
+
+    def choice(self, seq):
+        self.choices = tuple(seq)
+        return seq[0]
+
+def check_decision(npc, char_class, irrelevant, order, scores):
+    """ Compare dnd.ability_increase with the former rules for the
+    ability ´scores´ in the order of the class """
+    abilities = dict(zip(order, scores))
+    npc.abilities = dict(abilities)
+    rng = RecordingRandom()
+    legacy_ability_increase(npc, char_class, rng)
+    decision = dnd.ability_increase(char_class, irrelevant, abilities)
+    if decision is None:
+        expected = rng.choices == tuple(order[0:2])
+    else:
+        abilities[decision] += 1
+        expected = rng.choices is None and abilities == npc.abilities
+    if not expected:
+        raise AssertionError('%s %s %s: decided %s' % (
+            char_class, irrelevant, tuple(scores), decision))
+
+# Lowest and highest score of each score code
+code_bounds = [(dnd.ability_score_codes.index(code),
+                len(dnd.ability_score_codes) - 1
+                - dnd.ability_score_codes[::-1].index(code))
+               for code in range(len(dnd.score_test_results))]
+
+def check_ability_increases(char_class, irrelevant, exhaustive=False):
+    """ Compare dnd.ability_increase with the former rules. Every score
+    0-99 of each ability is checked with the other scores at 10, which
+    checks the score codes. Then every combination of the score codes of
+    the three primary abilities is checked with the score classes the
+    former rules tell apart in the other abilities (below 8, 9, other),
+    or with all their codes if ´exhaustive´. Each code is tried at its
+    lowest and highest score in turn. Returns the number of decisions """
+    order = dnd.class_specs[char_class]['ability_priorization'][0:6]
+    npc = dnd.Character()
+    npc.Class = [char_class]
+    npc.priority_order = list(order[0:4]) + list(irrelevant)
+    n = 0
+    for i in range(len(order)):
+        for score in range(len(dnd.ability_score_codes)):
+            scores = [10] * len(order)
+            scores[i] = score
+            check_decision(npc, char_class, irrelevant, order, scores)
+            n += 1
+
+    codes = range(len(dnd.score_test_results))
+    if exhaustive:
+        other_classes = [[code] for code in codes]
+    else:
+        below_8 = dnd.passing_codes[dnd.BELOW_8]
+        nine = dnd.passing_codes[dnd.NINE]
+        other_classes = [sorted(below_8), sorted(nine),
+                         [code for code in codes
+                          if code not in below_8 | nine]]
+    for combination in itertools.product(codes, codes, codes, other_classes,
+                                         other_classes, other_classes):
+        # Take turns with the codes of a class and with the bounds
+        scores = [code_bounds[code if i < 3
+                              else code[n % len(code)]][(n + i) % 2]
+                  for i, code in enumerate(combination)]
+        check_decision(npc, char_class, irrelevant, order, scores)
+        n += 1
+    return n
+
+def build_with(builder_class, spec, seed):
+    builder = builder_class(rng=seed)
+    generator.UIBuilder(False, False, builder.npc, builder.rng,
+                        spec).generate_menu()
+    return builder.generate()
+
+def bench_increases(args):
+    if not args.no_check:
+        # Every decision list
+        cases = [case for case in sorted(dnd.ability_increase_rule_lists)
+                 if not args.classes or case[0] in args.classes]
+        start = time.time()
+        n = 0
+        for char_class, irrelevant in cases:
+            n += check_ability_increases(char_class, irrelevant,
+                                         args.exhaustive)
+        print('decisions identical for %i score combinations (%.0f s)'
+              % (n, time.time() - start))
+
+    # Single decisions on the scores of a finished demi-god
+    npc = generator.build_npc({'level_type': 'demi-god'}, 0)
+    builder = generator.NPCBuilder(npc, 0)
+    scores = dict(npc.abilities)
+    active_class = npc.Class[-1]
+    def rules():
+        npc.abilities = dict(scores)
+        legacy_ability_increase(npc, active_class, builder.rng)
+    def table():
+        npc.abilities = dict(scores)
+        builder.check_ability_increase(40, active_class)
+    number = 20000
+    old = min(timeit.repeat(rules, number=number, repeat=3)) / number
+    new = min(timeit.repeat(table, number=number, repeat=3)) / number
+    print('per increase  rules %.2f us  table %.2f us' % (old * 1e6,
+                                                          new * 1e6))
+
+    for level_type in args.level_types:
+        spec = generator.make_spec({'level_type': level_type})
+        times = {}
+        for name, builder_class in (('rules', LegacyBuilder),
+                                    ('table', generator.NPCBuilder)):
+            start = time.time()
+            npcs = [build_with(builder_class, spec, seed)
+                    for seed in range(args.count)]
+            times[name] = time.time() - start
+            sheets = [generator.render_sheet(npc) for npc in npcs]
+            if name == 'rules':
+                expected = sheets
+            elif sheets != expected:
+                raise AssertionError('%s characters differ' % level_type)
+        print('%-10s n=%i  rules %.2f ms  table %.2f ms per character'
+              % (level_type, args.count,
+                 times['rules'] / args.count * 1000,
+                 times['table'] / args.count * 1000))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='D&D 3.5 NPC generator '
+                                                 'benchmarks')
+    commands = parser.add_subparsers()
+
+    rpc = commands.add_parser('rpc', help='JSON-RPC round-trip latency')
+    rpc.add_argument('--socket', help='Unix socket of a running server '
+                                      '(default: start one)')
+    rpc.add_argument('--jobs', type=int, default=2,
+                     help='workers of the started server (default 2)')
+    rpc.add_argument('--method', default='generate',
+                     choices=sorted(service.rpc_methods))
+    rpc.add_argument('--count', type=int, default=4,
+                     help='characters per generate_batch call')
+    rpc.add_argument('--level-type', default='random')
+    rpc.add_argument('--requests', type=int, default=200)
+    rpc.add_argument('--depth', type=int, default=8,
+                     help='requests in flight when pipelining')
+    rpc.set_defaults(run=bench_rpc)
+
+    abilities = commands.add_parser('abilities',
+                                    help='ability modifier updates')
+    abilities.add_argument('--number', type=int, default=20000)
+    abilities.set_defaults(run=bench_abilities)
+
+    feats = commands.add_parser('feats', help='feat eligibility')
+    feats.add_argument('--count', type=int, default=500)
+    feats.add_argument('level_types', nargs='*',
+                       default=['novice', 'epic', 'demi-god'])
+    feats.set_defaults(run=bench_feats)
+
+    increases = commands.add_parser('increases',
+                                    help='ability increase decisions')
+    increases.add_argument('--count', type=int, default=300)
+    increases.add_argument('--no-check', action='store_true',
+                           help='only time the batches')
+    increases.add_argument('--exhaustive', action='store_true',
+                           help='check every combination of score codes '
+                                '(about an hour for all classes)')
+    increases.add_argument('--classes', nargs='+', metavar='CLASS',
+                           help='check only these classes')
+    increases.add_argument('level_types', nargs='*',
+                           default=['epic', 'demi-god'])
+    increases.set_defaults(run=bench_increases)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import cPickle as pickle
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+import dnd35_defs as dnd
+import html_template as html_sheet
+
+# owwww|====================> Result caches <=====================|wwwwo
+#
+#   A character is a pure function of its specification, seed and the
+#   rules, thus finished characters can be stored and handed out again
+#   instead of being rebuilt.
+#
+# #####################################################################
+
+class CharacterCache(object):
+    """ Bounded LRU cache of finished characters, or of any picklable
+    results derived from them. Values are stored as compressed pickles,
+    and every get returns a fresh copy, thus callers may modify what
+    they receive. The least recently used entries are evicted when
+    either ´max_entries´ or ´max_bytes´ (size of the stored snapshots)
+    is exceeded """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            snapshot = self.entries.pop(key, None)
+            if snapshot is None:
+                self.misses += 1
+                return default
+            self.entries[key] = snapshot
+            self.hits += 1
+        return pickle.loads(zlib.decompress(snapshot))
+
+    def put(self, key, value):
+        snapshot = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                                 1)
+        if len(snapshot) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = snapshot
+            self.size += len(snapshot)
+            self.evict(self.max_entries, self.max_bytes)
+
+    def trim(self, max_entries=0, max_bytes=None):
+        """ Evict least recently used entries down to the given limits,
+        e.g. to free memory. Without arguments the cache is emptied """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        with self.lock:
+            self.evict(max_entries, max_bytes)
+
+    def evict(self, max_entries, max_bytes):
+        # Called with the lock held
+        while self.entries and (len(self.entries) > max_entries
+                                or self.size > max_bytes):
+            key, snapshot = self.entries.popitem(last=False)
+            self.size -= len(snapshot)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
+
+class SheetCache(object):
+    """ Directory of rendered character sheets, addressed by a hash of
+    everything a sheet depends on. Files are written under temporary
+    names and renamed into place, thus readers (also other processes)
+    never see partial sheets. When the sheets exceed ´max_bytes´, the
+    least recently used ones are deleted.
+
+    The size of the stored sheets is summed up once and kept running.
+    A cache sent to a worker process arrives there as the worker's own
+    cache of the directory (see shared_sheet_cache), thus every task of
+    the worker shares it and its running size """
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None
+
+    def __reduce__(self):
+        return shared_sheet_cache, (self.directory, self.max_bytes)
+
+    @staticmethod
+    def key(spec, seed):
+        """ Key of the sheet of the complete specification ´spec´ and
+        ´seed´ """
+        data = json.dumps([sorted(spec.items()), seed, dnd.RULES_VERSION,
+                           html_sheet.TEMPLATE_VERSION,
+                           html_sheet.HIDE_CALCULATED])
+        return hashlib.sha1(data).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.html')
+
+    def get(self, key):
+        """ Return the sheet of ´key´, or None if it is not stored """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                sheet = f.read()
+            # Modification times order the sheets for pruning
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return sheet
+
+    def put(self, key, sheet):
+        path = self.path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(sheet)
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+        if self.size is None:
+            self.size = sum(size for mtime, size, path in self.files())
+        else:
+            self.size += len(sheet) - replaced
+        if self.size > self.max_bytes:
+            # Prune below the cap to avoid pruning on every put
+            self.prune(self.max_bytes * 9 // 10)
+
+    def files(self):
+        """ Return (mtime, size, path) of each stored sheet """
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.html'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def prune(self, max_bytes=None):
+        """ Delete least recently used sheets until at most ´max_bytes´
+        (default: the cap) remain """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        files = sorted(self.files())
+        self.size = sum(size for mtime, size, path in files)
+        for mtime, size, path in files:
+            if self.size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+
+# Sheet caches of this process by (directory, max_bytes)
+shared_sheet_caches = {}
+
+def shared_sheet_cache(directory, max_bytes):
+    """ Return the SheetCache of ´directory´ of this process, created on
+    first use. Unpickled sheet caches are these """
+    key = (os.path.abspath(directory), max_bytes)
+    cache = shared_sheet_caches.get(key)
+    if cache is None:
+        cache = shared_sheet_caches[key] = SheetCache(directory, max_bytes)
+    return cache
@@ -7,8 +7,12 @@ Dungeons & Dragons 3.5 character creation rules
 
 """
 
+import array
+import collections
 import re
 import random
+import hashlib
+import json
 
 """ ===================================================================
  HOW TO ADD NEW RACES =================================================
@@ -21,6 +25,7 @@ been implemented with their bonuses.
 ´race_specs´
   Add new key (race's name) and fullfill all required field. Remember
   to add racial bonuses defined in ´racename_bonuses´ subdictionaries.
+  Bonuses left out default to ´racial_bonus_defaults´.
 
 ´races´
    Add new race under key ´any´. You may also build new subdictionaries
@@ -72,6 +77,7 @@ class Character(object):
         abs = {'str': 0, 'dex': 0, 'con': 0, 'wis': 0, 'int': 0, 'cha': 0}
 
         self.name = str()
+        self.seed = None
         self.gender = str()
         self.age = 0
         self.age_type = str()
@@ -94,6 +100,8 @@ class Character(object):
         self.class_feats = dict()
         self.race_feats = dict()
         self.feats = dict()
+        # Keep track on epic feats that can be taken multiple times
+        self.epic_counter = dict()
         self.spell_penetration = 0
 
         self.Class = list()
@@ -186,15 +194,59 @@ class Character(object):
         self.charisma_to_saves = False
         self.wisdom_to_ac = False
 
+# Read-only rules tables ==============================================
+class FrozenDict(dict):
+    """ Dictionary that refuses modification. Used for the shared rules
+    tables so that a character can never change them for the others """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('rules tables are read-only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def freeze(table):
+    """ Recursively convert dicts into FrozenDicts and lists into tuples """
+    if isinstance(table, dict):
+        return FrozenDict((k, freeze(v)) for k, v in table.items())
+    if isinstance(table, (list, tuple)):
+        return tuple(freeze(v) for v in table)
+    return table
+
 # Define D&D dice rolling rules =======================================
-def roll_dice(dice, times, dice_mod, total_mod, ignore_lowest, *args):
+def get_rng(seed=None):
+    """ Return a random generator for ´seed´. A random.Random instance
+    is used as is, anything else (None, int, str) seeds a new one """
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+def random_seed():
+    """ Draw a new batch seed from the system's random source """
+    return random.SystemRandom().randint(0, 2**32 - 1)
+
+def derive_seed(batch_seed, index):
+    """ Counter-based seed for the ´index´th character of a batch.
+    Seeds are derived by hashing (batch_seed, index), so any batch member
+    can be regenerated without generating the characters before it """
+    digest = hashlib.sha256('%s:%i' % (batch_seed, index)).hexdigest()
+    return int(digest[:16], 16)
+
+def roll_dice(dice, times, dice_mod, total_mod, ignore_lowest, *args,
+              **kwargs):
     """ D&D dice roller
     ´dice´          dice type, e.g. d4, d6, d10
     ´times´         how many times dice will be rolled
     ´total_mod´     modifier applied to total score, e.g. 4d6+4
     ´dice_mod´      modifier applied to each roll (e.g. 1d8+1 x 4)
     ´ignore_lowest´ if multiple rolled, ignore lowest n rolls
-    *args            may take input as a list too"""
+    *args            may take input as a list too
+    ´rng´           (keyword) random generator used for the rolls,
+                    defaults to the global random module"""
+    rng = kwargs.get('rng', random)
 
     # If *args is given as a well-formed list, override variables
     if args:
@@ -220,7 +272,7 @@ def roll_dice(dice, times, dice_mod, total_mod, ignore_lowest, *args):
         return 0
     else:
         while j < times:
-            rolls.append(random.randint(1, dice) + dice_mod)
+            rolls.append(rng.randint(1, dice) + dice_mod)
             j += 1
         rolls.sort()
 
@@ -372,8 +424,13 @@ power_types = {'weaker': {'ability_roll': [dice['d8'], 2, 1, 0, 0],
 #   C_spells_per_day        default spell level progression for class C
 #   spells_per_day          number of spells character can cast per day
 #
+#   ability_modifiers       ability modifier of each ability score. Scores
+#                           stay far below 100 even for demi-gods.
+#
 # =======================================================================
 
+ability_modifiers = tuple((score - 10) // 2 for score in range(100))
+
 BAB_tables = {
     'high': [1]*20,
     'medium': [0, 1, 1, 1]*5,
@@ -1221,14 +1278,11 @@ skills = {
     'Use Magic Device': ['xCxxxxxxCxx', False, 'cha', 0],
     'Use Rope': ['xxxxxxxCCxx', True, 'dex', 0]}
 
-# Define dictionary for storing skill points on character creation
 # Define list of skills that can be used untrained
 untrained = []
-skill_point_dict = {}
 for key in skills.keys():
     if skills[key][1]:
         untrained.append(key)
-    skill_point_dict[key] = {'ranks': 0, 'ability_mod': 0, 'misc_mod': 0}
 
 # Group skills to ease class skill listing
 knowledge = []
@@ -1277,1025 +1331,1492 @@ for key in override.keys():
             print('Warning: Unknown skill "%s" at \'override[%s]\'!'\
                     % (skill, key))
 
+# Skill IDs and class skill draws ========================================
+#
+#   skill_names             skill of each skill ID, in the order of the
+#                           generated class skill lists
+#   skill_ids               skill ID of each skill
+#
+#   class_skill_choices() merges the racial class skills into the class
+#   skills of each (class, race) pair once.
+#
+# =========================================================================
 
-# Define class special features ===========================================
+skill_names = tuple(skills.keys())
+skill_ids = dict((skill, i) for i, skill in enumerate(skill_names))
+
+class_skill_choice_table = {}
+
+def class_skill_choices(char_class, race):
+    """ Return the skill IDs level ups of ´char_class´ played by ´race´
+    draw skills from: the class skills followed by the racial ones. A
+    racial class skill that is also a class skill appears twice, thus
+    is drawn more often """
+    choices = class_skill_choice_table.get((char_class, race))
+    if choices is None:
+        names = list(class_skills[char_class])\
+            + list(racial_bonuses[race].class_skills)
+        choices = tuple(skill_ids[skill] for skill in names)
+        class_skill_choice_table[(char_class, race)] = choices
+    return choices
+
+# Skill point tables ======================================================
 #
-# Most data automatically extracted from D&D wiki. Contains only text.
-# Does not affect modifiers etc. (to do later)
+#   Ranks, ability modifiers and misc modifiers of all skills are kept in
+#   three short integer arrays indexed by skill ID. Indexing a table by
+#   skill name gives a view that reads and writes like the former
+#   {'ranks': 0, 'ability_mod': 0, 'misc_mod': 0} dicts, e.g.
+#
+#       npc.total_skill_points['Survival']['misc_mod'] += 2
 #
 # =========================================================================
 
-def special_abs(npc, act_class, active_class_level, act_max_lvl):
-
-    des = {
-    "Uncanny Dodge": "Retains DEX bonus if caught Flat-footed",
-    "Imp. Uncanny Dodge": "Cannot be flanked"}
-
-    # Stacking or partially stacking feats are defined as functions
-    # If only higher applies, they can be represented as a key:value pair
-    def fast_movement():
-        npc.speed_bonus += 10
-        npc.class_feats['Fast Movement'] = "(+10ft)"
-
-    def speed_bonus():
-        npc.unarmored_speed_bonus += 10
-        npc.class_feats['Unarmored Speed Bonus'] = "(%s)"\
-                                        % str(npc.unarmored_speed_bonus)
-
-    def trap_sense():
-        npc.save_special_bonuses['ref']['vs. traps'] += 1
-        npc.ac_special_bonuses['dodge']['vs. traps'] += 1
-        npc.class_feats['Trap Sense'] = "(+%s)" \
-                        % str(npc.save_special_bonuses['ref']['vs. traps'])
-
-    def true_damage_reduction():
-        npc.damage_reduction['-'] += 1
-        dr = "(%s/-)" % str(npc.damage_reduction['-'])
-        npc.class_feats['Damage Reduction'] = dr
-
-    def indomitable_will():
-        npc.save_special_bonuses['will']['vs. ench.'] += 4
-        npc.class_feats['Indomitable Will'] = "(+%s)" \
-                    % str(npc.save_special_bonuses['will']['vs. ench.'])
-
-    def nature_sense():
-        npc.total_skill_points['Knowledge (nature)']['misc_mod'] += 2
-        npc.total_skill_points['Survival']['misc_mod'] += 2
-        npc.class_feats['Nature Sense'] = "(+2 nature checks)"
-
-    def resist_natures_lure():
-        npc.save_special_bonuses['general']['vs. Fey'] += 4
-        npc.class_feats["Resist Nature's Lure"] = "(+%s)" \
-                        % str(npc.save_special_bonuses['general']['vs. Fey'])
-
-    def still_mind():
-        npc.save_special_bonuses['will']['vs. ench.'] += 2
-        npc.class_feats['Still Mind'] = "(+%s)" \
-            % str(npc.save_special_bonuses['will']['vs. ench.'])
-
-    def diamond_soul():
-        if act_max_lvl+10 >= npc.spell_resistance:
-            npc.spell_resistance += act_max_lvl+10
-            npc.class_feats['Diamond Soul'] = "(SR +%s)" %str(act_max_lvl+10)
-        else:
-            pass
+skill_columns = ('ranks', 'ability_mod', 'misc_mod')
+skill_key_abilities = tuple(skills[skill][2] for skill in skill_names)
 
-    def perfect_self():
-        if npc.damage_reduction['magic'] <= 10:
-            npc.damage_reduction['magic'] = 10
-        else:
-            pass
-
-        dr = "%s/magic" % str(npc.damage_reduction['magic'])
-        npc.class_feats['Perfect Self'] = "Considered extraplanar, DR %s" %dr
-        npc.race_type = "Outsider (Extraplanar)"
-
-    def sneak_attack():
-        npc.sneak_attack += 1
-
-    def monk_ac_bonus():
-        npc.ac_unarmored_bonus += 1
-        npc.class_feats['Monk AC bonus'] = "(+%s)" % str(npc.ac_unarmored_bonus)
-
-    def divine_grace():
-        npc.charisma_to_saves = True
-        npc.class_feats['Divine Grace'] = "(CHA modifier to saving throws)"
-
-    def aura_of_courage():
-        npc.save_special_bonuses['general']['vs. fear'] += 4
-        npc.class_feats["Aura of Courage"] = "(saves +%s vs. fear 10ft radius)"\
-                        % str(npc.save_special_bonuses['general']['vs. fear'])
-
-    def favored_enemy():
-        favored_enemies =["Aberration", "Humanoid (reptilian)",
-                        "Animal", "Magical beast",
-                        "Construct", "Monstrous humanoid",
-                        "Dragon", "Ooze",
-                        "Elemental", "Outsider (air)",
-                        "Fey", "Outsider (chaotic)",
-                        "Giant", "Outsider (earth)",
-                        "Outsider (evil)",
-                        "Dwarf", "Outsider (fire)",
-                        "Elf", "Outsider (good)",
-                        "Goblinoid", "Outsider (lawful)",
-                        "Gnoll", "Outsider (native)",
-                        "Gnome", "Outsider (water)",
-                        "Halfling", "Plant",
-                        "Human", "Undead",
-                        "Orc", "Vermin"]
-
-        possible = list(set(favored_enemies) - set(npc.favored_enemy))
-        npc.favored_enemy.append(random.choice(possible))
-
-    def moon_and_sun():
-        msg = "Can speak with any living creature"
-        npc.class_feats['Tongue of the Sun and Moon'] = msg
-        npc.languages = [msg]
-
-    def animal_companion():
-        npc.has_animal_companion = True
-        npc.animal_companion['level']\
-                += (act_max_lvl + 1) - active_class_level
-        npc.class_feats['Animal Companion']\
-                = 'level %i' % npc.animal_companion['level']
-
-    def summon_familiar():
-        npc.has_familiar = True
-        npc.familiar['level']\
-                += (act_max_lvl + 1) - active_class_level
-        npc.class_feats['Summon familiar']\
-                = 'level %i' % npc.familiar['level']
-
-    def turn_undead():
-        npc.turn_undead += (act_max_lvl + 1) - active_class_level
-        npc.class_feats['Turn undead'] = 'level %i' % npc.turn_undead
-
-    cleric = {
-        1: {"Turn undead": turn_undead}}
-
-    wizard = {
-        1: {"Summon familiar": summon_familiar,
-            "Scribe scroll": "Can create a scroll of any known spell"}}
-
-    barbarian = {
-        1:{"Fast Movement": fast_movement,
-            "Illiteracy": "Cannot read unless spends 2 points on a language",
-            "Rage": "+4 STR/CON, -2 AC, +2 WILL, +%i HP (1/day)" % (2*act_max_lvl)},
-        2:{"Uncanny Dodge": des['Uncanny Dodge']},
-        3:{"Trap Sense": trap_sense},
-        4:{"Rage": "+4 STR/CON, -2 AC, +2 WILL, +%i HP (2/day)" % (2*act_max_lvl)},
-        5:{"Imp. Uncanny Dodge": des['Imp. Uncanny Dodge']},
-        6:{"Trap Sense": trap_sense},
-        7:{"Damage Reduction (-)": true_damage_reduction},
-        8:{"Rage": "+4 STR/CON, -2 AC, +2 WILL, +%i HP (3/day)" % (2*act_max_lvl)},
-        9:{"Trap Sense": trap_sense},
-        10:{"Damage Reduction (-)": true_damage_reduction},
-        11:{"Rage": "Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (3/day)" % (2*act_max_lvl)},
-        12:{"Rage": "Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (4/day)" % (2*act_max_lvl), "Trap Sense": trap_sense},
-        13:{"Damage Reduction (-)": true_damage_reduction},
-        14:{"Indomitable Will": indomitable_will},
-        15:{"Trap Sense": trap_sense},
-        16:{"Damage Reduction (-)": true_damage_reduction,
-            "Rage": "Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (5/day)" % 2*act_max_lvl},
-        17:{"Rage": "Greater and tireless: +6 STR/CON, -2 AC, +3 WILL, +%i HP (5/day)" % (2*act_max_lvl)},
-        18:{"Trap Sense": trap_sense},
-        19:{"Damage Reduction (-)": true_damage_reduction},
-        20:{"Rage": "Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (6/day)" % (2*act_max_lvl)},
-        21:{"Trap Sense": trap_sense},
-        22:{"Damage Reduction (-)": true_damage_reduction},
-        24:{"Trap Sense": trap_sense,
-            "Rage": "Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (7/day)" % (2*act_max_lvl)},
-        25:{"Damage Reduction (-)": true_damage_reduction},
-        27:{"Trap Sense": trap_sense},
-        28:{"Damage Reduction (-)": true_damage_reduction,
-            "Rage": "Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (8/day)" % (2*act_max_lvl)},
-        30:{"Trap Sense": trap_sense},
-        31:{"Damage Reduction (-)": true_damage_reduction},
-        33:{"Trap Sense": trap_sense},
-        34:{"Rage": "Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (9/day)" % (2*act_max_lvl),
-            "Damage Reduction (-)": true_damage_reduction},
-        36:{"Trap Sense": trap_sense},
-        37:{"Damage Reduction (-)": true_damage_reduction},
-        38:{"Rage": "Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (10/day)" % (2*act_max_lvl)},
-        39:{"Trap Sense": trap_sense},
-        40:{"Damage Reduction (-)": true_damage_reduction}}
-
-    bard = {
-        1:{"Bardic Music": "May play music (%s per day)" % (act_max_lvl),
-           "Bardic Knowledge":
-                "May attempt lore checks to gain obscure information",
-           "Countersong": "Can use music or poetics to counter magical "\
-                                            "effects that depend on sound",
-           "Fascinate": "Can use music or poetics to cause one or "\
-                            "more creatures to become fascinated with him",
-           "Inspire Courage": "Gives allies +1 to saves and damage rolls"},
-        3:{"Inspire Competence": "+2 to ally skill checks"},
-        6:{"Suggestion": "Influence the actions of the target creature by "\
-                    "suggesting a course of activity (Perform vs. Will)"},
-        8:{"Inspire Courage": "Gives allies +2 to saves and damage rolls"},
-        9:{"Inspire Greatness": "Give allies +2d10 HP, +2 to attack rolls, "\
-                                "+1 fortitude save"},
-        12:{"Song of Freedom": "Free ally from enchantment "\
-                                "(perform for 1 minute)"},
-        14:{"Inspire Courage": "Gives allies +3 to saves and damage rolls"},
-        15:{"Inspire Heroics": "Gives allies +4 AC and +4 to saves"},
-        18:{"Mass Suggestion": "Influence masses of people"},
-        20:{"Inspire Courage": "Gives allies +4 to saves and damage rolls"},
-        26:{"Inspire Courage": "Gives allies +5 to saves and damage rolls"},
-        32:{"Inspire Courage": "Gives allies +6 to saves and damage rolls"},
-        38:{"Inspire Courage": "Gives allies +7 to saves and damage rolls"}}
-
-    druid = {
-        1: {"Animal Companion": animal_companion,
-            "Nature Sense": nature_sense,
-            "Wild Empathy": "Charm animals"},
-        2: {"Woodland Stride": "Move through natural obstacles"},
-        3: {"Trackless Step": "Leaves no trackable trails"},
-        4: {"Resist Nature's Lure": resist_natures_lure},
-        5: {"Wild Shape": "1/day (small, medium)"},
-        6: {"Wild Shape": "2/day (small, medium)"},
-        7: {"Wild Shape": "3/day (small, medium)"},
-        8: {"Wild Shape": "3/day (small, medium, large)"},
-        9: {"Venom Immunity" :"Immunity to all poisons"},
-        10: {"Wild Shape": "4/day (small, medium, large)"},
-        11: {"Wild Shape": "4/day (tiny, small, medium, large)"},
-        12: {"Wild Shape": "4/day (plant, tiny, small, medium, large)"},
-        13: {"A Thousand Faces": "Change appearance at will"},
-        14: {"Wild Shape": "5/day (plant, tiny, small, medium, large)"},
-        15: {"Timeless Body": "Does not age, does not receive aging penalties",
-            "Wild Shape": "5/day (plant, tiny, small, medium, large, huge)"},
-        16: {"Elemental Shape": "1/day (small, medium, large)"},
-        18: {"Wild Shape": "6/day (plant, tiny, small, medium, large, huge)",
-            "Elemental Shape": "2/day (small, medium, large)"},
-        20: {"Elemental Shape": "3/day (small, medium, large, huge)"},
-        22: {"Wild Shape": "7/day (plant, tiny, small, medium, large, huge)",
-                 "Elemental Shape": "4/day (small, medium, large, huge)"},
-        26: {"Wild Shape": "8/day (plant, tiny, small, medium, large, huge)",
-                 "Elemental Shape": "5/day (small, medium, large, huge)"},
-        30: {"Wild Shape": "infinite (plant, tiny, small, medium, large, huge)",
-                 "Elemental Shape": "infinite (small, medium, large, huge)"}}
-
-    fighter = {}
-
-    monk_dmg = {'medium': '1d4', 'small': '1d2', 'large': '1d6'}
-    if act_class == 'monk':
-        if act_max_lvl in [1, 2, 3]:
-            monk_dmg = {'medium': '1d6', 'small': '1d4', 'large': '1d8'}
-        if act_max_lvl in [4, 5, 6, 7]:
-            monk_dmg = {'medium': '1d8', 'small': '1d6', 'large': '2d6'}
-        if act_max_lvl in [8, 9, 10, 11]:
-            monk_dmg = {'medium': '1d10', 'small': '1d8', 'large': '2d8'}
-        if act_max_lvl in [12, 13, 14, 15]:
-            monk_dmg = {'medium': '2d6', 'small': '1d10', 'large': '3d6'}
-        if act_max_lvl in [16, 17, 18, 19]:
-            monk_dmg = {'medium': '2d8', 'small': '2d6', 'large': '3d8'}
-        if act_max_lvl >= 20:
-            monk_dmg = {'medium': '2d10', 'small': '2d8', 'large': '4d8'}
-
-        npc.unarmed_damage = monk_dmg[npc.size]
+class SkillView(object):
 
-    if npc.unarmed_damage is None:
-        npc.unarmed_damage = monk_dmg[npc.size]
-
-    monk = {
-        1: {"Flurry of Blows": "If unarmored, gain one extra attack '\
-                                            'with highest BAB -2",
-            "Unarmed Strike": "Fists do %s damage" % monk_dmg[npc.size]},
-        2: {"Evasion": "No damage from successful REF saves '\
-                                            'that would halve damage"},
-        3: {"Still Mind": still_mind, "Unarmored Speed Bonus": speed_bonus},
-        4: {"Ki Strike": "Fists +1 magic weapons", "Slow Fall": "20 ft."},
-        5: {"Purity of Body": "Immunity to non-magical diseases",
-            'AC Bonus': monk_ac_bonus,
-            "Flurry of Blows":
-                "If unarmored, gain one extra attack with highest BAB -1",},
-        6: {"Slow Fall": "30 ft.", "Unarmored Speed Bonus": speed_bonus},
-        7: {"Wholeness of Body": "Heal %s HP per day" % (act_max_lvl*2)},
-        8: {"Slow Fall": "40 ft."},
-        9: {"Improved Evasion": "Take half damage from failed REF saves",
-            "Unarmored Speed Bonus": speed_bonus},
-        10: {"Ki Strike": "Fists +2 magic weapons", "Slow Fall": "50 ft.",
-            'AC Bonus': monk_ac_bonus},
-        11: {"Diamond Body": "Immunity to all poisons",
-            "Flurry of Blows":
-                "Greater: If unarmored, gain two extra attacks with highest BAB"},
-        12: {"Abundant Step":
-                "1/day (teleport %s ft.)" % str(400+(act_max_lvl*20)),
-            "Slow Fall": "60 ft.", "Unarmored Speed Bonus": speed_bonus},
-        13: {"Diamond Soul": diamond_soul},
-        14: {"Slow Fall": "70 ft."},
-        15: {"Quivering Palm": "",
-            'AC Bonus': monk_ac_bonus, "Unarmored Speed Bonus": speed_bonus},
-        16: {"Ki Strike": "Fists +3 magic weapons", "Slow Fall": "80 ft."},
-        17: {"Timeless Body": "Does not age",
-            "Tongue of the Sun and Moon": moon_and_sun},
-        18: {"Slow Fall": "90 ft.", "Unarmored Speed Bonus": speed_bonus},
-        19: {"Empty Body" : "Etherealness 1/day"},
-        20: {"Perfect Self": perfect_self,
-            "Slow Fall": "Any Distance",
-            'AC Bonus': monk_ac_bonus},
-        21: {"Unarmored Speed Bonus": speed_bonus},
-        24: {"Unarmored Speed Bonus": speed_bonus},
-        25: {'AC Bonus': monk_ac_bonus},
-        27: {"Unarmored Speed Bonus": speed_bonus},
-        30: {'AC Bonus': monk_ac_bonus, "Unarmored Speed Bonus": speed_bonus},
-        33: {"Unarmored Speed Bonus": speed_bonus},
-        35: {'AC Bonus': monk_ac_bonus},
-        36: {"Unarmored Speed Bonus": speed_bonus},
-        39: {"Unarmored Speed Bonus": speed_bonus},
-        40: {'AC Bonus': monk_ac_bonus}}
-
-    paladin = {
-        1: {"Aura of Good": "Detect presence of good (60 ft radius)",
-            "Detect Evil": "Detect evil at will (60 ft radius)",
-            "Smite Evil": "1/day"},
-        2: {"Divine Grace": divine_grace, "Lay on Hands": ""},
-        3: {"Aura of Courage": aura_of_courage,
-            "Divine Health": "Immunity to all types of diseases"},
-        4: {"Turn Undead": turn_undead},
-        5: {"Smite Evil": "2/day", "Special Mount": ""},
-        6: {"Remove Disease": "1/week"},
-        9: {"Remove Disease": "2/week"},
-        10: {"Smite Evil": "3/day"},
-        12: {"Remove Disease": "3/week"},
-        15: {"Remove Disease": "4/week", "Smite Evil": "4/day"},
-        18: {"Remove Disease": "5/week"},
-        20: {"Smite Evil": "5/day"},
-        21: {"Remove Disease": "6/week"},
-        24: {"Remove Disease": "7/week"},
-        25: {"Smite Evil": "6/day"},
-        27: {"Remove Disease": "8/week"},
-        30: {"Remove Disease": "9/week", "Smite Evil": "6/day"},
-        33: {"Remove Disease": "10/week"},
-        35: {"Smite Evil": "7/day"},
-        36: {"Remove Disease": "11/week"},
-        39: {"Remove Disease": "12/week"},
-        40: {"Smite Evil": "8/day"}}
-
-    ranger = {
-        1: {"Favored Enemy": favored_enemy,
-            "Track": "May track by using survival skill",
-            "Wild Empathy": "Charm animals"},
-        2: {"Combat Style": ""},
-        3: {"Endurance": "+4 to checks involving non-lethal"\
-                " damage holding-breath. May sleep in medium armor."},
-        4: {"Animal Companion": animal_companion},
-        5: {"Favored Enemy": favored_enemy},
-        6: {"Improved Combat Style": ""},
-        7: {"Woodland Stride": "Move through natural obstacles"},
-        8: {"Swift Tracker": "Can move normal speed while tracking"},
-        9: {"Evasion":
-            "On succesful REF save that would halve damage, takes no damage"},
-        10: {"Favored Enemy": favored_enemy},
-        11: {"Combat Style Mastery": ""},
-        13: {"Camouflage": "Can hide in any sort of natural terrain"},
-        15: {"Favored Enemy": favored_enemy},
-        17: {"Hide in Plain Sight":
-                "When in natural terrain, can use hide skill when observed"},
-        20: {"Favored Enemy": favored_enemy},
-        25: {"Favored Enemy": favored_enemy},
-        30: {"Favored Enemy": favored_enemy},
-        35: {"Favored Enemy": favored_enemy},
-        40: {"Favored Enemy": favored_enemy}}
-
-    rogue = {
-        1: {"Sneak Attack": sneak_attack,
-                "Trapfinding": "Can use search skill to locate traps"},
-        2: {"Evasion": "On succesful REF save that would '\
-                        'halve damage, takes no damage"},
-        3: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        4: {"Uncanny Dodge": des['Uncanny Dodge']},
-        5: {"Sneak Attack": sneak_attack},
-        6: {"Trap Sense": trap_sense},
-        7: {"Sneak Attack": sneak_attack},
-        8: {"Imp. Uncanny Dodge": des['Imp. Uncanny Dodge']},
-        9: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        10: {"Crippling Strike":
-            "Sneak attacks do 2 strength damage (heals 1 point per day)"},
-        11: {"Sneak Attack": sneak_attack},
-        12: {"Trap Sense": trap_sense},
-        13: {"Sneak Attack": sneak_attack, "Special Ability": ""},
-        15: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        16: {"Special Ability": ""},
-        17: {"Sneak Attack": sneak_attack},
-        18: {"Trap Sense": trap_sense},
-        19: {"Sneak Attack": sneak_attack, "Special Ability": ""},
-        21: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        23: {"Sneak Attack": sneak_attack},
-        24: {"Trap Sense": trap_sense},
-        25: {"Sneak Attack": sneak_attack},
-        27: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        29: {"Sneak Attack": sneak_attack},
-        30: {"Trap Sense": trap_sense},
-        31: {"Sneak Attack": sneak_attack},
-        33: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
-        35: {"Sneak Attack": sneak_attack},
-        36: {"Trap Sense": trap_sense},
-        37: {"Sneak Attack": sneak_attack},
-        39: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense}}
-
-    commoner = {}
-    expert = {}
-    adept = {2: {'Summon familiar': summon_familiar}}
-    aristocrat = {}
-    warrior = {}
-
-    class_special_feats = {
-        'barbarian': barbarian,
-        'cleric': cleric,
-        'wizard': wizard,
-        'sorcerer': wizard,
-        'bard': bard,
-        'druid': druid,
-        'fighter': fighter,
-        'monk': monk,
-        'paladin': paladin,
-        'ranger': ranger,
-        'rogue': rogue,
-        'aristocrat': aristocrat,
-        'expert': expert,
-        'adept': adept,
-        'commoner': commoner,
-        'warrior': warrior}
-
-    specials = class_special_feats[act_class]
-
-    if active_class_level in specials.keys():
-        level_abilities = specials[active_class_level]
-        for key in level_abilities.keys():
-            if isinstance(level_abilities[key], str):
-                # Append class feats as tuples (level, feat)
-                if key not in npc.class_feats.keys():
-                    npc.class_feats[key] = (act_max_lvl, level_abilities[key])
-                else:
-                    if isinstance(npc.class_feats[key], tuple):
-                        # Overwrite only if ability is higher level
-                        if act_max_lvl >= npc.class_feats[key][0]:
-                            npc.class_feats[key] = (act_max_lvl,
-                                                    level_abilities[key])
-                        else:
-                            pass
-            if hasattr(level_abilities[key], '__call__'):
-                level_abilities[key]()
-
-# =====================================================================
-""" Feats """
-# =====================================================================
+    __slots__ = ('table', 'id')
 
-# Keep track on epic feats that can be taken multiple times
-epic_counter = {}
+    def __init__(self, table, id):
+        self.table = table
+        self.id = id
 
-def add_feats(npc, act_cls, act_cls_lvl, act_cls_lvl_max, comb_level):
+    def __getitem__(self, column):
+        return getattr(self.table, column)[self.id]
 
-    # Temporary variables, fix later
-    npc.str = npc.abilities['str']
-    npc.con = npc.abilities['con']
-    npc.dex = npc.abilities['dex']
-    npc.wis = npc.abilities['wis']
-    npc.int = npc.abilities['int']
-    npc.cha = npc.abilities['cha']
-    npc.lvl = act_cls_lvl
+    def __setitem__(self, column, value):
+        getattr(self.table, column)[self.id] = value
 
-    def check_reqs(name, args, index):
-        """ Check if feat pre-requirements are met
-        Return True if requirements are ok or not specified """
-        if not args['reqs']:
-            return True
-        else:
-            for requirement in args['reqs'].keys():
-                val = args['reqs'][requirement]
-                if isinstance(val, int):
-                    if npc.__dict__[requirement] < val:
-                        return False
-                if isinstance(val, str):
-                    if val not in npc.__dict__[requirement].keys():
-                        return False
-            return True
-
-    def pre_req_feat(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+    def keys(self):
+        return list(skill_columns)
 
-        npc.feats[name] = args['descr']
-        return True
+    def __iter__(self):
+        return iter(skill_columns)
 
-    def improved_grapple(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+    def __repr__(self):
+        return repr(dict((column, self[column]) for column in skill_columns))
 
-        npc.feats[name] = args['descr']
-        npc.grapple += 4
-        return True
+class SkillTable(object):
+    """ Skill points of every skill, indexed by skill name """
 
-    def count_epic(name, descr):
-        if name not in epic_counter.keys():
-            epic_counter[name] = 1
-        else:
-            epic_counter[name] += 1
+    def __init__(self):
+        for column in skill_columns:
+            setattr(self, column, array.array('h', [0]) * len(skill_names))
 
-        ft_name = "%s (+%s)" % (name, str(epic_counter[name]))
-        npc.feats[ft_name] = descr
+    def __getitem__(self, skill):
+        return SkillView(self, skill_ids[skill])
 
-    def epic_armor_skin(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+    def __contains__(self, skill):
+        return skill in skill_ids
 
-        count_epic(name, args['descr'])
-        npc.ac_modifiers['natural'] += 1
-        return True
+    def __iter__(self):
+        return iter(skill_names)
 
-    def epic_toughness(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+    def __len__(self):
+        return len(skill_names)
 
-        count_epic(name, args['descr'])
-        npc.hp += 30
-        return True
+    def keys(self):
+        return list(skill_names)
 
-    def epic_polyglot(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+    def rows(self):
+        """ Return (skill, ranks, ability_mod, misc_mod) of each skill in
+        skill ID order """
+        return zip(skill_names, self.ranks, self.ability_mod, self.misc_mod)
 
-        npc.languages = ['Can speak all lanugages']
-        return True
+    def as_dict(self):
+        return dict((skill, {'ranks': ranks, 'ability_mod': ability_mod,
+                             'misc_mod': misc_mod})
+                    for skill, ranks, ability_mod, misc_mod in self.rows())
 
-    def epic_sneak_attack(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+def new_skill_points():
+    """ Allocate a fresh skill point table for storing skill points
+    on character creation """
+    return SkillTable()
 
-        count_epic(name, args['descr'])
-        npc.sneak_attack += 1
-        return True
 
-    def epic_ability(name, args, index):
-        """ Pump up ability scores on epic levels """
-        if not check_reqs(name, args, index):
-            return False
+# Freeze shared rules tables ==============================================
+#
+# Characters read these tables but must never modify them, otherwise
+# every following character in the same process would inherit the
+# changes. Per-character state is always allocated freshly.
+#
+# =========================================================================
 
-        abrs = {'str': 'Strength',
-                'dex': 'Dexterity',
-                'con': 'Constitution',
-                'wis': 'Wisdom',
-                'int': 'Intelligence',
-                'cha': 'Charisma'}
+sizes = freeze(sizes)
+race_specs = freeze(race_specs)
+class_specs = freeze(class_specs)
+skills = freeze(skills)
 
-        if npc.abilities[npc.priority_order[0]] > 30:
-            increase = npc.priority_order[1]
-        else:
-            increase = npc.priority_order[0]
+# Racial bonuses ==========================================================
+#
+#   racial_bonuses          bonuses of each race compiled from the
+#                           ´racename_bonuses´ dicts into a RacialBonuses
+#                           record with every field present
+#   racial_bonus_defaults   value of each field for races without it
+#
+# =========================================================================
 
-        count_epic("%s %s" % (name, abrs[increase]), args['descr'])
-        npc.abilities[increase] += 1
-        return True
+racial_bonus_defaults = freeze({
+    'racial_feat': {},
+    'vision': 'normal',
+    'skill_bonus': {},
+    'class_skills': [],
+    'saves': {'fort': 0, 'ref': 0, 'will': 0},
+    'special_save_bonus': {},
+    'armor': {},
+    'special_armor_bonus': {},
+    'grapple': 0,
+    'bab': 0,
+    'spell_resistance': 0,
+    'size_for_items': None,     # size of the race
+    'HD': (0, 0)})              # [HD, how many levels this is used]
+
+RacialBonuses = collections.namedtuple('RacialBonuses',
+                                       sorted(racial_bonus_defaults))
+
+def compile_racial_bonuses(race):
+    bonuses = race_specs[race].get('bonuses', {})
+    fields = dict(racial_bonus_defaults,
+                  size_for_items=race_specs[race]['size'])
+    for field in fields:
+        if field in bonuses:
+            fields[field] = bonuses[field]
+    return RacialBonuses(**fields)
+
+racial_bonuses = FrozenDict((race, compile_racial_bonuses(race))
+                            for race in race_specs)
+
+# Legal characters ========================================================
+#
+#   legal_characters        every (race, alignment, classes) breaking no
+#                           race, alignment or multi-class restriction;
+#                           ´classes´ is a tuple of one or two classes.
+#                           Sorted, thus draws from it are reproducible
+#
+# =========================================================================
 
-    def epic_dr(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
+def is_legal_character(race, alignment, char_classes):
+    if alignment in race_specs[race]['restricted_alignments']:
+        return False
+    for char_class in char_classes:
+        if alignment in class_specs[char_class]['restricted_alignments']:
             return False
-
-        count_epic(name, args['descr'])
-        npc.damage_reduction['-'] += 3
-        return True
-
-    def epic_initiative(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
+    if len(char_classes) == 2:
+        first, second = char_classes
+        if second == first or second in class_specs[first]['restricted_multi']:
             return False
+    return True
+
+legal_characters = tuple(sorted(
+    (race, alignment, char_classes)
+    for race in races['any']
+    for alignment in alignment_types['any']
+    for char_classes in [(first,) for first in class_specs]
+                        + [(first, second) for first in class_specs
+                                           for second in class_specs]
+    if is_legal_character(race, alignment, char_classes)))
+
+# Ability priorities ======================================================
+#
+#   priority_orders         order in which ability scores are assigned,
+#                           keyed by the (highest, lowest) level classes
+#                           of the character, (class, class) if it has one
+#   ability_adjustment_vectors
+#                           racial and aging adjustment of each ability,
+#                           keyed by (race, age type)
+#
+# =========================================================================
 
-        npc.initiative += 8
-        npc.feats[name] = args['descr']
-        return True
+def hybrid_priority_order(high_class, low_class):
+    """ Merge the priorization tables of two classes, taking abilities
+    alternately from the higher and the lower level class """
+    order = []
+    for pair in zip(class_specs[high_class]['ability_priorization'],
+                    class_specs[low_class]['ability_priorization']):
+        for ability in pair:
+            if ability not in order:
+                order.append(ability)
+    return tuple(order)
+
+priority_orders = FrozenDict(((high, low), hybrid_priority_order(high, low))
+                             for high in class_specs for low in class_specs)
+
+ability_adjustment_vectors = FrozenDict(
+    ((race, age_type),
+     FrozenDict((ability, race_specs[race]['ability_adjustments'][ability]
+                          + aging_modifiers[age_type][ability])
+                for ability in aging_modifiers[age_type]))
+    for race in race_specs for age_type in aging_modifiers)
+
+# Ability increases =======================================================
+#
+#   ability_score_tests     results of the tests the ability increase
+#                           rules make on a score, for each score 0-99
+#   ability_score_codes     code of each score; scores with the same code
+#                           pass the same tests
+#   ability_increase_rules()
+#                           increase rules of a class as a decision list
+#   ability_increase_rule_lists
+#                           decision lists of every class and pair of least
+#                           significant abilities a character can have,
+#                           compiled at import
+#   ability_increase()      ability to raise, decided by the decision list
+#                           from the score codes of the abilities
+#
+#   A table of every decision would hold a decision for each of the 9^6
+#   code combinations of each of the 432 decision lists, 230 million in
+#   all. The lists decide in about as much time as looking the decision
+#   up, and forked workers share them.
+#
+# =========================================================================
 
-    def epic_fast_healing(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+BELOW_8, ODD_BELOW_10, NINE, ODD_11_TO_39, BELOW_16, BELOW_19 = range(6)
+
+ability_score_tests = tuple((score < 8, score in range(1, 11, 2),
+                             score == 9, score in range(11, 41, 2),
+                             score < 16, score < 19)
+                            for score in range(100))
+score_test_results = sorted(set(ability_score_tests))
+ability_score_codes = tuple(score_test_results.index(tests)
+                            for tests in ability_score_tests)
+# Codes of the scores passing each test
+passing_codes = tuple(frozenset(code for code, tests
+                                in enumerate(score_test_results)
+                                if tests[test])
+                      for test in range(6))
+
+def ability_increase_rules(char_class, irrelevant):
+    """ Return the ability increase rules of ´char_class´ as a decision
+    list of (ability, codes): the first ability whose score code is in
+    its codes is raised. ´irrelevant´ are the two least significant
+    abilities of the character. If no rule applies, one of the two
+    primary abilities is raised at random.
+
+    The rules in order of priority:
+    1) Raise severely negative stats to 8 to overcome negative modifiers.
+        If CHA, WIS or DEX are irrelevant for the class, do not raise.
+    2) If caster, pump primary ability to 19 to unlock all spell levels.
+        Bards and Adepts pump primary to 16.
+    3) Raise odd primary abilities having negative modifiers.
+    4) Raise any ability score if 9 to overcome negative modifier,
+        ignore irrelevant stats.
+    5) raise odd positive primary abilities to improve modifiers
+    6) raise primary abilities if under 16. Exception being dexterity
+        if class is a heavy armor user. """
+    all_abilities = class_specs[char_class]['ability_priorization'][0:6]
+    primary_abilities = all_abilities[0:3]
+    rules = []
+    for ability in all_abilities:
+        if ability not in irrelevant and ability not in ['cha', 'wis', 'dex']:
+            rules.append((ability, passing_codes[BELOW_8]))
+    if char_class in classes['spellcaster']:
+        rules.append((primary_abilities[0], passing_codes[BELOW_19]))
+    elif char_class in ['bard', 'adept']:
+        rules.append((primary_abilities[0], passing_codes[BELOW_16]))
+    for ability in primary_abilities:
+        if ability not in irrelevant:
+            rules.append((ability, passing_codes[ODD_BELOW_10]))
+    for ability in all_abilities:
+        rules.append((ability, passing_codes[NINE]))
+    for ability in primary_abilities:
+        rules.append((ability, passing_codes[ODD_11_TO_39]))
+    if char_class not in classes['armor_user']:
+        for ability in primary_abilities:
+            if ability != 'dex':
+                rules.append((ability, passing_codes[BELOW_16]))
+
+    return tuple(rules)
+
+# Least significant abilities are the last two of a priority order. A
+# multi-class character of equal class levels takes the priority order
+# of its first class, thus any class may meet any pair
+least_significant_pairs = sorted(set(tuple(order[-2:])
+                                     for order in priority_orders.values()))
+ability_increase_rule_lists = FrozenDict(
+    ((char_class, irrelevant), ability_increase_rules(char_class, irrelevant))
+    for char_class in class_specs for irrelevant in least_significant_pairs)
+
+def ability_increase(char_class, irrelevant, abilities):
+    """ Return the ability a character of ´char_class´ with ability
+    scores ´abilities´ raises, or None if it raises one of its two
+    primary abilities at random. ´irrelevant´ is a tuple of its two
+    least significant abilities """
+    for ability, passing in ability_increase_rule_lists[(char_class,
+                                                         irrelevant)]:
+        if ability_score_codes[abilities[ability]] in passing:
+            return ability
+    return None
+
+# Cumulative progression tables ===========================================
+#
+#   bab_totals              base attack bonus of each class after n
+#                           levels (index n), levels 0-20
+#   save_totals             base saves of each class after n levels
+#   epic_bab_totals,        epic progression after n epic levels
+#   epic_save_totals
+#
+#   Epic progression applies to character levels 21-39.
+#
+# =========================================================================
 
-        npc.fast_healing += 3
-        npc.feats[name] = args['descr']
-        return True
+def cumulative(increases):
+    totals = [0]
+    for increase in increases:
+        totals.append(totals[-1] + increase)
+    return tuple(totals)
+
+bab_totals = dict((cls, cumulative(specs['bab']))
+                  for cls, specs in class_specs.items())
+save_totals = dict((cls, dict((save, cumulative(table)) for save, table
+                              in specs['saves'].items()))
+                   for cls, specs in class_specs.items())
+epic_bab_totals = cumulative(BAB_tables['epic'][:19])
+epic_save_totals = dict((save, cumulative(table[:19]))
+                        for save, table in save_tables['epic'].items())
+
+def progression(totals, epic_totals, classes, levels, level):
+    """ Sum of the cumulative ´totals´ of ´classes´ (one or two, with
+    class levels ´levels´) after character level ´level´. Multi-class
+    characters index the table of their second class by character
+    level, as the level up always has """
+    first = min(level, levels[0], 20)
+    total = totals[classes[0]][first]
+    if len(classes) > 1 and min(level, 20) > first:
+        second = totals[classes[1]]
+        total += second[min(level, 20)] - second[first]
+    if level > 20:
+        total += epic_totals[min(level, 39) - 20]
+    return total
+
+def base_attack_bonus(classes, levels, level=None):
+    """ Base attack bonus of a character of ´classes´ with class levels
+    ´levels´ after character level ´level´ (default: all levels) """
+    if level is None:
+        level = sum(levels)
+    return progression(bab_totals, epic_bab_totals, classes, levels, level)
+
+def base_saves(classes, levels, level=None):
+    """ Base saves of a character as in base_attack_bonus """
+    if level is None:
+        level = sum(levels)
+    return dict((save, progression(
+                    dict((cls, save_totals[cls][save]) for cls in classes),
+                    epic_save_totals[save], classes, levels, level))
+                for save in ('fort', 'ref', 'will'))
+
+# Rules version ===========================================================
+#
+# Characters built from the same specification and seed are identical as
+# long as the rules stay the same, thus the rules version is part of the
+# key of every stored or shared character. It changes automatically with
+# the rules tables; increase RULES_REVISION whenever a change in the code
+# changes the characters built.
+#
+# =========================================================================
 
-    def epic_skill_focus(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+RULES_REVISION = 4
 
-        ranked = []
-        for skill in npc.total_skill_points.keys():
-            if npc.total_skill_points[skill]['ranks'] > 10:
-                ranked.append(skill)
+def rules_version():
+    tables = [RULES_REVISION, sizes, race_specs, class_specs, skills,
+              class_skills, BAB_tables, save_tables, spells_known,
+              spells_per_day, aging_modifiers, power_types, level_types]
+    return hashlib.sha1(json.dumps(tables, sort_keys=True)).hexdigest()[:12]
 
-        if len(ranked) < 1:
-            return False
-        else:
-            increase = random.choice(ranked)
-            count_epic(name, "(Improved %s)" % increase)
-            npc.total_skill_points[increase]['misc_mod'] += 10
-            return True
-
-    def epic_energy_resistance(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+RULES_VERSION = rules_version()
 
-        count_epic(name, args['descr'])
-        type_ = random.choice(['fire', 'cold', 'acid'])
-        npc.damage_reduction[type_] += 10
-        return True
+# Define class special features ===========================================
+#
+# Most data automatically extracted from D&D wiki. Contains only text.
+# Does not affect modifiers etc. (to do later)
+#
+#   class_special_abilities     special abilities of each class by class
+#                               level. An ability is a description, a
+#                               LevelText or a function applying it
+#
+# =========================================================================
 
-    def wpn_focus(name, args, index):
-        """ Check feats with pre-requirements """
-        if not check_reqs(name, args, index):
-            return False
+class LevelText(object):
+    """ Description of a special ability that depends on the character,
+    e.g. on the maximum level of the class. ´fields´ are functions of
+    (npc, max_level) giving the values for ´template´; the text is
+    formatted only when the ability is granted """
+
+    def __init__(self, template, *fields):
+        self.template = template
+        self.fields = fields
+
+    def format(self, npc, max_level):
+        return self.template % tuple(field(npc, max_level)
+                                     for field in self.fields)
+
+def max_level(npc, max_level):
+    return max_level
+
+def double_max_level(npc, max_level):
+    return 2 * max_level
+
+def unarmed_damage(npc, max_level):
+    return npc.unarmed_damage
+
+def abundant_step_distance(npc, max_level):
+    return str(400 + max_level * 20)
+
+# Stacking or partially stacking abilities are defined as functions of
+# (npc, class_level, max_level, rng). If only higher applies, they can be
+# represented as descriptions
+def fast_movement(npc, level, max_level, rng):
+    npc.speed_bonus += 10
+    npc.class_feats['Fast Movement'] = "(+10ft)"
+
+def speed_bonus(npc, level, max_level, rng):
+    npc.unarmored_speed_bonus += 10
+    npc.class_feats['Unarmored Speed Bonus'] = "(%s)"\
+                                    % str(npc.unarmored_speed_bonus)
+
+def trap_sense(npc, level, max_level, rng):
+    npc.save_special_bonuses['ref']['vs. traps'] += 1
+    npc.ac_special_bonuses['dodge']['vs. traps'] += 1
+    npc.class_feats['Trap Sense'] = "(+%s)" \
+                    % str(npc.save_special_bonuses['ref']['vs. traps'])
+
+def true_damage_reduction(npc, level, max_level, rng):
+    npc.damage_reduction['-'] += 1
+    dr = "(%s/-)" % str(npc.damage_reduction['-'])
+    npc.class_feats['Damage Reduction'] = dr
+
+def indomitable_will(npc, level, max_level, rng):
+    npc.save_special_bonuses['will']['vs. ench.'] += 4
+    npc.class_feats['Indomitable Will'] = "(+%s)" \
+                % str(npc.save_special_bonuses['will']['vs. ench.'])
+
+def nature_sense(npc, level, max_level, rng):
+    npc.total_skill_points['Knowledge (nature)']['misc_mod'] += 2
+    npc.total_skill_points['Survival']['misc_mod'] += 2
+    npc.class_feats['Nature Sense'] = "(+2 nature checks)"
+
+def resist_natures_lure(npc, level, max_level, rng):
+    npc.save_special_bonuses['general']['vs. Fey'] += 4
+    npc.class_feats["Resist Nature's Lure"] = "(+%s)" \
+                    % str(npc.save_special_bonuses['general']['vs. Fey'])
+
+def still_mind(npc, level, max_level, rng):
+    npc.save_special_bonuses['will']['vs. ench.'] += 2
+    npc.class_feats['Still Mind'] = "(+%s)" \
+        % str(npc.save_special_bonuses['will']['vs. ench.'])
+
+def diamond_soul(npc, level, max_level, rng):
+    if max_level+10 >= npc.spell_resistance:
+        npc.spell_resistance += max_level+10
+        npc.class_feats['Diamond Soul'] = "(SR +%s)" %str(max_level+10)
+
+def perfect_self(npc, level, max_level, rng):
+    if npc.damage_reduction['magic'] <= 10:
+        npc.damage_reduction['magic'] = 10
+
+    dr = "%s/magic" % str(npc.damage_reduction['magic'])
+    npc.class_feats['Perfect Self'] = "Considered extraplanar, DR %s" %dr
+    npc.race_type = "Outsider (Extraplanar)"
+
+def sneak_attack(npc, level, max_level, rng):
+    npc.sneak_attack += 1
+
+def monk_ac_bonus(npc, level, max_level, rng):
+    npc.ac_unarmored_bonus += 1
+    npc.class_feats['Monk AC bonus'] = "(+%s)" % str(npc.ac_unarmored_bonus)
+
+def divine_grace(npc, level, max_level, rng):
+    npc.charisma_to_saves = True
+    npc.class_feats['Divine Grace'] = "(CHA modifier to saving throws)"
+
+def aura_of_courage(npc, level, max_level, rng):
+    npc.save_special_bonuses['general']['vs. fear'] += 4
+    npc.class_feats["Aura of Courage"] = "(saves +%s vs. fear 10ft radius)"\
+                    % str(npc.save_special_bonuses['general']['vs. fear'])
+
+favored_enemies = ["Aberration", "Humanoid (reptilian)",
+                   "Animal", "Magical beast",
+                   "Construct", "Monstrous humanoid",
+                   "Dragon", "Ooze",
+                   "Elemental", "Outsider (air)",
+                   "Fey", "Outsider (chaotic)",
+                   "Giant", "Outsider (earth)",
+                   "Outsider (evil)",
+                   "Dwarf", "Outsider (fire)",
+                   "Elf", "Outsider (good)",
+                   "Goblinoid", "Outsider (lawful)",
+                   "Gnoll", "Outsider (native)",
+                   "Gnome", "Outsider (water)",
+                   "Halfling", "Plant",
+                   "Human", "Undead",
+                   "Orc", "Vermin"]
+
+def favored_enemy(npc, level, max_level, rng):
+    possible = sorted(set(favored_enemies) - set(npc.favored_enemy))
+    npc.favored_enemy.append(rng.choice(possible))
+
+def moon_and_sun(npc, level, max_level, rng):
+    msg = "Can speak with any living creature"
+    npc.class_feats['Tongue of the Sun and Moon'] = msg
+    npc.languages = [msg]
+
+def animal_companion(npc, level, max_level, rng):
+    npc.has_animal_companion = True
+    npc.animal_companion['level'] += (max_level + 1) - level
+    npc.class_feats['Animal Companion']\
+            = 'level %i' % npc.animal_companion['level']
+
+def summon_familiar(npc, level, max_level, rng):
+    npc.has_familiar = True
+    npc.familiar['level'] += (max_level + 1) - level
+    npc.class_feats['Summon familiar'] = 'level %i' % npc.familiar['level']
+
+def turn_undead(npc, level, max_level, rng):
+    npc.turn_undead += (max_level + 1) - level
+    npc.class_feats['Turn undead'] = 'level %i' % npc.turn_undead
+
+uncanny_dodge = "Retains DEX bonus if caught Flat-footed"
+improved_uncanny_dodge = "Cannot be flanked"
+
+def rage(template):
+    return LevelText(template, double_max_level)
+
+cleric_specials = {
+    1: {"Turn undead": turn_undead}}
+
+wizard_specials = {
+    1: {"Summon familiar": summon_familiar,
+        "Scribe scroll": "Can create a scroll of any known spell"}}
+
+barbarian_specials = {
+    1:{"Fast Movement": fast_movement,
+        "Illiteracy": "Cannot read unless spends 2 points on a language",
+        "Rage": rage("+4 STR/CON, -2 AC, +2 WILL, +%i HP (1/day)")},
+    2:{"Uncanny Dodge": uncanny_dodge},
+    3:{"Trap Sense": trap_sense},
+    4:{"Rage": rage("+4 STR/CON, -2 AC, +2 WILL, +%i HP (2/day)")},
+    5:{"Imp. Uncanny Dodge": improved_uncanny_dodge},
+    6:{"Trap Sense": trap_sense},
+    7:{"Damage Reduction (-)": true_damage_reduction},
+    8:{"Rage": rage("+4 STR/CON, -2 AC, +2 WILL, +%i HP (3/day)")},
+    9:{"Trap Sense": trap_sense},
+    10:{"Damage Reduction (-)": true_damage_reduction},
+    11:{"Rage": rage("Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (3/day)")},
+    12:{"Rage": rage("Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (4/day)"), "Trap Sense": trap_sense},
+    13:{"Damage Reduction (-)": true_damage_reduction},
+    14:{"Indomitable Will": indomitable_will},
+    15:{"Trap Sense": trap_sense},
+    16:{"Damage Reduction (-)": true_damage_reduction,
+        "Rage": rage("Greater: +6 STR/CON, -2 AC, +3 WILL, +%i HP (5/day)")},
+    17:{"Rage": rage("Greater and tireless: +6 STR/CON, -2 AC, +3 WILL, +%i HP (5/day)")},
+    18:{"Trap Sense": trap_sense},
+    19:{"Damage Reduction (-)": true_damage_reduction},
+    20:{"Rage": rage("Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (6/day)")},
+    21:{"Trap Sense": trap_sense},
+    22:{"Damage Reduction (-)": true_damage_reduction},
+    24:{"Trap Sense": trap_sense,
+        "Rage": rage("Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (7/day)")},
+    25:{"Damage Reduction (-)": true_damage_reduction},
+    27:{"Trap Sense": trap_sense},
+    28:{"Damage Reduction (-)": true_damage_reduction,
+        "Rage": rage("Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (8/day)")},
+    30:{"Trap Sense": trap_sense},
+    31:{"Damage Reduction (-)": true_damage_reduction},
+    33:{"Trap Sense": trap_sense},
+    34:{"Rage": rage("Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (9/day)"),
+        "Damage Reduction (-)": true_damage_reduction},
+    36:{"Trap Sense": trap_sense},
+    37:{"Damage Reduction (-)": true_damage_reduction},
+    38:{"Rage": rage("Mighty and tireless: +8 STR/CON, -2 AC, +4 WILL, +%i HP (10/day)")},
+    39:{"Trap Sense": trap_sense},
+    40:{"Damage Reduction (-)": true_damage_reduction}}
+
+bard_specials = {
+    1:{"Bardic Music": LevelText("May play music (%s per day)", max_level),
+       "Bardic Knowledge":
+            "May attempt lore checks to gain obscure information",
+       "Countersong": "Can use music or poetics to counter magical "\
+                                        "effects that depend on sound",
+       "Fascinate": "Can use music or poetics to cause one or "\
+                        "more creatures to become fascinated with him",
+       "Inspire Courage": "Gives allies +1 to saves and damage rolls"},
+    3:{"Inspire Competence": "+2 to ally skill checks"},
+    6:{"Suggestion": "Influence the actions of the target creature by "\
+                "suggesting a course of activity (Perform vs. Will)"},
+    8:{"Inspire Courage": "Gives allies +2 to saves and damage rolls"},
+    9:{"Inspire Greatness": "Give allies +2d10 HP, +2 to attack rolls, "\
+                            "+1 fortitude save"},
+    12:{"Song of Freedom": "Free ally from enchantment "\
+                            "(perform for 1 minute)"},
+    14:{"Inspire Courage": "Gives allies +3 to saves and damage rolls"},
+    15:{"Inspire Heroics": "Gives allies +4 AC and +4 to saves"},
+    18:{"Mass Suggestion": "Influence masses of people"},
+    20:{"Inspire Courage": "Gives allies +4 to saves and damage rolls"},
+    26:{"Inspire Courage": "Gives allies +5 to saves and damage rolls"},
+    32:{"Inspire Courage": "Gives allies +6 to saves and damage rolls"},
+    38:{"Inspire Courage": "Gives allies +7 to saves and damage rolls"}}
+
+druid_specials = {
+    1: {"Animal Companion": animal_companion,
+        "Nature Sense": nature_sense,
+        "Wild Empathy": "Charm animals"},
+    2: {"Woodland Stride": "Move through natural obstacles"},
+    3: {"Trackless Step": "Leaves no trackable trails"},
+    4: {"Resist Nature's Lure": resist_natures_lure},
+    5: {"Wild Shape": "1/day (small, medium)"},
+    6: {"Wild Shape": "2/day (small, medium)"},
+    7: {"Wild Shape": "3/day (small, medium)"},
+    8: {"Wild Shape": "3/day (small, medium, large)"},
+    9: {"Venom Immunity" :"Immunity to all poisons"},
+    10: {"Wild Shape": "4/day (small, medium, large)"},
+    11: {"Wild Shape": "4/day (tiny, small, medium, large)"},
+    12: {"Wild Shape": "4/day (plant, tiny, small, medium, large)"},
+    13: {"A Thousand Faces": "Change appearance at will"},
+    14: {"Wild Shape": "5/day (plant, tiny, small, medium, large)"},
+    15: {"Timeless Body": "Does not age, does not receive aging penalties",
+        "Wild Shape": "5/day (plant, tiny, small, medium, large, huge)"},
+    16: {"Elemental Shape": "1/day (small, medium, large)"},
+    18: {"Wild Shape": "6/day (plant, tiny, small, medium, large, huge)",
+        "Elemental Shape": "2/day (small, medium, large)"},
+    20: {"Elemental Shape": "3/day (small, medium, large, huge)"},
+    22: {"Wild Shape": "7/day (plant, tiny, small, medium, large, huge)",
+             "Elemental Shape": "4/day (small, medium, large, huge)"},
+    26: {"Wild Shape": "8/day (plant, tiny, small, medium, large, huge)",
+             "Elemental Shape": "5/day (small, medium, large, huge)"},
+    30: {"Wild Shape": "infinite (plant, tiny, small, medium, large, huge)",
+             "Elemental Shape": "infinite (small, medium, large, huge)"}}
+
+# Unarmed damage by size: everyone's, and a monk's by minimum monk level
+unarmed_damage_base = {'medium': '1d4', 'small': '1d2', 'large': '1d6'}
+monk_unarmed_damage = [
+    (20, {'medium': '2d10', 'small': '2d8', 'large': '4d8'}),
+    (16, {'medium': '2d8', 'small': '2d6', 'large': '3d8'}),
+    (12, {'medium': '2d6', 'small': '1d10', 'large': '3d6'}),
+    (8, {'medium': '1d10', 'small': '1d8', 'large': '2d8'}),
+    (4, {'medium': '1d8', 'small': '1d6', 'large': '2d6'}),
+    (1, {'medium': '1d6', 'small': '1d4', 'large': '1d8'})]
+
+monk_specials = {
+    1: {"Flurry of Blows": "If unarmored, gain one extra attack "\
+                                        "with highest BAB -2",
+        "Unarmed Strike": LevelText("Fists do %s damage", unarmed_damage)},
+    2: {"Evasion": "No damage from successful REF saves "\
+                                        "that would halve damage"},
+    3: {"Still Mind": still_mind, "Unarmored Speed Bonus": speed_bonus},
+    4: {"Ki Strike": "Fists +1 magic weapons", "Slow Fall": "20 ft."},
+    5: {"Purity of Body": "Immunity to non-magical diseases",
+        'AC Bonus': monk_ac_bonus,
+        "Flurry of Blows":
+            "If unarmored, gain one extra attack with highest BAB -1",},
+    6: {"Slow Fall": "30 ft.", "Unarmored Speed Bonus": speed_bonus},
+    7: {"Wholeness of Body": LevelText("Heal %s HP per day",
+                                       double_max_level)},
+    8: {"Slow Fall": "40 ft."},
+    9: {"Improved Evasion": "Take half damage from failed REF saves",
+        "Unarmored Speed Bonus": speed_bonus},
+    10: {"Ki Strike": "Fists +2 magic weapons", "Slow Fall": "50 ft.",
+        'AC Bonus': monk_ac_bonus},
+    11: {"Diamond Body": "Immunity to all poisons",
+        "Flurry of Blows":
+            "Greater: If unarmored, gain two extra attacks with highest BAB"},
+    12: {"Abundant Step": LevelText("1/day (teleport %s ft.)",
+                                    abundant_step_distance),
+        "Slow Fall": "60 ft.", "Unarmored Speed Bonus": speed_bonus},
+    13: {"Diamond Soul": diamond_soul},
+    14: {"Slow Fall": "70 ft."},
+    15: {"Quivering Palm": "",
+        'AC Bonus': monk_ac_bonus, "Unarmored Speed Bonus": speed_bonus},
+    16: {"Ki Strike": "Fists +3 magic weapons", "Slow Fall": "80 ft."},
+    17: {"Timeless Body": "Does not age",
+        "Tongue of the Sun and Moon": moon_and_sun},
+    18: {"Slow Fall": "90 ft.", "Unarmored Speed Bonus": speed_bonus},
+    19: {"Empty Body" : "Etherealness 1/day"},
+    20: {"Perfect Self": perfect_self,
+        "Slow Fall": "Any Distance",
+        'AC Bonus': monk_ac_bonus},
+    21: {"Unarmored Speed Bonus": speed_bonus},
+    24: {"Unarmored Speed Bonus": speed_bonus},
+    25: {'AC Bonus': monk_ac_bonus},
+    27: {"Unarmored Speed Bonus": speed_bonus},
+    30: {'AC Bonus': monk_ac_bonus, "Unarmored Speed Bonus": speed_bonus},
+    33: {"Unarmored Speed Bonus": speed_bonus},
+    35: {'AC Bonus': monk_ac_bonus},
+    36: {"Unarmored Speed Bonus": speed_bonus},
+    39: {"Unarmored Speed Bonus": speed_bonus},
+    40: {'AC Bonus': monk_ac_bonus}}
+
+paladin_specials = {
+    1: {"Aura of Good": "Detect presence of good (60 ft radius)",
+        "Detect Evil": "Detect evil at will (60 ft radius)",
+        "Smite Evil": "1/day"},
+    2: {"Divine Grace": divine_grace, "Lay on Hands": ""},
+    3: {"Aura of Courage": aura_of_courage,
+        "Divine Health": "Immunity to all types of diseases"},
+    4: {"Turn Undead": turn_undead},
+    5: {"Smite Evil": "2/day", "Special Mount": ""},
+    6: {"Remove Disease": "1/week"},
+    9: {"Remove Disease": "2/week"},
+    10: {"Smite Evil": "3/day"},
+    12: {"Remove Disease": "3/week"},
+    15: {"Remove Disease": "4/week", "Smite Evil": "4/day"},
+    18: {"Remove Disease": "5/week"},
+    20: {"Smite Evil": "5/day"},
+    21: {"Remove Disease": "6/week"},
+    24: {"Remove Disease": "7/week"},
+    25: {"Smite Evil": "6/day"},
+    27: {"Remove Disease": "8/week"},
+    30: {"Remove Disease": "9/week", "Smite Evil": "6/day"},
+    33: {"Remove Disease": "10/week"},
+    35: {"Smite Evil": "7/day"},
+    36: {"Remove Disease": "11/week"},
+    39: {"Remove Disease": "12/week"},
+    40: {"Smite Evil": "8/day"}}
+
+ranger_specials = {
+    1: {"Favored Enemy": favored_enemy,
+        "Track": "May track by using survival skill",
+        "Wild Empathy": "Charm animals"},
+    2: {"Combat Style": ""},
+    3: {"Endurance": "+4 to checks involving non-lethal"\
+            " damage holding-breath. May sleep in medium armor."},
+    4: {"Animal Companion": animal_companion},
+    5: {"Favored Enemy": favored_enemy},
+    6: {"Improved Combat Style": ""},
+    7: {"Woodland Stride": "Move through natural obstacles"},
+    8: {"Swift Tracker": "Can move normal speed while tracking"},
+    9: {"Evasion":
+        "On succesful REF save that would halve damage, takes no damage"},
+    10: {"Favored Enemy": favored_enemy},
+    11: {"Combat Style Mastery": ""},
+    13: {"Camouflage": "Can hide in any sort of natural terrain"},
+    15: {"Favored Enemy": favored_enemy},
+    17: {"Hide in Plain Sight":
+            "When in natural terrain, can use hide skill when observed"},
+    20: {"Favored Enemy": favored_enemy},
+    25: {"Favored Enemy": favored_enemy},
+    30: {"Favored Enemy": favored_enemy},
+    35: {"Favored Enemy": favored_enemy},
+    40: {"Favored Enemy": favored_enemy}}
+
+rogue_specials = {
+    1: {"Sneak Attack": sneak_attack,
+            "Trapfinding": "Can use search skill to locate traps"},
+    2: {"Evasion": "On succesful REF save that would "\
+                    "halve damage, takes no damage"},
+    3: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    4: {"Uncanny Dodge": uncanny_dodge},
+    5: {"Sneak Attack": sneak_attack},
+    6: {"Trap Sense": trap_sense},
+    7: {"Sneak Attack": sneak_attack},
+    8: {"Imp. Uncanny Dodge": improved_uncanny_dodge},
+    9: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    10: {"Crippling Strike":
+        "Sneak attacks do 2 strength damage (heals 1 point per day)"},
+    11: {"Sneak Attack": sneak_attack},
+    12: {"Trap Sense": trap_sense},
+    13: {"Sneak Attack": sneak_attack, "Special Ability": ""},
+    15: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    16: {"Special Ability": ""},
+    17: {"Sneak Attack": sneak_attack},
+    18: {"Trap Sense": trap_sense},
+    19: {"Sneak Attack": sneak_attack, "Special Ability": ""},
+    21: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    23: {"Sneak Attack": sneak_attack},
+    24: {"Trap Sense": trap_sense},
+    25: {"Sneak Attack": sneak_attack},
+    27: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    29: {"Sneak Attack": sneak_attack},
+    30: {"Trap Sense": trap_sense},
+    31: {"Sneak Attack": sneak_attack},
+    33: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense},
+    35: {"Sneak Attack": sneak_attack},
+    36: {"Trap Sense": trap_sense},
+    37: {"Sneak Attack": sneak_attack},
+    39: {"Sneak Attack": sneak_attack, "Trap Sense": trap_sense}}
+
+class_special_abilities = {
+    'barbarian': barbarian_specials,
+    'cleric': cleric_specials,
+    'wizard': wizard_specials,
+    'sorcerer': wizard_specials,
+    'bard': bard_specials,
+    'druid': druid_specials,
+    'fighter': {},
+    'monk': monk_specials,
+    'paladin': paladin_specials,
+    'ranger': ranger_specials,
+    'rogue': rogue_specials,
+    'aristocrat': {},
+    'expert': {},
+    'adept': {2: {'Summon familiar': summon_familiar}},
+    'commoner': {},
+    'warrior': {}}
+
+def special_abs(npc, act_class, active_class_level, act_max_lvl, rng=random):
 
-        if len(npc.weapon_proficiencies) == 0:
-            return False
+    if act_class == 'monk':
+        for min_level, damage in monk_unarmed_damage:
+            if act_max_lvl >= min_level:
+                npc.unarmed_damage = damage[npc.size]
+                break
         else:
-            weapon_type = random.choice(npc.weapon_proficiencies)
-
-        npc.feats[name + ' ('+weapon_type+')'] = args['descr']
-        return True
+            npc.unarmed_damage = unarmed_damage_base[npc.size]
 
-    def skill_feat(name, args, index):
-        descr = []
-        for k in args.keys():
-            npc.skill_points[index][k]['ranks'] += args[k]
-            descr.append('+%i to %s' % (args[k], k))
-        npc.feats[name] = "(%s)" % ', '.join(descr)
-        return True
+    if npc.unarmed_damage is None:
+        npc.unarmed_damage = unarmed_damage_base[npc.size]
+
+    level_abilities = class_special_abilities[act_class].get(
+        active_class_level)
+    if level_abilities is None:
+        return
+
+    for key, ability in level_abilities.items():
+        if isinstance(ability, (str, LevelText)):
+            # Append class feats as tuples (level, feat)
+            if key not in npc.class_feats.keys():
+                pass
+            elif not isinstance(npc.class_feats[key], tuple):
+                continue
+            # Overwrite only if ability is higher level
+            elif act_max_lvl < npc.class_feats[key][0]:
+                continue
+            if isinstance(ability, LevelText):
+                ability = ability.format(npc, act_max_lvl)
+            npc.class_feats[key] = (act_max_lvl, ability)
+        else:
+            ability(npc, active_class_level, act_max_lvl, rng)
 
-    def save_feat(name, args, index):
-        descr = []
-        for k in args.keys():
-            npc.saves_mods[k]['misc'] += args[k]
-            descr.append('+%i to %s saves' % (args[k], k))
-        npc.feats[name] = "(%s)" % ', '.join(descr)
-        return True
+# =====================================================================
+""" Feats """
+# =====================================================================
 
-    def save_special_feat(name, args, index):
-        descr = []
-        for k in args.keys():
-            for j in args[k].keys():
-                npc.save_special_bonuses[k][j] += args[k][j]
-            descr.append('+%i to saves %s' % (args[k][j], j))
-        npc.feats[name] = "%s" % ', '.join(descr)
-        return True
+class Feat(object):
+    """ A feat of the registry. ´effect(npc, name, feat, index, rng)´
+    applies the feat to the character and returns whether it was taken;
+    ´index´ is the index of the class taking it. Feats whose ´reqs´ are
+    not met are never taken. ´args´ are feat specific arguments for the
+    effect """
 
-    def armor_light(name):
-        npc.armor_proficiencies.append('light')
-        npc.feats[name] = ""
-        return True
+    def __init__(self, effect=None, descr='', reqs=None, args=None):
+        self.effect = effect or describe_feat
+        self.descr = descr
+        self.reqs = reqs or {}
+        self.args = args
 
-    def armor_medium(name):
-        npc.armor_proficiencies.append('medium')
-        npc.feats[name] = ""
+    def check_reqs(self, npc):
+        """ Check if feat pre-requirements are met
+        Return True if requirements are ok or not specified """
+        for requirement, val in self.reqs.items():
+            if isinstance(val, int):
+                if npc.__dict__[requirement] < val:
+                    return False
+            if isinstance(val, str):
+                if val not in npc.__dict__[requirement].keys():
+                    return False
         return True
 
-    def spell_penetration(name):
-        npc.spell_penetration += 2
-        npc.feats[name] = "+2 to checks breaking enemy spell resistance"
+def describe_feat(npc, name, feat, index, rng):
+    npc.feats[name] = feat.descr
+    return True
 
-    def armor_heavy(name):
-        if npc.ability_mods['dex'] > 1:
-            return False
-        else:
-            npc.armor_proficiencies.append('heavy')
-            npc.feats[name] = ""
-            return True
+def improved_grapple(npc, name, feat, index, rng):
+    npc.feats[name] = feat.descr
+    npc.grapple += 4
+    return True
 
-    def shield_proficiency(name):
-        npc.has_shield_proficiency = True
-        npc.feats[name] = "No armor check penalty on attack rolls"
+def count_epic(npc, name, descr):
+    if name not in npc.epic_counter.keys():
+        npc.epic_counter[name] = 1
+    else:
+        npc.epic_counter[name] += 1
+
+    ft_name = "%s (+%s)" % (name, str(npc.epic_counter[name]))
+    npc.feats[ft_name] = descr
+
+def epic_armor_skin(npc, name, feat, index, rng):
+    count_epic(npc, name, feat.descr)
+    npc.ac_modifiers['natural'] += 1
+    return True
+
+def epic_toughness(npc, name, feat, index, rng):
+    count_epic(npc, name, feat.descr)
+    npc.hp += 30
+    return True
+
+def epic_polyglot(npc, name, feat, index, rng):
+    npc.languages = ['Can speak all lanugages']
+    return True
+
+def epic_sneak_attack(npc, name, feat, index, rng):
+    count_epic(npc, name, feat.descr)
+    npc.sneak_attack += 1
+    return True
+
+def epic_ability(npc, name, feat, index, rng):
+    """ Pump up ability scores on epic levels """
+    abrs = {'str': 'Strength',
+            'dex': 'Dexterity',
+            'con': 'Constitution',
+            'wis': 'Wisdom',
+            'int': 'Intelligence',
+            'cha': 'Charisma'}
+
+    if npc.abilities[npc.priority_order[0]] > 30:
+        increase = npc.priority_order[1]
+    else:
+        increase = npc.priority_order[0]
+
+    count_epic(npc, "%s %s" % (name, abrs[increase]), feat.descr)
+    npc.abilities[increase] += 1
+    return True
+
+def epic_dr(npc, name, feat, index, rng):
+    count_epic(npc, name, feat.descr)
+    npc.damage_reduction['-'] += 3
+    return True
+
+def epic_initiative(npc, name, feat, index, rng):
+    npc.initiative += 8
+    npc.feats[name] = feat.descr
+    return True
+
+def epic_fast_healing(npc, name, feat, index, rng):
+    npc.fast_healing += 3
+    npc.feats[name] = feat.descr
+    return True
+
+def epic_skill_focus(npc, name, feat, index, rng):
+    ranked = []
+    for skill in npc.total_skill_points.keys():
+        if npc.total_skill_points[skill]['ranks'] > 10:
+            ranked.append(skill)
+
+    if len(ranked) < 1:
+        return False
+    else:
+        increase = rng.choice(sorted(ranked))
+        count_epic(npc, name, "(Improved %s)" % increase)
+        npc.total_skill_points[increase]['misc_mod'] += 10
         return True
 
-    def improved_initiative(name):
-        val = 4
-        npc.initiative += val
-        npc.feats[name] = "(+%i to initiative)" % val
-        return True
+def epic_energy_resistance(npc, name, feat, index, rng):
+    count_epic(npc, name, feat.descr)
+    type_ = rng.choice(['fire', 'cold', 'acid'])
+    npc.damage_reduction[type_] += 10
+    return True
 
-    def run(name):
-        npc.run_speed_multiplier = 5
-        npc.feats[name] = "Run speed increased"
-        return True
-
-    def wpn_proficiency(name, args, index):
-        npc.weapon_proficiencies.append(args)
-        npc.feats[name] = 'No -4 penalty with %s weapons' % args
-        return True
+def wpn_focus(npc, name, feat, index, rng):
+    if len(npc.weapon_proficiencies) == 0:
+        return False
+    else:
+        weapon_type = rng.choice(npc.weapon_proficiencies)
+
+    npc.feats[name + ' ('+weapon_type+')'] = feat.descr
+    return True
+
+def skill_feat(npc, name, feat, index, rng):
+    descr = []
+    for k in feat.args.keys():
+        npc.skill_points[index][k]['ranks'] += feat.args[k]
+        npc.total_skill_points[k]['ranks'] += feat.args[k]
+        descr.append('+%i to %s' % (feat.args[k], k))
+    npc.feats[name] = "(%s)" % ', '.join(descr)
+    return True
+
+def save_feat(npc, name, feat, index, rng):
+    descr = []
+    for k in feat.args.keys():
+        npc.saves_mods[k]['misc'] += feat.args[k]
+        descr.append('+%i to %s saves' % (feat.args[k], k))
+    npc.feats[name] = "(%s)" % ', '.join(descr)
+    return True
+
+def save_special_feat(npc, name, feat, index, rng):
+    descr = []
+    for k in feat.args.keys():
+        for j in feat.args[k].keys():
+            npc.save_special_bonuses[k][j] += feat.args[k][j]
+        descr.append('+%i to saves %s' % (feat.args[k][j], j))
+    npc.feats[name] = "%s" % ', '.join(descr)
+    return True
+
+def armor_proficiency(npc, name, feat, index, rng):
+    npc.armor_proficiencies.append(feat.args)
+    npc.feats[name] = feat.descr
+    return True
+
+def spell_penetration(npc, name, feat, index, rng):
+    npc.spell_penetration += 2
+    npc.feats[name] = feat.descr
+    return True
+
+def armor_heavy(npc, name, feat, index, rng):
+    if npc.ability_mods['dex'] > 1:
+        return False
+    else:
+        return armor_proficiency(npc, name, feat, index, rng)
+
+def shield_proficiency(npc, name, feat, index, rng):
+    npc.has_shield_proficiency = True
+    npc.feats[name] = feat.descr
+    return True
+
+def improved_initiative(npc, name, feat, index, rng):
+    npc.initiative += feat.args
+    npc.feats[name] = feat.descr
+    return True
+
+def run(npc, name, feat, index, rng):
+    npc.run_speed_multiplier = 5
+    npc.feats[name] = feat.descr
+    return True
+
+def wpn_proficiency(npc, name, feat, index, rng):
+    npc.weapon_proficiencies.append(feat.args)
+    npc.feats[name] = 'No -4 penalty with %s weapons' % feat.args
+    return True
+
+def toughness(npc, name, feat, index, rng):
+    npc.hp += 3
+    npc.feats[name] = feat.descr
+    return True
+
+# Feat dictionary combiner
+def merge_dicts(*dict_args):
+    """Given any number of dicts, shallow copy and merge into a new dict,
+    precedence goes to key value pairs in latter dicts."""
+    result = {}
+    for dictionary in dict_args:
+        result.update(dictionary)
+    return result
+
+general_feats = {
+    'Acrobatic': Feat(skill_feat, args={'Jump': 2, 'Tumble': 2}),
+    'Agile': Feat(skill_feat, args={'Balance': 2, 'Escape Artist': 2}),
+    'Alertness': Feat(skill_feat, args={'Listen': 2, 'Spot': 2}),
+    'Animal Affinity': Feat(skill_feat,
+        args={'Ride': 2, 'Handle Animal': 2}),
+    'Armor Proficiency (light)': Feat(armor_proficiency, args='light'),
+    'Armor Proficiency (medium)': Feat(armor_proficiency, args='medium'),
+    'Armor Proficiency (heavy)': Feat(armor_heavy, args='heavy'),
+    'Athletic': Feat(skill_feat, args={'Climb': 2, 'Swim': 2}),
+    'Blind-fight': Feat(descr='When fighting concealed creatures, reroll '\
+                              'misses once. Half penalties when blinded'),
+    'Combat reflexes': Feat(descr='Additional attack of opportunity'),
+    'Deceitful': Feat(skill_feat, args={'Disguise': 2, 'Forgery': 2}),
+    'Deft hands': Feat(skill_feat,
+        args={'Use Rope': 2, 'Sleight of Hand': 2}),
+    'Endurance': Feat(save_special_feat,
+        args={'general': {'vs. non-lethal': 4}}),
+    'Great Fortitude': Feat(save_feat, args={'fort': 2}),
+    'Improved initiative': Feat(improved_initiative,
+        '(+4 to initiative)', args=4),
+    'Iron Will': Feat(save_feat, args={'will': 2}),
+    'Lightning Reflexes': Feat(save_feat, args={'ref': 2}),
+    'Point Blank Shot': Feat(
+        descr='+1 bonus on ranged attack and damage within 30 ft.'),
+    'Run': Feat(run, 'Run speed increased'),
+    'Shield Proficiency': Feat(shield_proficiency,
+        'No armor check penalty on attack rolls'),
+    'Simple Weapon proficiency': Feat(wpn_proficiency, args='simple'),
+    'Martial Weapon proficiency': Feat(wpn_proficiency, args='martial'),
+    'Exotic Weapon proficiency': Feat(wpn_proficiency, args='exotic'),
+    'Toughness': Feat(toughness, '(+3 hitpoints)')
+    }
 
-    def toughness(name):
-        npc.hp += 3
-        npc.feats[name] = '(+3 hitpoints)'
-        return True
+magic_feats = {
+    'Augment Summoning': Feat(descr='Summoned monsters have +4 STR/CON'),
+    'Combat Casting': Feat(descr='+4 concentration when casting '\
+                                 'defensively'),
+    'Eschew Materials': Feat(descr='Cast spells without material '\
+                                   'components'),
+    'Improved counterspell': Feat(descr='Counterspell with spell of same '\
+                                        'school'),
+    'Spell Penetration': Feat(spell_penetration,
+        '+2 to checks breaking enemy spell resistance')}
+
+metamagic_feats = {
+    'Empower Spell': Feat(descr="Increase spell's variable, numeric "\
+                                "effects by 50%"),
+    'Enlarge Spell': Feat(descr="Double spell's range"),
+    'Extend Spell': Feat(descr="Double spell's duration"),
+    'Heighten Spell': Feat(descr="Cast spells as higher level"),
+    'Maximize Spell': Feat(descr="Maximize spell's variable, numeric "\
+                                 "effects"),
+    'Quicken Spell': Feat(descr="Cast spells as free action"),
+    'Silent Spell': Feat(descr="Cast spells without verbal components"),
+    'Still Spell': Feat(descr="Cast spells without somatic components"),
+    'Widen Spell': Feat(descr="Double spell's area")}
+
+fighter_bonus_feats = {
+    'Power Attack': Feat(
+        descr='Trade attack bonus for damage (up to base attack bonus)',
+        reqs={'str': 13}),
+    'Cleave': Feat(
+        descr='Extra melee attack after killing target',
+        reqs={'feats': 'Power Attack'}),
+    'Great Cleave': Feat(
+        descr='No limit to cleave attacks each round',
+        reqs={'feats': 'Cleave', 'bab': 4}),
+    'Improved Shield Bash': Feat(
+        descr='Retain shield bonus to AC when bashing',
+        reqs={'feats': 'Shield proficiency'}),
+    'Two Weapon Fighting': Feat(
+        descr='Reduce two-weapon fighting penalties by 2',
+        reqs={'dex': 15}),
+    'Two Weapon Defense': Feat(
+        descr='Off-hand weapon grants +1 shield bonus to AC',
+        reqs={'feats': 'Two Weapon Fighting'}),
+    'Impr. Two Weapon Fighting': Feat(
+        descr='Gain second off-hand attack',
+        reqs={'dex': 17, 'feats': 'Two Weapon Fighting', 'bab': 6}),
+    'Greater Two Weapon Fighting': Feat(
+        descr='Gain second off-hand attack',
+        reqs={'dex': 19, 'feats': 'Impr. Two Weapon Fighting', 'bab': 11}),
+    'Weapon Focus': Feat(wpn_focus,
+        descr='(+1 with selected weapon type)',
+        reqs={'bab': 1}),
+        }
 
-    # Feat dictionary combiner
-    def merge_dicts(*dict_args):
-        """Given any number of dicts, shallow copy and merge into a new dict,
-        precedence goes to key value pairs in latter dicts."""
-        result = {}
-        for dictionary in dict_args:
-            result.update(dictionary)
-        return result
-
-    general_feats = {
-        'Acrobatic': [skill_feat, {'Jump': 2, 'Tumble': 2}],
-        'Agile': [skill_feat, {'Balance': 2, 'Escape Artist': 2}],
-        'Alertness': [skill_feat, {'Listen': 2, 'Spot': 2}],
-        'Animal Affinity': [skill_feat, {'Ride': 2, 'Handle Animal': 2}],
-        'Armor Proficiency (light)': armor_light,
-        'Armor Proficiency (medium)': armor_medium,
-        'Armor Proficiency (heavy)': armor_heavy,
-        'Athletic': [skill_feat, {'Climb': 2, 'Swim': 2}],
-        'Blind-fight': 'When fighting concealed creatures, reroll misses '\
-                        'once. Half penalties when blinded',
-        'Combat reflexes': 'Additional attack of opportunity',
-        'Deceitful': [skill_feat, {'Disguise': 2, 'Forgery': 2}],
-        'Deft hands': [skill_feat, {'Use Rope': 2, 'Sleight of Hand': 2}],
-        'Endurance': [save_special_feat, {'general': {'vs. non-lethal': 4}}],
-        'Great Fortitude': [save_feat, {'fort': 2}],
-        'Improved initiative': improved_initiative,
-        'Iron Will': [save_feat, {'will': 2}],
-        'Lightning Reflexes': [save_feat, {'ref': 2}],
-        'Point Blank Shot': '+1 bonus on ranged attack and damage within 30 ft.',
-        'Run': run,
-        'Shield Proficiency': shield_proficiency,
-        'Simple Weapon proficiency': [wpn_proficiency, 'simple'],
-        'Martial Weapon proficiency': [wpn_proficiency, 'martial'],
-        'Exotic Weapon proficiency': [wpn_proficiency, 'exotic'],
-        'Toughness': toughness
+wizard_bonus_feats = {'Spell Mastery':
+    Feat(descr='Can prepare some spells without spell book')}
+
+monk_bonus_feats = {
+    'Improved Unarmed Strike': Feat(
+        descr='Does not provoke attacks of opportunity when unarmed'),
+    'Improved grapple': Feat(improved_grapple,
+        descr='(+4 to grapple checks)'),
+    'Stunning Fist': Feat(
+        descr='May attempt to stun opponents with unarmed strikes',
+        reqs={'lvl': 2}),
+    'Combat Reflexes': Feat(
+        descr='May make a number of additional attacks of '\
+              'opportunity equal to DEX bonus',
+        reqs={'lvl': 2}),
+    'Deflect Arrows': Feat(
+        descr='May dodge ranged attack once per round',
+        reqs={'lvl': 2}),
+    'Improved Disarm': Feat(
+        descr='Does not provoke AOO when disarming enemy',
+        reqs={'lvl': 6}),
         }
 
-    magic_feats = {
-        'Augment Summoning': 'Summoned monsters have +4 STR/CON',
-        'Combat Casting': '+4 concentration when casting defensively',
-        'Eschew Materials': 'Cast spells without material components',
-        'Improved counterspell': 'Counterspell with spell of same school',
-        'Spell Penetration': spell_penetration}
-
-    metamagic_feats = {
-        'Empower Spell': "Increase spell's variable, numeric effects by 50%",
-        'Enlarge Spell': "Double spell's range",
-        'Extend Spell': "Double spell's duration",
-        'Heighten Spell': "Cast spells as higher level",
-        'Maximize Spell': "Maximize spell's variable, numeric effects",
-        'Quicken Spell': "Cast spells as free action",
-        'Silent Spell': "Cast spells without verbal components",
-        'Still Spell': "Cast spells without somatic components",
-        'Widen Spell': "Double spell's area"}
-
-    fighter_bonus_feats = {
-        'Power Attack': [pre_req_feat,
-            {'descr':
-                    'Trade attack bonus for damage (up to base attack bonus)',
-            'reqs': {'str': 13}}],
-        'Cleave': [pre_req_feat,
-            {'descr': 'Extra melee attack after killing target',
-            'reqs': {'feats': 'Power Attack'}}],
-        'Great Cleave': [pre_req_feat,
-            {'descr': 'No limit to cleave attacks each round',
-            'reqs': {'feats': 'Cleave', 'bab': 4}}],
-        'Improved Shield Bash': [pre_req_feat,
-            {'descr': 'Retain shield bonus to AC when bashing',
-            'reqs': {'feats': 'Shield proficiency'}}],
-        'Two Weapon Fighting': [pre_req_feat,
-            {'descr': 'Reduce two-weapon fighting penalties by 2',
-            'reqs': {'dex': 15}}],
-        'Two Weapon Defense': [pre_req_feat,
-            {'descr': 'Off-hand weapon grants +1 shield bonus to AC',
-            'reqs': {'feats': 'Two Weapon Fighting'}}],
-        'Impr. Two Weapon Fighting': [pre_req_feat,
-            {'descr': 'Gain second off-hand attack',
-            'reqs': {'dex': 17, 'feats': 'Two Weapon Fighting', 'bab': 6}}],
-        'Greater Two Weapon Fighting': [pre_req_feat,
-            {'descr': 'Gain second off-hand attack',
-            'reqs': {'dex': 19,
-                    'feats': 'Impr. Two Weapon Fighting', 'bab': 11}}],
-        'Weapon Focus': [wpn_focus,
-            {'descr': '(+1 with selected weapon type)',
-            'reqs': {'bab': 1}}],
-            }
+warrior_type_feats = merge_dicts(general_feats, fighter_bonus_feats)
+mixed_type_feats = merge_dicts(warrior_type_feats,
+                                magic_feats, metamagic_feats, general_feats)
+wizard_type_feats = merge_dicts(magic_feats, metamagic_feats, general_feats)
+
+# Which kind of feats each class will pick
+gen_feats = {
+    'fighter': warrior_type_feats,
+    'barbarian': warrior_type_feats,
+    'paladin': warrior_type_feats,
+    'ranger': warrior_type_feats,
+    'cleric': mixed_type_feats,
+    'wizard': wizard_type_feats,
+    'sorcerer': wizard_type_feats,
+    'bard': mixed_type_feats,
+    'rogue': warrior_type_feats,
+    'monk': warrior_type_feats,
+    'druid': mixed_type_feats,
+    'commoner': general_feats,
+    'expert': general_feats,
+    'adept': mixed_type_feats,
+    'aristocrat': general_feats,
+    'warrior': mixed_type_feats}
+
+non_epic_bonus_feats = {
+    'wizard': merge_dicts(wizard_bonus_feats, metamagic_feats),
+    'monk': monk_bonus_feats,
+    'fighter': fighter_bonus_feats}
+
+# NON BONUS epic feats
+epic_feats = {
+    'Great': Feat(epic_ability, '(Ability score bonus)')
+    }
 
-    wizard_bonus_feats = {'Spell Mastery':
-                                'Can prepare some spells without spell book'}
-
-    monk_bonus_feats = {
-        'Improved Unarmed Strike': [pre_req_feat,
-            {'descr': 'Does not provoke attacks of opportunity when unarmed',
-            'reqs': {}}],
-        'Improved grapple': [improved_grapple,
-            {'descr': '(+4 to grapple checks)',
-            'reqs': {}}],
-        'Stunning Fist': [pre_req_feat,
-            {'descr': 'May attempt to stun opponents with unarmed strikes',
-            'reqs': {'lvl': 2}}],
-        'Combat Reflexes': [pre_req_feat,
-            {'descr': 'May make a number of additional attacks of '\
-                        'opportunity equal to DEX bonus',
-            'reqs': {'lvl': 2}}],
-        'Deflect Arrows': [pre_req_feat,
-            {'descr': 'May dodge ranged attack once per round',
-            'reqs': {'lvl': 2}}],
-        'Improved Disarm': [pre_req_feat,
-            {'descr': 'Does not provoke AOO when disarming enemy',
-            'reqs': {'lvl': 6}}],
-            }
+fighter_epic_bonus_feats = {
+    'Armor Skin': Feat(epic_armor_skin, '(Improved natural armor)'),
+    'Epic Toughness': Feat(epic_toughness, '(Additional hitpoints)'),
+    'Superior Initiative': Feat(epic_initiative, '(+8 to initiative)'),
+    'Energy Resistance': Feat(epic_energy_resistance,
+        '(Elemental damage reduction)'),
+    'Perfect Two Weapon Fighting': Feat(
+        descr='The character can make as many attacks with his or '\
+              'her off-hand weapon as with his or her primary '\
+              'weapon, using the same base attack bonus.',
+        reqs={'feats': 'Greater Two Weapon Fighting', 'dex': 25}),
+    'Epic Damage Reduction': Feat(epic_dr,
+        '(Increased damage reduction)')}
+
+rogue_epic_bonus_feats = {
+    'Epic Sneak Attack': Feat(epic_sneak_attack,
+        descr='Improved Sneak Attack',
+        reqs={'sneak_attack': 8}),
+    'Legendary Climber': Feat(
+        descr='May ignore all penalties applied for accelerated climbing',
+        reqs={'dex': 21}),
+    'Sneak Attack of Opportunity': Feat(
+        descr='Attack of opportunities gain sneak attack bonus',
+        reqs={'sneak_attack': 8}),
+    'Combat Archery': Feat(
+        descr='Enemies do not get AOO when using bow',
+        reqs={'feats': 'Point Blank Shot'}),
+    'Dexterous Will': Feat(
+        descr='May use reflex save instead of will save once per round',
+        reqs={'dex': 25}),
+    'Dexterous Fortitude': Feat(
+        descr='May use reflex save instead of fortitude save once per '\
+              'round',
+        reqs={'dex': 25}),
+    'Epic Skill Focus': Feat(epic_skill_focus, '(Bonus to skill checks)')}
+
+cleric_epic_bonus_feats = {
+    'Armor Skin': fighter_epic_bonus_feats['Armor Skin'],
+    'Impr. Combat Casting': Feat(
+        descr='Does not incur AOO when casting spells',
+        reqs={'feats': 'Combat Casting'}),
+    'Planar Turning': Feat(
+        descr='May turn outsiders as undead',
+        reqs={'wis': 25, 'cha': 25}),
+    'Undead Mastery': Feat(
+        descr='The character may command up to ten times his or '\
+              'her level in HD of undead',
+        reqs={'cha': 21}),
+    'Spell Penetration': magic_feats['Spell Penetration'],
+    'Greater Spell Penetration': Feat(
+        descr='Additional +2 to checks breaking enemy spell resistance',
+        reqs={'feats': 'Spell Penetration'}),
+    'Epic Spell Penetration': Feat(
+        descr='Additional +2 to checks breaking enemy spell resistance',
+        reqs={'feats': 'Greater Spell Penetration'}),
+        }
 
-    warrior_type_feats = merge_dicts(general_feats, fighter_bonus_feats)
-    mixed_type_feats = merge_dicts(warrior_type_feats,
-                                    magic_feats, metamagic_feats, general_feats)
-    wizard_type_feats = merge_dicts(magic_feats, metamagic_feats, general_feats)
-
-    # Which kind of feats each class will pick
-    gen_feats = {
-        'fighter': warrior_type_feats,
-        'barbarian': warrior_type_feats,
-        'paladin': warrior_type_feats,
-        'ranger': warrior_type_feats,
-        'cleric': mixed_type_feats,
-        'wizard': wizard_type_feats,
-        'sorcerer': wizard_type_feats,
-        'bard': mixed_type_feats,
-        'rogue': warrior_type_feats,
-        'monk': warrior_type_feats,
-        'druid': mixed_type_feats,
-        'commoner': general_feats,
-        'expert': general_feats,
-        'adept': mixed_type_feats,
-        'aristocrat': general_feats,
-        'warrior': mixed_type_feats}
-
-    non_epic_bonus_feats = {
-        'wizard': merge_dicts(wizard_bonus_feats, metamagic_feats),
-        'monk': monk_bonus_feats,
-        'fighter': fighter_bonus_feats}
-
-    # NON BONUS epic feats
-    epic_feats = {
-        'Great': [epic_ability,
-            {'descr': '(Ability score bonus)',
-            'reqs': {}}]
+druid_epic_bonus_feats = {
+    'Wildshape (Colossal)': Feat(
+        descr='May shapeshift into colossal animals',
+        reqs={'feats': 'Wildshape (Gargantuan)'}),
+    'Wildshape (Diminutive)': Feat(
+        descr='May shapeshift into diminutive animals'),
+    'Wildshape (Gargantuan)': Feat(
+        descr='May shapeshift into gargantuan animals',
+        reqs={'feats': 'Wildshape (Huge)'}),
+    'Wildshape (Huge)': Feat(
+        descr='May shapeshift into huge animals'),
+    'Wildshape (Fine)': Feat(
+        descr='May shapeshift into fine sized animals',
+        reqs={'feats': 'Wildshape (Diminutive)'}),
+    'Dragon Shape': Feat(
+        descr='May shapeshift into Dragon. '\
+              'Maximum size is determined by Wildshape feats',
+        reqs={'wis': 30}),
+    'Fast Healing': Feat(epic_fast_healing,
+        descr='(Improved HP regeneration)',
+        reqs={'con': 25}),
+    'Energy Resistance': fighter_epic_bonus_feats['Energy Resistance'],
+    'Spell Penetration': magic_feats['Spell Penetration'],
+    'Greater Spell Penetration':
+        cleric_epic_bonus_feats['Greater Spell Penetration'],
+    'Epic Spell Penetration':
+        cleric_epic_bonus_feats['Epic Spell Penetration']
         }
 
-    fighter_epic_bonus_feats = {
-        'Armor Skin': [epic_armor_skin,
-            {'descr': '(Improved natural armor)',
-            'reqs': {}}],
-        'Epic Toughness': [epic_toughness,
-            {'descr': '(Additional hitpoints)',
-            'reqs': {}}],
-        'Superior Initiative': [epic_initiative,
-            {'descr': '(+8 to initiative)',
-            'reqs': {}}],
-        'Energy Resistance': [epic_energy_resistance,
-            {'descr': '(Elemental damage reduction)',
-            'reqs': {}}],
-        'Perfect Two Weapon Fighting': [pre_req_feat,
-            {'descr': 'The character can make as many attacks with his or '\
-                        'her off-hand weapon as with his or her primary '\
-                        'weapon, using the same base attack bonus.',
-            'reqs': {'feats': 'Greater Two Weapon Fighting', 'dex': 25}}],
-        'Epic Damage Reduction': [epic_dr,
-            {'descr': '(Increased damage reduction)',
-            'reqs': {}}]    }
-
-    rogue_epic_bonus_feats = {
-        'Epic Sneak Attack': [epic_sneak_attack,
-            {'descr': 'Improved Sneak Attack',
-            'reqs': {'sneak_attack': 8}}],
-        'Legendary Climber': [pre_req_feat,
-            {'descr': 'May ignore all penalties applied for accelerated climbing',
-            'reqs': {'dex': 21}}],
-        'Sneak Attack of Opportunity': [pre_req_feat,
-            {'descr': 'Attack of opportunities gain sneak attack bonus',
-            'reqs': {'sneak_attack': 8}}],
-        'Combat Archery': [pre_req_feat,
-            {'descr': 'Enemies do not get AOO when using bow',
-            'reqs': {'feats': 'Point Blank Shot'}}],
-        'Dexterous Will': [pre_req_feat,
-            {'descr': 'May use reflex save instead of will save once per round',
-            'reqs': {'dex': 25}}],
-        'Dexterous Fortitude': [pre_req_feat,
-            {'descr': 'May use reflex save instead of fortitude save once per round',
-            'reqs': {'dex': 25}}],
-        'Epic Skill Focus': [epic_skill_focus,
-            {'descr': '(Bonus to skill checks)',
-            'reqs': {}}]}
-
-    cleric_epic_bonus_feats = {
-        'Armor Skin': fighter_epic_bonus_feats['Armor Skin'],
-        'Impr. Combat Casting': [pre_req_feat,
-            {'descr': 'Does not incur AOO when casting spells',
-            'reqs': {'feats': 'Combat Casting'}}],
-        'Planar Turning': [pre_req_feat,
-            {'descr': 'May turn outsiders as undead',
-            'reqs': {'wis': 25, 'cha': 25}}],
-        'Undead Mastery': [pre_req_feat,
-            {'descr': 'The character may command up to ten times his or '\
-                            'her level in HD of undead',
-            'reqs': {'cha': 21}}],
-        'Spell Penetration': spell_penetration,
-        'Greater Spell Penetration': [pre_req_feat,
-            {'descr': 'Additional +2 to checks breaking enemy spell resistance',
-            'reqs': {'feats': 'Spell Penetration'}}],
-        'Epic Spell Penetration': [pre_req_feat,
-            {'descr': 'Additional +2 to checks breaking enemy spell resistance',
-            'reqs': {'feats': 'Greater Spell Penetration'}}],
-            }
+wizard_epic_bonus_feats = {
+    'Impr. Combat Casting': cleric_epic_bonus_feats['Impr. Combat Casting'],
+    'Spell Penetration': magic_feats['Spell Penetration'],
+    'Greater Spell Penetration':
+        cleric_epic_bonus_feats['Greater Spell Penetration'],
+    'Epic Spell Penetration':
+        cleric_epic_bonus_feats['Epic Spell Penetration']
+        }
 
-    druid_epic_bonus_feats = {
-        'Wildshape (Colossal)': [pre_req_feat,
-            {'descr': 'May shapeshift into colossal animals',
-            'reqs': {'feats': 'Wildshape (Gargantuan)'}}],
-        'Wildshape (Diminutive)': [pre_req_feat,
-            {'descr': 'May shapeshift into diminutive animals',
-            'reqs': {}}],
-        'Wildshape (Gargantuan)': [pre_req_feat,
-            {'descr': 'May shapeshift into gargantuan animals',
-            'reqs': {'feats': 'Wildshape (Huge)'}}],
-        'Wildshape (Huge)': [pre_req_feat,
-            {'descr': 'May shapeshift into huge animals',
-            'reqs': {}}],
-        'Wildshape (Fine)': [pre_req_feat,
-            {'descr': 'May shapeshift into fine sized animals',
-            'reqs': {'feats': 'Wildshape (Diminutive)'}}],
-        'Dragon Shape': [pre_req_feat,
-            {'descr': 'May shapeshift into Dragon. '\
-                    'Maximum size is determined by Wildshape feats',
-            'reqs': {'wis': 30}}],
-        'Fast Healing': [epic_fast_healing,
-            {'descr': '(Improved HP regeneration)',
-            'reqs': {'con': 25}}],
-        'Energy Resistance': fighter_epic_bonus_feats['Energy Resistance'],
-        'Spell Penetration': spell_penetration,
-        'Greater Spell Penetration':
-            cleric_epic_bonus_feats['Greater Spell Penetration'],
-        'Epic Spell Penetration':
-            cleric_epic_bonus_feats['Epic Spell Penetration']
-            }
+bard_epic_bonus_feats = {
+    'Impr. Combat Casting': cleric_epic_bonus_feats['Impr. Combat Casting'],
+    'Epic Skill Focus': rogue_epic_bonus_feats['Epic Skill Focus'],
+    'Polyglot': Feat(epic_polyglot,
+        descr='Can speak all languages',
+        reqs={'int': 25})}
+
+epic_bonus_feats = {
+    'fighter': fighter_epic_bonus_feats,
+    'paladin': fighter_epic_bonus_feats,
+    'monk': fighter_epic_bonus_feats,
+    'barbarian': fighter_epic_bonus_feats,
+    'ranger': fighter_epic_bonus_feats,
+    'rogue': rogue_epic_bonus_feats,
+    'cleric': cleric_epic_bonus_feats,
+    'druid': druid_epic_bonus_feats,
+    'wizard': wizard_epic_bonus_feats,
+    'sorcerer': wizard_epic_bonus_feats,
+    'bard': bard_epic_bonus_feats,
+    }
 
-    wizard_epic_bonus_feats = {
-        'Impr. Combat Casting': cleric_epic_bonus_feats['Impr. Combat Casting'],
-        'Spell Penetration': spell_penetration,
-        'Greater Spell Penetration':
-            cleric_epic_bonus_feats['Greater Spell Penetration'],
-        'Epic Spell Penetration':
-            cleric_epic_bonus_feats['Epic Spell Penetration']
-            }
+# Every feat by name
+feats = merge_dicts(general_feats, magic_feats, metamagic_feats,
+                    fighter_bonus_feats, wizard_bonus_feats,
+                    monk_bonus_feats, epic_feats, fighter_epic_bonus_feats,
+                    rogue_epic_bonus_feats, cleric_epic_bonus_feats,
+                    druid_epic_bonus_feats, wizard_epic_bonus_feats,
+                    bard_epic_bonus_feats)
+
+# Feat names of each table in the order feats are drawn
+feat_choices = dict((id(table), tuple(sorted(table)))
+                    for table in gen_feats.values()
+                    + non_epic_bonus_feats.values()
+                    + epic_bonus_feats.values() + [epic_feats])
+
+# Feat prerequisite graph ================================================
+#
+#   stat_dependents     feats requiring a minimum value of a character
+#                       attribute (ability score, bab, lvl, sneak_attack)
+#   feat_dependents     feats requiring another feat. These edges form a
+#                       DAG, which is checked at import
+#
+#   EligibleFeats keeps the feats a character qualifies for and re-checks
+#   only the dependents of what changed since it last looked.
+#
+# =========================================================================
 
-    bard_epic_bonus_feats = {
-        'Impr. Combat Casting': cleric_epic_bonus_feats['Impr. Combat Casting'],
-        'Epic Skill Focus': rogue_epic_bonus_feats['Epic Skill Focus'],
-        'Polyglot': [epic_polyglot,
-            {'descr': 'Can speak all languages',
-            'reqs': {'int': 25}}]}
-
-    epic_bonus_feats = {
-        'fighter': fighter_epic_bonus_feats,
-        'paladin': fighter_epic_bonus_feats,
-        'monk': fighter_epic_bonus_feats,
-        'barbarian': fighter_epic_bonus_feats,
-        'ranger': fighter_epic_bonus_feats,
-        'rogue': rogue_epic_bonus_feats,
-        'cleric': cleric_epic_bonus_feats,
-        'druid': druid_epic_bonus_feats,
-        'wizard': wizard_epic_bonus_feats,
-        'sorcerer': wizard_epic_bonus_feats,
-        'bard': bard_epic_bonus_feats,
-        }
+def feat_graph():
+    """ Return (stat_dependents, feat_dependents) of the registry """
+    stat_dependents = {}
+    feat_dependents = {}
+    for name, feat in feats.items():
+        for requirement, val in feat.reqs.items():
+            if isinstance(val, str):
+                feat_dependents.setdefault(val, set()).add(name)
+            else:
+                stat_dependents.setdefault(requirement, set()).add(name)
+    return stat_dependents, feat_dependents
+
+stat_dependents, feat_dependents = feat_graph()
+
+def check_feat_graph():
+    """ Raise ValueError if feat prerequisites are circular """
+    done = set()
+    def visit(name, path):
+        if name in path:
+            raise ValueError('Circular feat prerequisites: %s'
+                             % ' -> '.join(path + [name]))
+        if name in done:
+            return
+        for dependent in feat_dependents.get(name, ()):
+            visit(dependent, path + [name])
+        done.add(name)
+    for name in sorted(feat_dependents):
+        visit(name, [])
+
+check_feat_graph()
+
+class EligibleFeats(object):
+    """ Feats whose prerequisites the character ´npc´ meets. refresh()
+    brings the set up to date after the character has changed.
+
+    ´retries_avoided´ counts the draws the former pick-and-check loop
+    would have wasted on feats the character did not qualify for: the
+    expected number of misses for each pick, or all its 100 tries if
+    nothing qualified """
+
+    def __init__(self, npc):
+        self.npc = npc
+        self.met = set(name for name, feat in feats.items()
+                       if not feat.reqs)
+        self.values = {}
+        self.present = set()
+        self.seen_feats = None
+        self.retries_avoided = 0.0
+
+    def refresh(self):
+        npc = self.npc
+        stale = set()
+        for attribute, dependents in stat_dependents.items():
+            value = npc.__dict__[attribute]
+            if self.values.get(attribute) != value:
+                self.values[attribute] = value
+                stale.update(dependents)
+        # Feats are only ever added
+        if len(npc.feats) != self.seen_feats:
+            self.seen_feats = len(npc.feats)
+            for name, dependents in feat_dependents.items():
+                if name not in self.present and name in npc.feats:
+                    self.present.add(name)
+                    stale.update(dependents)
+        for name in stale:
+            if feats[name].check_reqs(npc):
+                self.met.add(name)
+            else:
+                self.met.discard(name)
+
+    def candidates(self, table):
+        """ Feats of ´table´ the character qualifies for and does not
+        have yet, in drawing order """
+        self.refresh()
+        available = [name for name in feat_choices[id(table)]
+                     if name not in self.npc.feats]
+        candidates = [name for name in available if name in self.met]
+        if candidates:
+            self.retries_avoided += (len(available) - len(candidates))\
+                / float(len(candidates))
+        elif available:
+            self.retries_avoided += 100
+        return candidates
+
+# Define basic feat progression
+feat_progression = [1] + [x for x in range(3,40,3)]
+
+def takes_feats(char_class, class_level):
+    """ Check if ´char_class´ gains feats at class level ´class_level´ """
+    return class_level in feat_progression\
+        or class_level in class_specs[char_class]['bonus_feats']
+
+def pick_feats(npc, table, index, rng=random, eligible=None):
+    """ Pick a feat from ´table´ the character qualifies for and does
+    not have yet. Feats whose effect cannot be applied (e.g. Weapon
+    Focus without weapon proficiencies) are dropped and another one is
+    drawn. Returns the name of the feat taken or None """
+    if eligible is None:
+        eligible = EligibleFeats(npc)
+    candidates = eligible.candidates(table)
+    while candidates:
+        pick = rng.choice(candidates)
+        feat = table[pick]
+        if feat.effect(npc, pick, feat, index, rng):
+            return pick
+        candidates.remove(pick)
+
+def add_feats(npc, act_cls, act_cls_lvl, act_cls_lvl_max, comb_level,
+              rng=random, eligible=None):
+    """ Give the feats of the class level. ´eligible´ is the
+    EligibleFeats of the character, kept from level to level """
+
+    # Temporary variables, fix later
+    npc.str = npc.abilities['str']
+    npc.con = npc.abilities['con']
+    npc.dex = npc.abilities['dex']
+    npc.wis = npc.abilities['wis']
+    npc.int = npc.abilities['int']
+    npc.cha = npc.abilities['cha']
+    npc.lvl = act_cls_lvl
 
-    def pick_feats(available_feats, feats):
-        picked = False
-        max_iteration = 0
-        while not picked:
-            pick = random.choice(available_feats)
-            if isinstance(feats[pick], str):
-                npc.feats[pick] = feats[pick]
-                picked = True
-            if isinstance(feats[pick], list):
-                if hasattr(feats[pick][0], '__call__'):
-                    args = feats[pick][1]
-                    picked = feats[pick][0](pick, args, index)
-            if hasattr(feats[pick], '__call__'):
-                picked = feats[pick](pick)
-            max_iteration += 1
-            # Safety mechanism if no feats available
-            if max_iteration == 100:
-                picked = True
-
-    # Define basic feat progression
-    feat_progression = [1] + [x for x in range(3,40,3)]
     bonus_feat_progression = class_specs[act_cls]['bonus_feats']
 
+    if eligible is None:
+        eligible = EligibleFeats(npc)
+
     # Active class index for skillpoints
     index = npc.Class.index(act_cls)
     if act_cls_lvl in feat_progression:
         if comb_level < 21:
-            available = list(set(gen_feats[act_cls].keys()) - set(npc.feats.keys()))
-            # Prevent feeding empty arrays to random.choice()
-            if len(available) > 0:
-                pick_feats(available, gen_feats[act_cls])
+            pick_feats(npc, gen_feats[act_cls], index, rng, eligible)
         else:
-            available = list(set(epic_feats.keys()) - set(npc.feats.keys()))
-            if len(available) > 0:
-                pick_feats(available, epic_feats)
+            pick_feats(npc, epic_feats, index, rng, eligible)
 
-    print(act_cls, act_cls_lvl, '# DEBUG #######################')
     if act_cls_lvl in bonus_feat_progression:
         if comb_level < 21:
             bfeats = non_epic_bonus_feats[act_cls]
         else:
             bfeats = epic_bonus_feats[act_cls]
-        available = list(set(bfeats.keys()) - set(npc.feats.keys()))
-        # Prevent feeding empty arrays to random.choice()
-        if len(available) > 0:
-            pick_feats(available, bfeats)
+        pick_feats(npc, bfeats, index, rng, eligible)
 
 
 # ======= DEFINITIONS END =================================================
@@ -3,8 +3,19 @@
 
 __version__ = "$1.0$"
 
+import argparse
+import bisect
+import collections
+import copy
+import gc
+import itertools
+import multiprocessing
+import os
 import random
 import re
+import shutil
+import sys
+import dnd35_cache as caches
 import dnd35_defs as dnd
 import html_template as html_sheet
 
@@ -17,7 +28,6 @@ import html_template as html_sheet
 # Python 2.7 -- A. Sahala 2014
 # #####################################################################
 
-NPC = dnd.Character()
 roll = dnd.roll_dice
 d00 = dnd.dice['d00']
 d20 = dnd.dice['d20']
@@ -26,20 +36,418 @@ d8 = dnd.dice['d8']
 d6 = dnd.dice['d6']
 d4 = dnd.dice['d4']
 
+# Character specifications =============================================
+#
+#   Declarative replacement for the interactive menus. Every field may
+#   be 'random'. ´class´ may name two classes for a multi-class
+#   character, e.g. 'fighter/wizard'. ´level_type´ may be given without
+#   the level range, e.g. 'novice'.
+#
+# =====================================================================
+
+class_types = {'standard': '1', 'npc': '2'}
+spec_fields = ['class_type', 'gender', 'race', 'alignment', 'class',
+               'age_type', 'power', 'level_type']
+default_spec = dict((field, 'random') for field in spec_fields)
+default_spec['class_type'] = 'standard'
+
+def make_spec(spec=None, **fields):
+    """ Return a complete character specification from ´spec´ and/or
+    keyword fields. Missing fields are random, except a missing class
+    type, which is standard unless the class is an NPC class. Raises
+    ValueError if no legal character fits the specification (see
+    spec_characters) """
+    if spec is not None and not isinstance(spec, dict):
+        raise ValueError('A specification must be a mapping of fields')
+    new_spec = default_spec.copy()
+    typed = False
+    for source in (spec or {}), fields:
+        for field, value in source.items():
+            if field not in spec_fields:
+                raise ValueError('Unknown specification field "%s"' % field)
+            if value is not None:
+                new_spec[field] = str(value).lower()
+                typed = typed or field == 'class_type'
+    if not typed and any(value in class_type_classes['npc']
+                         for value in new_spec['class'].split('/')):
+        new_spec['class_type'] = 'npc'
+    for field in sorted(spec_field_values):
+        value = new_spec[field]
+        if value != 'random' and value not in spec_field_values[field]:
+            raise ValueError('Unknown %s "%s"'
+                             % (field.replace('_', ' '), value))
+    spec_characters(new_spec)
+    return new_spec
+
+# Menu answers of the fields not restricted by the other fields. Level
+# types may be given without their level range
+spec_field_values = {
+    'gender': list(dnd.genders),
+    'age_type': sorted(dnd.aging_modifiers),
+    'power': sorted(dnd.power_types),
+    'level_type': sorted(dnd.level_types)
+                  + sorted(key.split('\t')[0] for key in dnd.level_types)}
+
+# Classes of each class type; only standard characters may multi-class
+class_type_classes = {'standard': dnd.classes['any'],
+                      'npc': dnd.classes['civilian']}
+multi_class_types = ['standard']
+
+# Legal characters of each specification, filled as specifications
+# are seen. Fields are checked before, thus the table stays bounded
+spec_character_table = {}
+
+def spec_characters(spec):
+    """ Return the legal characters fitting the class type, race,
+    alignment and class of the complete specification ´spec´ as
+    {(class_type, is_multiclass): [(race, alignment, classes), ...]}.
+    Raises ValueError if there are none """
+    key = (spec['class_type'], spec['race'], spec['alignment'],
+           spec['class'])
+    characters = spec_character_table.get(key)
+    if characters is not None:
+        return characters
+
+    class_type, race, alignment, wanted = key
+    wanted = wanted.split('/')
+    for field, value, allowed in (
+            ('class type', class_type, class_types),
+            ('race', race, dnd.races['any']),
+            ('alignment', alignment, dnd.alignment_types['any'])):
+        if value != 'random' and value not in allowed:
+            raise ValueError('"%s" is not a %s' % (value, field))
+    if len(wanted) > 2:
+        raise ValueError('A character can have at most two classes')
+    for value in wanted:
+        if value != 'random' and value not in dnd.class_specs:
+            raise ValueError('"%s" is not a class' % value)
+
+    characters = {}
+    for character in dnd.legal_characters:
+        if race not in ['random', character[0]]\
+        or alignment not in ['random', character[1]]:
+            continue
+        classes = character[2]
+        if wanted != ['random']:
+            if len(wanted) != len(classes)\
+            or any(value not in ['random', char_class]
+                   for value, char_class in zip(wanted, classes)):
+                continue
+        for type_ in sorted(class_types):
+            if class_type not in ['random', type_]:
+                continue
+            if len(classes) == 2 and type_ not in multi_class_types:
+                continue
+            if all(c in class_type_classes[type_] for c in classes):
+                characters.setdefault((type_, len(classes) == 2),
+                                      []).append(character)
+    if not characters:
+        raise ValueError('No legal character has the class type, race, '
+                         'alignment and class of the specification')
+    spec_character_table[key] = characters
+    return characters
+
+def character_weight(character, weights):
+    """ Product of the weights of the race, alignment and classes of
+    ´character´. ´weights´ maps 'race', 'alignment' and 'class' to
+    {value: weight}; values left out weigh 1 """
+    race, alignment, classes = character
+    weight = weights.get('race', {}).get(race, 1)\
+        * weights.get('alignment', {}).get(alignment, 1)
+    for char_class in classes:
+        weight *= weights.get('class', {}).get(char_class, 1)
+    return weight
+
+def random_character(spec, rng=random, weights=None):
+    """ Draw (class_type, race, alignment, classes) fitting the complete
+    specification ´spec´ from the legal characters. Random class types
+    are equally likely and a random class is a multi-class one with a
+    probability of 1/4, as in the menus; otherwise every legal character
+    is equally likely, or as likely as its weight (see character_weight)
+    if ´weights´ are given. Class types and single or multi-class
+    characters the weights rule out are never drawn """
+    if weights:
+        characters = weighted_characters(spec, weights)
+    else:
+        characters = spec_characters(spec)
+
+    types = sorted(set(type_ for type_, multi in characters))
+    class_type = types[0] if len(types) == 1 else rng.choice(types)
+    multi = sorted(multi for type_, multi in characters
+                   if type_ == class_type)
+    if len(multi) == 2:
+        multi = rng.choice([True] + [False]*3)
+    else:
+        multi = multi[0]
+    characters = characters[(class_type, multi)]
+
+    if not weights:
+        return (class_type,) + rng.choice(characters)
+    characters, totals = characters
+    index = bisect.bisect_right(totals, rng.random() * totals[-1])
+    return (class_type,) + characters[min(index, len(characters) - 1)]
+
+# Cumulative weights of the legal characters of each specification and
+# weights, filled as they are seen
+weighted_character_table = {}
+
+def weighted_characters(spec, weights):
+    """ Return the legal characters of spec_characters(spec) whose
+    (class_type, is_multiclass) bucket the ´weights´ do not rule out, as
+    {bucket: (characters, cumulative weights)}. Raises ValueError if
+    the weights rule out every character """
+    key = (spec['class_type'], spec['race'], spec['alignment'],
+           spec['class'], weights_key(weights))
+    characters = weighted_character_table.get(key)
+    if characters is not None:
+        return characters
+
+    characters = {}
+    for bucket, members in spec_characters(spec).items():
+        total = 0
+        totals = []
+        for character in members:
+            total += character_weight(character, weights)
+            totals.append(total)
+        if total > 0:
+            characters[bucket] = (members, totals)
+    if not characters:
+        raise ValueError('The weights rule out every character of the '
+                         'specification')
+    weighted_character_table[key] = characters
+    return characters
+
+def weights_key(weights):
+    """ Return a hashable key of character ´weights´ """
+    return tuple(sorted((field, tuple(sorted(values.items())))
+                        for field, values in (weights or {}).items()))
+
+def spec_key(spec):
+    """ Return a hashable key of the complete specification ´spec´ """
+    return tuple(spec[field] for field in spec_fields)
+
+def parse_spec(text):
+    """ Parse a specification written as ´field=value,...´, e.g.
+    ´class=fighter,level_type=adventurer´ """
+    spec = {}
+    for item in text.split(','):
+        if item.strip() and item.strip() != 'random':
+            field, sep, value = item.partition('=')
+            if not sep:
+                raise ValueError('Expected field=value, got "%s"' % item)
+            spec[field.strip().replace('-', '_')] = value.strip()
+    return make_spec(spec)
+
+def format_spec(spec):
+    """ Inverse of parse_spec. Random fields are left out """
+    return ','.join('%s=%s' % (field, spec[field]) for field in spec_fields
+                    if spec[field] != default_spec[field]) or 'random'
+
+def build_npc(spec=None, seed=None, cache=None, weights=None):
+    """ Build a character non-interactively from ´spec´ (see make_spec)
+    using ´seed´ for every random choice. Raises ValueError if the
+    specification breaks race, alignment or class restrictions. Random
+    race, alignment and classes are drawn according to ´weights´ (see
+    random_character).
+
+    With a ´cache´ (dnd35_cache.CharacterCache) the character is built
+    only if it is not found there. Characters of random seeds (´seed´
+    None) are not cached """
+    spec = make_spec(spec)
+    if seed is None:
+        cache = None
+    if cache is not None:
+        key = (spec_key(spec), seed, dnd.RULES_VERSION)
+        if weights:
+            key += (weights_key(weights),)
+        npc = cache.get(key)
+        if npc is not None:
+            return npc
+    builder = NPCBuilder(rng=seed)
+    UIBuilder(False, False, builder.npc, builder.rng, spec,
+              weights).generate_menu()
+    npc = builder.generate()
+    if cache is not None:
+        cache.put(key, npc)
+    return npc
+
+def build_batch_members(spec, seed, start, count):
+    """ Build ´count´ consecutive members of the batch ´seed´ """
+    return [build_npc(spec, dnd.derive_seed(seed, index))
+            for index in range(start, start + count)]
+
+def render_batch_members(spec, seed, start, count, cache=None):
+    """ Render the sheets of ´count´ consecutive members of the batch
+    ´seed´. Returns (npc, sheet) pairs. Sheets found in ´cache´ (a
+    dnd35_cache.SheetCache) are not rebuilt; their npc is None """
+    sheets = []
+    for index in range(start, start + count):
+        member_seed = dnd.derive_seed(seed, index)
+        sheet = None
+        if cache is not None:
+            key = cache.key(spec, member_seed)
+            sheet = cache.get(key)
+        if sheet is not None:
+            sheets.append((None, sheet))
+            continue
+        npc = build_npc(spec, member_seed)
+        sheet = render_sheet(npc)
+        if cache is not None:
+            cache.put(key, sheet)
+        sheets.append((npc, sheet))
+    return sheets
+
+def _init_worker():
+    # The cyclic collector would write to the header of every object it
+    # visits, unsharing the pages of the rules tables. Generation creates
+    # no reference cycles, so the workers can do without it
+    gc.disable()
+
+def make_pool(jobs):
+    """ Fork a pool of ´jobs´ worker processes. The rules are imported
+    and a first character built in the parent before forking, thus the
+    workers share the rules tables copy-on-write instead of each building
+    its own copy. The parent's objects are moved out of reach of the
+    collector (gc.freeze on Python 3.7+) for the same reason """
+    build_npc(seed=0)
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork').Pool(jobs, _init_worker)
+    return multiprocessing.Pool(jobs, _init_worker)
+
+def worker_memory(pool):
+    """ Return (pid, rss, pss, private) in kB for each worker of ´pool´.
+    PSS counts shared pages divided by the number of processes sharing
+    them; private pages are those a worker does not share at all.
+    Linux only, values missing from /proc are None """
+    memory = []
+    # Pool does not publish its workers
+    for process in pool._pool:
+        fields = {}
+        for name in ('smaps_rollup', 'status'):
+            try:
+                with open('/proc/%i/%s' % (process.pid, name)) as f:
+                    for line in f:
+                        key, _, value = line.partition(':')
+                        if value.strip().endswith('kB'):
+                            fields.setdefault(key, int(value.split()[0]))
+            except IOError:
+                pass
+        private = None
+        if 'Private_Clean' in fields:
+            private = fields['Private_Clean'] + fields['Private_Dirty']
+        memory.append((process.pid, fields.get('Rss', fields.get('VmRSS')),
+                       fields.get('Pss'), private))
+    return memory
+
+def iter_npcs(spec=None, seed=None, limit=None, start=0, jobs=1,
+              chunk_size=4, pool=None):
+    """ Lazily generate finished characters of the batch ´seed´ from
+    ´spec´, starting at batch index ´start´. Generation is endless unless
+    ´limit´ is given; stop iterating whenever enough characters are seen.
+
+    The seed of each character is stored in its ´seed´ attribute, thus
+    a dropped character can be rebuilt with build_npc(spec, npc.seed).
+
+    With ´jobs´ > 1 characters are built in a pool of worker processes,
+    ´chunk_size´ characters per task. Since every character has its own
+    seed, the results do not depend on scheduling, and they are yielded
+    in batch order. An existing ´pool´ (see make_pool) of ´jobs´ workers
+    may be given; it is left running for the caller.
+
+    Without a ´seed´ a random batch seed is drawn. The seed of the batch
+    is kept in the ´seed´ attribute of the returned iterator """
+    if seed is None:
+        seed = dnd.random_seed()
+    spec = make_spec(spec)
+    return NPCBatch(seed, iter_batch(build_batch_members, (), spec, seed,
+                                     limit, start, jobs, chunk_size, pool))
+
+class NPCBatch():
+    """ Iterator over the characters of the batch ´seed´ (see iter_npcs).
+    Closing it stops the workers of a pool it started """
+
+    def __init__(self, seed, npcs):
+        self.seed = seed
+        self.npcs = npcs
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.npcs)
+
+    __next__ = next
+
+    def close(self):
+        self.npcs.close()
+
+def iter_batch(members, args, spec, seed, limit=None, start=0, jobs=1,
+               chunk_size=4, pool=None):
+    """ Yield the items of members(spec, seed, first, count, *args) for
+    consecutive chunks of the batch ´seed´ (see iter_npcs) """
+    if limit is None:
+        stop = None
+    else:
+        stop = start + limit
+
+    if jobs <= 1 and pool is None:
+        index = start
+        while stop is None or index < stop:
+            for item in members(spec, seed, index, 1, *args):
+                yield item
+            index += 1
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool(jobs)
+    try:
+        # Keep a bounded window of tasks in flight. The queue doubles as
+        # a reorder buffer: chunks finishing early wait until all chunks
+        # before them have been yielded
+        pending = collections.deque()
+        chunks = itertools.count(start, chunk_size)
+        while True:
+            while len(pending) < max(jobs, 1) * 2:
+                first = next(chunks)
+                if stop is not None and first >= stop:
+                    break
+                count = chunk_size if stop is None\
+                    else min(chunk_size, stop - first)
+                pending.append(pool.apply_async(members,
+                    (spec, seed, first, count) + tuple(args)))
+            if not pending:
+                break
+            for item in pending.popleft().get():
+                yield item
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
 class NPCBuilder():
 
-    def __init__(self):
+    def __init__(self, npc=None, rng=None):
+        """ Each builder owns the character it develops. Pass ´npc´ to
+        continue with an existing (e.g. menu-initialized) character,
+        otherwise a new one is created.
+
+        ´rng´ is a seed or a random.Random instance. All dice rolls and
+        random choices of the builder are drawn from it, thus the same
+        character specification and seed always give the same NPC """
+        if npc is None:
+            npc = dnd.Character()
+        if rng is not None and not isinstance(rng, random.Random):
+            npc.seed = rng
+        self.npc = npc
+        self.rng = dnd.get_rng(rng)
         self.use_only_standard_rolls = False
         self.current_level = 0
-
-    def check_if_racial_bonus(self, bonus, null):
-        ret = null
-        """ Call this fuction to check if racial bonuses are available
-        ´bonus´ = category name, ´type_´ = return if not available"""
-        if 'bonuses' in dnd.race_specs[NPC.race].keys():
-            if bonus in dnd.race_specs[NPC.race]['bonuses'].keys():
-                ret = dnd.race_specs[NPC.race]['bonuses'][bonus]
-        return ret
+        # Feats the character qualifies for, kept up to date while leveling
+        self.eligible_feats = dnd.EligibleFeats(npc)
 
     def make_priority_order(self, char_class, race_specs):
         """ Create a hybrid priorization table for multi-class characters
@@ -56,166 +464,163 @@ class NPCBuilder():
 
             STR -> INT -> CON -> DEX -> WIS -> CHA
 
-        """
+        The orders of all class pairs are precomputed in
+        dnd.priority_orders (see dnd.hybrid_priority_order) """
+        npc = self.npc
 
         if len(char_class) == 2:
-            p_order = []
-            high_class = NPC.Class[NPC.level.index(max(NPC.level))]
-            low_class = NPC.Class[NPC.level.index(min(NPC.level))]
-            for pair in zip(dnd.class_specs[high_class]['ability_priorization'],
-                        dnd.class_specs[low_class]['ability_priorization']):
-                for ability in pair:
-                    if ability not in p_order:
-                        p_order.append(ability)
-                    else:
-                        pass
+            high_class = npc.Class[npc.level.index(max(npc.level))]
+            low_class = npc.Class[npc.level.index(min(npc.level))]
         else:
-            p_order = dnd.class_specs[char_class[0]]['ability_priorization']
-        NPC.priority_order = p_order
+            high_class = low_class = char_class[0]
+        npc.priority_order = list(dnd.priority_orders[(high_class,
+                                                       low_class)])
 
     def distribute_abilities(self, char_class, race_specs):
         """ Assign ability scores following the priority order """
+        npc = self.npc
+        adjustments = dnd.ability_adjustment_vectors[(npc.race,
+                                                      npc.age_type)]
 
-        sort_list = list()
-        for key in NPC.abilities.keys():
-            sort_list.append(NPC.abilities[key])
-
-        sort_list = sorted(sort_list, reverse=True)
-        i = 0
-        for ability in NPC.priority_order:
+        sort_list = sorted(npc.abilities.values(), reverse=True)
+        for i, ability in enumerate(npc.priority_order):
             if sort_list[i] < 3:
                 sort_list[i] = 3
-            ability_score = sort_list[i]\
-                            + race_specs['ability_adjustments'][ability]\
-                            + dnd.aging_modifiers[NPC.age_type][ability]
-            NPC.ability_adjustments[ability] = \
-                            + race_specs['ability_adjustments'][ability]\
-                            + dnd.aging_modifiers[NPC.age_type][ability]
+            ability_score = sort_list[i] + adjustments[ability]
+            npc.ability_adjustments[ability] = adjustments[ability]
 
             # Disallow scores lower than 3
             if ability_score < 3:
                 ability_score = 3
 
-            NPC.abilities[ability] = ability_score
-            i += 1
+            npc.abilities[ability] = ability_score
         self.update_ability_mods()
 
+    def update_attacks(self):
+        """ Count how many attacks character can make. None indicates
+        that the BAB is too low for gaining an additional attack """
+        npc = self.npc
+        i = 1
+        for new_attack in range(0, 16, 5):
+            attack = npc.bab - new_attack
+            if attack > 1:
+                npc.attacks[i] = attack
+            else:
+                if i > 1:
+                    npc.attacks[i] = None
+                else:
+                    npc.attacks[i] = attack
+            i += 1
+
     def update_variables(self):
-        cha_mod = NPC.ability_mods['cha']
-        wis_mod = NPC.ability_mods['wis']
-        str_mod = NPC.ability_mods['str']
-        size = NPC.size
-        race_specs = dnd.race_specs[NPC.race]
+        npc = self.npc
+        cha_mod = npc.ability_mods['cha']
+        wis_mod = npc.ability_mods['wis']
+        str_mod = npc.ability_mods['str']
+        size = npc.size
+        race_specs = dnd.race_specs[npc.race]
+        racial = dnd.racial_bonuses[npc.race]
 
         def update_AC():
             """ Special AC modifiers """
-            specials = self.check_if_racial_bonus('special_armor_bonus', dict())
+            specials = racial.special_armor_bonus
             for b in specials.keys():
                 for k in specials[b].keys():
-                    NPC.ac_special_bonuses[b][k] += specials[b][k]
+                    npc.ac_special_bonuses[b][k] += specials[b][k]
 
             """ Check racial modifiers """
-            racial_bonus = self.check_if_racial_bonus('armor', dict())
-            for b in racial_bonus.keys():
-                NPC.ac_modifiers[b] = racial_bonus[b]
+            for b in racial.armor.keys():
+                npc.ac_modifiers[b] = racial.armor[b]
 
             """ Check item modifiers """
 
-            if NPC.wears_armor:
+            if npc.wears_armor:
                 unarmored = 0
             else:
-                if NPC.wisdom_to_ac:
-                    unarmored = NPC.ac_unarmored_bonus+NPC.ability_mods['wis']
+                if npc.wisdom_to_ac:
+                    unarmored = npc.ac_unarmored_bonus+npc.ability_mods['wis']
                 else:
-                    unarmored = NPC.ac_unarmored_bonus
-
-            NPC.ac_modifiers['mods'] = NPC.ability_mods['dex']
-            NPC.ac_modifiers['size'] = dnd.ac_size_adj[NPC.size]
-            NPC.ac_base = 10 + unarmored
-            total_ac = NPC.ac_base
-
-            for bonus in NPC.ac_modifiers.keys():
-                total_ac += NPC.ac_modifiers[bonus]
-            NPC.ac = total_ac
-            NPC.ac_touch = NPC.ac_base + NPC.ability_mods['dex']\
-                                        + NPC.ac_modifiers['size']
-            if "Uncanny Dodge" in NPC.class_feats.keys():
-                NPC.ac_flat_footed = NPC.ac
+                    unarmored = npc.ac_unarmored_bonus
+
+            npc.ac_modifiers['mods'] = npc.ability_mods['dex']
+            npc.ac_modifiers['size'] = dnd.ac_size_adj[npc.size]
+            npc.ac_base = 10 + unarmored
+            total_ac = npc.ac_base
+
+            for bonus in npc.ac_modifiers.keys():
+                total_ac += npc.ac_modifiers[bonus]
+            npc.ac = total_ac
+            npc.ac_touch = npc.ac_base + npc.ability_mods['dex']\
+                                        + npc.ac_modifiers['size']
+            if "Uncanny Dodge" in npc.class_feats.keys():
+                npc.ac_flat_footed = npc.ac
             else:
-                NPC.ac_flat_footed = NPC.ac - NPC.ability_mods['dex']
+                npc.ac_flat_footed = npc.ac - npc.ability_mods['dex']
 
         def update_saves():
             # Special bonuses
-            spec_bonus = self.check_if_racial_bonus('special_save_bonus',
-                                                                dict())
+            spec_bonus = racial.special_save_bonus
             for b in spec_bonus.keys():
                 for k in spec_bonus[b].keys():
-                    NPC.save_special_bonuses[b][k] += spec_bonus[b][k]
+                    npc.save_special_bonuses[b][k] += spec_bonus[b][k]
 
             # General saves
-            empty = {'fort': 0, 'ref': 0, 'will': 0}
             bonus = 0
-            if NPC.charisma_to_saves:
-                bonus = NPC.ability_mods['cha']
+            if npc.charisma_to_saves:
+                bonus = npc.ability_mods['cha']
 
-            racial = self.check_if_racial_bonus('saves', empty)
-
-            for save in NPC.saves_mods.keys():
-                NPC.saves_mods[save]['misc'] += racial[save] + bonus
+            for save in npc.saves_mods.keys():
+                npc.saves_mods[save]['misc'] += racial.saves[save] + bonus
 
             key_abs = {
-                'fort': NPC.ability_mods['con'],
-                'ref': NPC.ability_mods['dex'],
-                'will': NPC.ability_mods['wis']}
+                'fort': npc.ability_mods['con'],
+                'ref': npc.ability_mods['dex'],
+                'will': npc.ability_mods['wis']}
 
-            for save in NPC.saves_mods.keys():
-                NPC.saves_mods[save]['ab'] = key_abs[save]
-                NPC.saves_total[save] = NPC.saves_mods[save]['ab']\
-                                        + NPC.saves_mods[save]['mag']\
-                                        + NPC.saves_mods[save]['misc']\
-                                        + NPC.saves_base[save]
+            for save in npc.saves_mods.keys():
+                npc.saves_mods[save]['ab'] = key_abs[save]
+                npc.saves_total[save] = npc.saves_mods[save]['ab']\
+                                        + npc.saves_mods[save]['mag']\
+                                        + npc.saves_mods[save]['misc']\
+                                        + npc.saves_base[save]
 
         def update_class_feats():
             """ Recount lay on hands magnitude """
-            if 'Lay on Hands' in NPC.class_feats.keys():
+            if 'Lay on Hands' in npc.class_feats.keys():
                 if cha_mod > 0:
-                    level = NPC.class_feats['Lay on Hands'][0]
+                    level = npc.class_feats['Lay on Hands'][0]
                     txt = 'Heal {amt} HPs/day (may be used in small portions)'\
                                     .format(amt=(str(cha_mod*level)))
-                    NPC.class_feats['Lay on Hands'] = (level, txt)
+                    npc.class_feats['Lay on Hands'] = (level, txt)
 
             """ Recount smite evil magnitude """
             feat = 'Smite Evil'
-            if feat in NPC.class_feats.keys():
-                level = NPC.class_feats[feat][0]
+            if feat in npc.class_feats.keys():
+                level = npc.class_feats[feat][0]
                 amount = (level/5)+1
                 txt = '+{hit} to hit, +{dmg} to dmg vs. evil ({amt}/day)'\
                                 .format(amt=amount,
                                         hit=cha_mod,
                                         dmg=level)
-                NPC.class_feats[feat] = (level, txt)
+                npc.class_feats[feat] = (level, txt)
 
             feat = "Quivering Palm"
-            if feat in NPC.class_feats.keys():
-                level = NPC.class_feats[feat][0]
+            if feat in npc.class_feats.keys():
+                level = npc.class_feats[feat][0]
                 txt = "Enemy must do a successful fortitude save vs. {DC} or die (1/week)".format(
                     DC = ((level/2)+wis_mod+10))
-                NPC.class_feats[feat] = (level, txt)
+                npc.class_feats[feat] = (level, txt)
 
         def update_speed():
-            if not NPC.wears_armor:
-                bonus = NPC.unarmored_speed_bonus
+            if not npc.wears_armor:
+                bonus = npc.unarmored_speed_bonus
             else:
                 bonus = 0
-            NPC.speed = NPC.speed_base + NPC.speed_bonus + bonus
+            npc.speed = npc.speed_base + npc.speed_bonus + bonus
 
         def update_grapple():
-            bonus = self.check_if_racial_bonus('grapple', 0)
-            """
-            if 'bonuses' in race_specs.keys():
-                if 'grapple' in race_specs['bonuses']:
-                    bonus = race_specs['bonuses']['grapple']"""
-            NPC.grapple = NPC.bab + str_mod + dnd.grapple_adj[size] + bonus
+            npc.grapple = npc.bab + str_mod + dnd.grapple_adj[size]\
+                + racial.grapple
 
         update_AC()
         update_saves()
@@ -224,112 +629,47 @@ class NPCBuilder():
         update_grapple()
 
     def update_hitpoints(self, change):
+        npc = self.npc
         # Apply changes in constitution to overall hitpoints
-        NPC.hp += (change * self.current_level)
+        npc.hp += (change * self.current_level)
 
     def update_ability_mods(self):
-        """ Update ability score modifiers if scores are changed """
-        old_con_modifier = NPC.ability_mods['con']
-        scoretable = dict()
-        sco = 0
-        min_mod = -5
-        while sco < 50:
-            # Define breakpoints for ability modifier change
-            if sco in range(1, 51, 2): min_mod += 1
-            sco += 1
-            scoretable[sco] = min_mod
-
-        for key in NPC.abilities:
-            NPC.ability_mods[key] = scoretable[NPC.abilities[key]]
-
-        self.update_hitpoints(NPC.ability_mods['con'] - old_con_modifier)
+        """ Update all ability score modifiers after scores are changed,
+        and apply a changed constitution modifier to the hit points of
+        the levels so far """
+        npc = self.npc
+        modifiers = dnd.ability_modifiers
+        mods = npc.ability_mods
+        old_con_modifier = mods['con']
+        for key, score in npc.abilities.items():
+            mods[key] = modifiers[score]
+
+        self.update_hitpoints(mods['con'] - old_con_modifier)
 
     def check_ability_increase(self, level, active_class):
-        """ Ability increases are chosen by class specific priorities """
-        primary_abilities = dnd.class_specs[active_class]\
-                            ['ability_priorization'][0:3]
-        all_abilities = dnd.class_specs[active_class]\
-                        ['ability_priorization'][0:6]
-
-        """ Ability increase priorities:
-        1) Raise severely negative stats to 8 to overcome negative modifiers.
-            If CHA, WIS or DEX are irrelevant for the class, do not raise.
-        2) If caster, pump primary ability to 19 to unlock all spell levels.
-            Bards and Adepts pump primary to 16.
-        3) Raise odd primary abilities having negative modifiers.
-        4) Raise any ability score if 9 to overcome negative modifier,
-            ignore irrelevant stats.
-        5) raise odd positive primary abilities to improve modifiers
-        6) raise primary abilities if under 16. Exception being dexterity
-            if class is a heavy armor user.
-        7) pump two primary abilities randomly, spellcasters pump primary  """
-
-        # Define two least significant ability scores
-        irrelevant = NPC.priority_order[-2:]
-        stat_increased = False
-        if not stat_increased:
-            for key in all_abilities:
-                if NPC.abilities[key] < 8 and key not in irrelevant\
-                and key not in ['cha', 'wis', 'dex']:
-                    NPC.abilities[key] += 1
-                    stat_increased = True
-                    break
-        if not stat_increased:
-            if active_class in dnd.classes['spellcaster']\
-                and NPC.abilities[primary_abilities[0]] < 19:
-                NPC.abilities[primary_abilities[0]] += 1
-                stat_increased = True
-            elif active_class in ['bard', 'adept']\
-                and NPC.abilities[primary_abilities[0]] < 16:
-                NPC.abilities[primary_abilities[0]] += 1
-                stat_increased = True
-        if not stat_increased:
-            for key in primary_abilities:
-                if NPC.abilities[key] in range(1,11,2)\
-                and key not in irrelevant:
-                    NPC.abilities[key] += 1
-                    stat_increased = True
-                    break
-        if not stat_increased:
-            for key in all_abilities:
-                if NPC.abilities[key] in [9]:
-                    NPC.abilities[key] += 1
-                    stat_increased = True
-                    break
-        if not stat_increased:
-            for key in primary_abilities:
-                if NPC.abilities[key] in sorted(range(11,41,2),
-                                                   reverse=True):
-                    NPC.abilities[key] += 1
-                    stat_increased = True
-                    break
-        if not stat_increased:
-            for key in primary_abilities:
-                if NPC.abilities[key] < 16\
-                and active_class not in dnd.classes['armor_user']\
-                and key != 'dex':
-                    NPC.abilities[key] += 1
-                    stat_increased = True
-                    break
-        if not stat_increased:
-            for c in NPC.Class:
-                caster_primary = dnd.class_specs[c]['ability_priorization'][0]
-                if c in dnd.classes['spellcaster']\
-                and caster_primary < 19:
-                    NPC.abilities[caster_primary] += 1
-                    break
-            else:
-                NPC.abilities[random.choice(primary_abilities[0:2])] += 1
-
-            stat_increased = True
+        """ Ability increases are chosen by class specific priorities,
+        see dnd.ability_increase_rules """
+        npc = self.npc
+        # Two least significant ability scores
+        irrelevant = tuple(npc.priority_order[-2:])
+        increase = dnd.ability_increase(active_class, irrelevant,
+                                        npc.abilities)
+        if increase is None:
+            # Pump two primary abilities randomly
+            primary_abilities = dnd.class_specs[active_class]\
+                                ['ability_priorization'][0:2]
+            increase = self.rng.choice(primary_abilities)
+        npc.abilities[increase] += 1
 
     def level_up(self, level, active_class_level):
         """ Level up chacter as long as the wanted char level is met."""
+        npc = self.npc
 
-        self.update_ability_mods() # update_modifiers
+        # Epic ability feats of the previous level raise scores
+        self.update_ability_mods()
 
         """ Define breakpoint after which second class will be developed """
-        breakpoint = NPC.level[0]
+        breakpoint = npc.level[0]
 
         # ==============================================================
         """ Main level up loop consists of following phases:
@@ -345,87 +685,62 @@ class NPCBuilder():
         # Select active class to level
         if level <= breakpoint:
             skill_index = 0 # used to store skills separately
-            active_class = NPC.Class[0]
+            active_class = npc.Class[0]
             active_class_level = level
-            active_class_level_max = NPC.level[0]
+            active_class_level_max = npc.level[0]
         else:
             skill_index = 1
-            active_class = NPC.Class[1]
-            active_class_level = level - NPC.level[0]
-            active_class_level_max = NPC.level[1]
+            active_class = npc.Class[1]
+            active_class_level = level - npc.level[0]
+            active_class_level_max = npc.level[1]
 
 
         HD = dnd.class_specs[active_class]['HD']
 
         # Check if race has a special HD
-        if 'HD' in dnd.race_specs[NPC.race]['bonuses'].keys():
-            if level <= dnd.race_specs[NPC.race]['bonuses']['HD'][1]:
-                if HD < dnd.race_specs[NPC.race]['bonuses']['HD'][0]:
-                    HD = dnd.race_specs[NPC.race]['bonuses']['HD'][0]
+        racial_HD, racial_HD_levels = dnd.racial_bonuses[npc.race].HD
+        if level <= racial_HD_levels and HD < racial_HD:
+            HD = racial_HD
 
         # Max HP roll at level 1
         if level == 1:
-            hp_roll = HD + NPC.ability_mods['con']
+            hp_roll = HD + npc.ability_mods['con']
         else:
             # Adjust HP rolls according to NPC power type
             # e.g. legendary barbarian rolls 3x1d12 and ignores 2 lowest
-            ignore_lowest = dnd.power_types[NPC.power]['hp_roll']
+            ignore_lowest = dnd.power_types[npc.power]['hp_roll']
             times = ignore_lowest + 1
 
-            hp_roll = roll(HD, times, 0, NPC.ability_mods['con'],
-                            ignore_lowest)
+            hp_roll = roll(HD, times, 0, npc.ability_mods['con'],
+                            ignore_lowest, rng=self.rng)
             # Disallow lower rolls than 1
             if hp_roll < 1:
                 hp_roll = 1
 
-        NPC.hp += hp_roll
+        npc.hp += hp_roll
 
         # ==============================================================
         """ Check if eligible for ability increase """
         # ==============================================================
         if level in range(4, 40, 4):
-            print(NPC.abilities)
             self.check_ability_increase(level, active_class)
             self.update_ability_mods()
 
         # ==============================================================
-        """ Increase base attack bonus and saving throws"""
+        """ Base attack bonus for feat prerequisites """
         # ==============================================================
-        if level < 21:
-            NPC.bab += dnd.class_specs[active_class]['bab'][level-1]
-            for key in NPC.saves_base:
-                NPC.saves_base[key]\
-                    += dnd.class_specs[active_class]['saves'][key][level-1]
-        if level in range(21, 40, 1):
-            NPC.bab += dnd.BAB_tables['epic'][level-21]
-            for key in NPC.saves_base:
-                NPC.saves_base[key]\
-                    += dnd.save_tables['epic'][key][level-21]
-
-        # ==============================================================
-        """ Count how many attacks character can make. Nonetype indicates
-        that the BAB is too low for gaining an additional attack """
-        # ==============================================================
-        i = 1
-        for new_attack in range(0, 16, 5):
-            attack = NPC.bab - new_attack
-            if attack > 1:
-                NPC.attacks[i] = attack
-            else:
-                if i > 1:
-                    NPC.attacks[i] = None
-                else:
-                    NPC.attacks[i] = attack
-            i += 1
+        # The final base attack bonus and saves are set after the last
+        # level (see generate). Feats taken on the way need the base
+        # attack bonus of their level
+        if dnd.takes_feats(active_class, active_class_level):
+            npc.bab = self.racial_bab\
+                + dnd.base_attack_bonus(npc.Class, npc.level, level)
 
         # ==============================================================
         """ Increase skills """
         # ==============================================================
-        # Get class skills and cross-class skills
-        bonus = self.check_if_racial_bonus('class_skills', list())
-
-        class_skills = dnd.class_skills[active_class] + bonus
-        cross_skills = list(set(dnd.skills.keys()) - set(class_skills))
+        # Get class skills
+        class_skills = dnd.class_skill_choices(active_class, npc.race)
 
         # Define max ranks for class and cross-class skills
         # Max ranks are based on total level instead of active class level
@@ -437,163 +752,166 @@ class NPCBuilder():
         # for bonus points, defined in ´dnd.bonus_skills´
         if level == 1:
             multiplier = 4
-            if NPC.race in dnd.bonus_skills.keys():
-                bonus = dnd.bonus_skills[NPC.race][0]
+            if npc.race in dnd.bonus_skills.keys():
+                bonus = dnd.bonus_skills[npc.race][0]
             else:
                 bonus = 0
         else:
             multiplier = 1
-            if NPC.race in dnd.bonus_skills.keys():
-                bonus = dnd.bonus_skills[NPC.race][1]
+            if npc.race in dnd.bonus_skills.keys():
+                bonus = dnd.bonus_skills[npc.race][1]
             else:
                 bonus = 0
 
         mod = dnd.class_specs[active_class]['skill_mod'] + bonus
-        points = (mod + NPC.ability_mods['int']) * multiplier
+        points = (mod + npc.ability_mods['int']) * multiplier
         # Character cannot get fewer skill points than the multiplier
         if points < 1:
             points = multiplier + bonus
 
-        # Distribute available skill points
+        # Distribute available skill points. Ranks are stored per class
+        # and kept summed in ´total_skill_points´; the rank limit applies
+        # to the combined ranks
+        class_ranks = npc.skill_points[skill_index].ranks
+        total_ranks = npc.total_skill_points.ranks
         while points > 0:
-            random_index = random.randint(0, len(class_skills)-1)
-            random_skill = NPC.skill_points[skill_index]\
-                                        [class_skills[random_index]]
+            random_index = self.rng.randint(0, len(class_skills)-1)
+            skill = class_skills[random_index]
 
-            if random_skill['ranks'] < class_max_ranks:
-                random_skill['ranks'] += 1
+            if total_ranks[skill] < class_max_ranks:
+                class_ranks[skill] += 1
+                total_ranks[skill] += 1
 
             points -= 1
 
-        # Combine skills from both classes and count bonuses
-        racial_bonus = self.check_if_racial_bonus('skill_bonus', dict())
-
-        for c in NPC.skill_points:
-            for skill in c.keys():
-                key_ability = dnd.skills[skill][2]
-                total_ranks = NPC.total_skill_points[skill]['ranks']
-                total_ranks += c[skill]['ranks']
-                if skill in racial_bonus.keys():
-                    bonus = racial_bonus[skill]
-                    NPC.total_skill_points[skill]['misc_mod'] = bonus
-                if key_ability is not None:
-                    NPC.total_skill_points[skill]['ability_mod']\
-                                = NPC.ability_mods[key_ability]
+        # Count bonuses for combined skills
+        racial_bonus = dnd.racial_bonuses[npc.race].skill_bonus
 
-        self.update_ability_mods()
+        total = npc.total_skill_points
+        for skill, bonus in racial_bonus.items():
+            total.misc_mod[dnd.skill_ids[skill]] = bonus
+        ability_mod = total.ability_mod
+        ability_mods = npc.ability_mods
+        for i, key_ability in enumerate(dnd.skill_key_abilities):
+            if key_ability is not None:
+                ability_mod[i] = ability_mods[key_ability]
 
         # ==============================================================
         """ Set level specific bonuses for classes """
         # ==============================================================
         #NPC = dnd.special_abs(NPC, active_class_level)
-        dnd.special_abs(NPC, active_class, active_class_level,
-                        active_class_level_max)
+        dnd.special_abs(npc, active_class, active_class_level,
+                        active_class_level_max, self.rng)
 
         # ==============================================================
         """ Set feats for classes """
         # ==============================================================
-        dnd.add_feats(NPC, active_class, active_class_level,
-                        active_class_level_max, level)
+        dnd.add_feats(npc, active_class, active_class_level,
+                        active_class_level_max, level, self.rng,
+                        self.eligible_feats)
 
     def generate(self):
         """ This function initializes the character by assigning
-        Levels, ability scores, classes, physical appearance etc. """
-        race = NPC.race
-        gender = NPC.gender
+        Levels, ability scores, classes, physical appearance etc.
+        Returns the finished character. """
+        npc = self.npc
+        race = npc.race
+        gender = npc.gender
         race_specs = dnd.race_specs[race]
         # ===================================================================
 
         """ Randomize Character level """
-        high = dnd.level_types[NPC.level_type][1]
-        low = dnd.level_types[NPC.level_type][0]
-        NPC.effective_level = random.randint(low, high)
-        NPC.total_level = NPC.effective_level - race_specs['level_adjustment']
+        high = dnd.level_types[npc.level_type][1]
+        low = dnd.level_types[npc.level_type][0]
+        npc.effective_level = self.rng.randint(low, high)
+        npc.total_level = npc.effective_level - race_specs['level_adjustment']
 
         # Multi-class characters must be at least level 2
-        if NPC.total_level <= 1 and len(NPC.Class) == 2:
-            NPC.total_level = 2
+        if npc.total_level <= 1 and len(npc.Class) == 2:
+            npc.total_level = 2
 
         # Distribute randomized levels among character classes
-        if not NPC.is_multiclass:
-            NPC.skill_points = [dnd.skill_point_dict.copy()]
-            NPC.level.append(NPC.total_level)
+        if not npc.is_multiclass:
+            npc.skill_points = [dnd.new_skill_points()]
+            npc.level.append(npc.total_level)
         else:
-            NPC.skill_points = [dnd.skill_point_dict.copy()]*2
-            NPC.level = [0,0]
+            npc.skill_points = [dnd.new_skill_points(),
+                                dnd.new_skill_points()]
+            npc.level = [0,0]
             i = 1
-            while i <= NPC.total_level:
+            while i <= npc.total_level:
                 if i == 1:
-                    NPC.level[0] += 1
+                    npc.level[0] += 1
                 elif i == 2:
-                    NPC.level[1] += 1
+                    npc.level[1] += 1
                 else:
-                    NPC.level[random.randint(0, 1)] += 1
+                    npc.level[self.rng.randint(0, 1)] += 1
                 i += 1
         # ===================================================================
         """ Count age. Take into account age modifiers from both
         classes and total level (here divided by 1d6+3) """
         class_age_mods = []
         i = 0
-        for class_ in NPC.Class:
-            dice = race_specs[dnd.class_specs[NPC.Class[i]]['age']][1]
-            rolls = race_specs[dnd.class_specs[NPC.Class[i]]['age']][0]
-            class_age_mods.append(roll(dice, rolls, 0, 0, 0))
+        for class_ in npc.Class:
+            dice = race_specs[dnd.class_specs[npc.Class[i]]['age']][1]
+            rolls = race_specs[dnd.class_specs[npc.Class[i]]['age']][0]
+            class_age_mods.append(roll(dice, rolls, 0, 0, 0, rng=self.rng))
             i += 1
 
         # Roll 1d6+3 and divide total level by it, add this sum to total age
-        divider = roll(d6, 1, 0, 3, 0)
-        modifier = NPC.total_level/divider
+        divider = roll(d6, 1, 0, 3, 0, rng=self.rng)
+        modifier = npc.total_level/divider
         if len(class_age_mods) == 2:
             modifier += max(class_age_mods) + (min(class_age_mods) / 2)
         else:
             modifier += max(class_age_mods)
 
         # If rolled age would give unwanted penalties, reduce it by 1/15th
-        age = race_specs[NPC.age_type] + modifier
-        if NPC.age_type == 'adult' and age > race_specs['middle']:
+        age = race_specs[npc.age_type] + modifier
+        if npc.age_type == 'adult' and age > race_specs['middle']:
             age = race_specs['middle'] - (race_specs['middle']/15)
 
-        NPC.age = age
+        npc.age = age
         # ===================================================================
         """ Count NPC height and weight based on racial stats """
-        base_height = dnd.sizes[race][gender]['base_height']
+        feet, inches = dnd.sizes[race][gender]['base_height']
         base_weight = dnd.sizes[race][gender]['base_weight']
         height_modifier = dnd.sizes[race][gender]['height_mod']
         weight_modifier = dnd.sizes[race][gender]['weight_mod']
 
         # Convert into metric and imperial units
         extra_height = roll(height_modifier[1],
-                            height_modifier[0], 0, 0, 0)
+                            height_modifier[0], 0, 0, 0, rng=self.rng)
         extra_weight = extra_height * roll(weight_modifier[1],
-                                                weight_modifier[0], 0, 0, 0)
-
-        base_height[0] += extra_height / 12
-        base_height[1] += extra_height % 12
-
-        if base_height[1] > 12:
-            base_height[1] -= 12
-            base_height[0] += 1
-
-        NPC.physical['ft'] += base_height[0]
-        NPC.physical['in'] += base_height[1]
-        NPC.physical['lbs'] += base_weight + extra_weight
-        NPC.physical['cm'] += int((base_height[1] * 2.54)
-                                     + base_height[0] * (2.54*12))
-        NPC.physical['kg'] += int((base_weight + extra_weight) * 0.45)
-        NPC.size = dnd.race_specs[race]['size']
+                                           weight_modifier[0], 0, 0, 0,
+                                           rng=self.rng)
+
+        feet += extra_height / 12
+        inches += extra_height % 12
+
+        if inches > 12:
+            inches -= 12
+            feet += 1
+
+        npc.physical['ft'] += feet
+        npc.physical['in'] += inches
+        npc.physical['lbs'] += base_weight + extra_weight
+        npc.physical['cm'] += int((inches * 2.54)
+                                     + feet * (2.54*12))
+        npc.physical['kg'] += int((base_weight + extra_weight) * 0.45)
+        npc.size = dnd.race_specs[race]['size']
         # Set size regarding items and carrying
-        NPC.size_for_items = self.check_if_racial_bonus('size_for_items',
-                                                        NPC.size)
+        npc.size_for_items = dnd.racial_bonuses[race].size_for_items
         # Set size adjustment to attack rolls
-        NPC.attack_adj += dnd.attack_adj[NPC.size]
+        npc.attack_adj += dnd.attack_adj[npc.size]
         # ===================================================================
         """ Set character appearance """
-        NPC.eyes = random.choice(race_specs['eyes'])
-        NPC.skin = random.choice(race_specs['skin'])
-        if NPC.age_type in ['old', 'venerable']:
-            NPC.hair = random.choice(dnd.hair_colors['old'])
+        npc.eyes = self.rng.choice(race_specs['eyes'])
+        npc.skin = self.rng.choice(race_specs['skin'])
+        if npc.age_type in ['old', 'venerable']:
+            npc.hair = self.rng.choice(dnd.hair_colors['old'])
         else:
-            NPC.hair = random.choice(race_specs['hair'])
+            npc.hair = self.rng.choice(race_specs['hair'])
 
         # ===================================================================
         """ Define base ability scores according to NPC power type:
@@ -607,84 +925,106 @@ class NPCBuilder():
         changed from the core settings ´allow_ability_reroll_at´.
         However, scores may get below 4 from racial or age penalties """
 
-        ability_roll = dnd.power_types[NPC.power]['ability_roll']
-        ability_reroll_at = dnd.power_types[NPC.power]['reroll_at']
+        ability_roll = dnd.power_types[npc.power]['ability_roll']
+        ability_reroll_at = dnd.power_types[npc.power]['reroll_at']
 
-        for score in NPC.abilities:
+        for score in npc.abilities:
             result = 0
             while result < ability_reroll_at:
                 #print(score, result)
-                result = roll(0,0,0,0,0,ability_roll)
-            NPC.abilities[score] += result
+                result = roll(0,0,0,0,0,ability_roll, rng=self.rng)
+            npc.abilities[score] += result
 
         # ===================================================================
         """ Initialize skill points and feats """
-        NPC.total_skill_points = dnd.skill_point_dict.copy()
+        npc.total_skill_points = dnd.new_skill_points()
 
         """ Initialize race specs """
-        NPC.race_type = race_specs['type']
-        NPC.speed_base = race_specs['speed']
-        NPC.vision = self.check_if_racial_bonus('vision', 'normal')
-        NPC.race_feats = self.check_if_racial_bonus('racial_feat', dict())
-        bonus = self.check_if_racial_bonus('spell_resistance', 0)
-        if bonus > 0:
-            NPC.spell_resistance = bonus + NPC.total_level
+        npc.race_type = race_specs['type']
+        npc.speed_base = race_specs['speed']
+        racial = dnd.racial_bonuses[race]
+        npc.vision = racial.vision
+        npc.race_feats = dict(racial.racial_feat)
+        if racial.spell_resistance > 0:
+            npc.spell_resistance = racial.spell_resistance + npc.total_level
         else:
-            NPC.spell_resistance = 0
+            npc.spell_resistance = 0
 
-        bonus = self.check_if_racial_bonus('bab', 0)
-        NPC.bab += bonus
+        self.racial_bab = racial.bab
+        npc.bab = self.racial_bab
 
         # ===================================================================
         """ Make priority order for distributing ability scores """
-        self.make_priority_order(NPC.Class, race_specs)
+        self.make_priority_order(npc.Class, race_specs)
 
         # ===================================================================
         """ Distribute ability scores according to the priority order """
-        self.distribute_abilities(NPC.Class, race_specs)
+        self.distribute_abilities(npc.Class, race_specs)
         # ====================================================================
         """ Set languages and bonus languages: choose bonus languages from
         racial bonus languages and class languages """
 
-        default_languages = race_specs['languages']
+        default_languages = list(race_specs['languages'])
         class_specific_languages = []
-        for c in NPC.Class:
+        for c in npc.Class:
             if c in dnd.class_languages.keys():
                 for l in dnd.class_languages[c]:
                     class_specific_languages.append(l)
 
-        bonus_langs = list(set(dnd.bonus_languages[race]
+        bonus_langs = sorted(set(dnd.bonus_languages[race]
                             + class_specific_languages)
                             - set(default_languages))
 
-        number_of_bonus_langs = NPC.ability_mods['int']
+        number_of_bonus_langs = npc.ability_mods['int']
         langs = []
         if number_of_bonus_langs > 0:
             while number_of_bonus_langs > 0:
-                index = random.randint(0, len(bonus_langs)-1)
+                index = self.rng.randint(0, len(bonus_langs)-1)
                 langs.append(bonus_langs[index])
                 del bonus_langs[index]
                 number_of_bonus_langs -= 1
 
-        NPC.languages = sorted(langs + default_languages)
-        NPC.scripts = sorted(list(
-                            set([dnd.languages[x] for x in NPC.languages])))
+        npc.languages = sorted(langs + default_languages)
+        npc.scripts = sorted(list(
+                            set([dnd.languages[x] for x in npc.languages])))
 
         # ===================================================================
         """ Level up NPC """
         level = 1
         active_class_level = 1
-        while level < NPC.total_level + 1:
+        while level < npc.total_level + 1:
             self.level_up(level, active_class_level)
             level += 1
 
+        # Base attack bonus, saves and attacks are looked up once for the
+        # final class levels. Characters without levels (see level
+        # adjustments) keep the defaults
+        if npc.total_level > 0:
+            npc.bab = self.racial_bab\
+                + dnd.base_attack_bonus(npc.Class, npc.level)
+            npc.saves_base = dnd.base_saves(npc.Class, npc.level)
+            self.update_attacks()
         self.update_variables()
+        return npc
 
 class UIBuilder():
 
-    def __init__(self, probabilities, random_ages):
+    def __init__(self, probabilities, random_ages, npc, rng=None,
+                 spec=None, weights=None):
+        """ Menu answers are written into ´npc´, usually the character
+        owned by an NPCBuilder. Random answers are drawn from ´rng´
+        (seed or random.Random instance). If a specification ´spec´ is
+        given (see make_spec), menus are answered from it instead of
+        asking the user; its class type, race, alignment and classes
+        are drawn at once from the legal characters (see
+        random_character) according to ´weights´ """
         self.probabilities = probabilities
         self.random_ages = random_ages
+        self.npc = npc
+        self.rng = dnd.get_rng(rng)
+        self.spec = spec
+        self.weights = weights
+        self.character = None
 
     def format_menu(self, opts, category):
         """ Format question menu outlook: ´opts´ possible answe options
@@ -715,36 +1055,71 @@ class UIBuilder():
 
         # Collect prohibited alignments
         if key == 'alignment':
-            restricted = dnd.race_specs[NPC.race]['restricted_alignments']
+            restricted = dnd.race_specs[self.npc.race]['restricted_alignments']
             allowed = list(set(dnd.alignment_types['any']) - set(restricted))
             next_menu = filter_list(next_menu, allowed)
         # Collect prohibited classes
         if key in ['Class']:
             for c in dnd.class_specs.keys():
-                if NPC.alignment in dnd.class_specs[c]['restricted_alignments']:
+                if self.npc.alignment in dnd.class_specs[c]['restricted_alignments']:
                     restricted.append(c)
-            if NPC.Class:
-                for x in NPC.Class:
-                    restricted += dnd.class_specs[x]['restricted_multi'] + [x]
+            if self.npc.Class:
+                for x in self.npc.Class:
+                    restricted += list(dnd.class_specs[x]['restricted_multi'])\
+                                  + [x]
             allowed = list(set(self.categories[key]) - set(restricted))
             next_menu = filter_list(next_menu, allowed)
         return next_menu
 
+    def spec_answer(self, opts, category):
+        """ Answer menu from the specification and the character drawn
+        for it. Answers not available in the (restriction filtered) menu
+        raise ValueError """
+        if category == 'main_menu':
+            return 'customize'
+
+        class_type, race, alignment, classes = self.character
+        if category == 'multi':
+            if len(classes) == 2:
+                answer = 'multi-class'
+            else:
+                answer = 'single class'
+        elif category == 'Class':
+            answer = classes[len(self.npc.Class)]
+        elif category == 'race':
+            answer = race
+        elif category == 'alignment':
+            answer = alignment
+        else:
+            answer = self.spec[category]
+
+        non_random = sorted(set(opts.keys()) - set(['r']))
+        if answer == 'random':
+            return opts[self.rng.choice(non_random)]
+        for key in non_random:
+            if answer in [opts[key], opts[key].split('\t')[0]]:
+                return opts[key]
+        raise ValueError('"%s" is not an allowed %s for this character'
+                         % (answer, category.lower().replace('_', ' ')))
+
     def show_menu(self, opts, category, randomize):
         """ Get answer and return it or randomize """
+        if not randomize and self.spec is not None:
+            return self.spec_answer(opts, category)
         if not randomize:
             while True:
                 answer = raw_input(self.format_menu(opts, category) + '\n>> ')
-                non_random = list(set(opts.keys()) - set('r'))
+                non_random = sorted(set(opts.keys()) - set('r'))
                 if answer in non_random:
                     return opts[answer]
                 if 'r' in opts.keys() and answer == 'r':
-                    return opts[random.choice(non_random)]
+                    return opts[self.rng.choice(non_random)]
         else:
             if not self.random_ages and category == 'age_type':
                 return 'adult'
             else:
-                return opts[random.choice(list(set(opts.keys()) - set(['r'])))]
+                return opts[self.rng.choice(sorted(set(opts.keys())
+                                                   - set(['r'])))]
 
     def iterate_menus(self, options, menu_order):
         """ Iterate through every NPC customization submenu in the
@@ -762,24 +1137,24 @@ class UIBuilder():
                 # Re-ask class if multi-class is chosen
                 answer = self.show_menu(options[key], key, randomize)
                 if answer == 'random':
-                    NPC.is_multiclass = random.choice([True] + [False]*3)
-                    if NPC.is_multiclass:
+                    self.npc.is_multiclass = self.rng.choice([True] + [False]*3)
+                    if self.npc.is_multiclass:
                         key = 'Class'
                     else:
                         key = menu_order[i+1]
                         del menu_order[i+1]
                 elif answer == 'multi-class':
-                    NPC.is_multiclass = True
+                    self.npc.is_multiclass = True
                     key = 'Class'
                 else:
-                    NPC.is_multiclass = False
+                    self.npc.is_multiclass = False
                     key = menu_order[i+1]
                     del menu_order[i+1]
             else:
                 pass
 
             """ Check variable types for each NPC attribute """
-            npc = NPC.__dict__
+            npc = self.npc.__dict__
             if isinstance(npc[key], list):
                 npc[key].append(self.show_menu(self.check_restrictions(
                             options[key], key), key, randomize))
@@ -801,7 +1176,12 @@ class UIBuilder():
 
         prequery = '\n1) Standard class \n2) NPC class\n\n>>'
         while True:
-            char_type = raw_input(prequery)
+            if self.spec is None:
+                char_type = raw_input(prequery)
+            else:
+                self.character = random_character(self.spec, self.rng,
+                                                  self.weights)
+                char_type = class_types[self.character[0]]
             if char_type == '1':
                 classes = dnd.classes['any']
                 menu_order = ['main_menu', 'gender', 'race', 'alignment',
@@ -844,34 +1224,152 @@ class UIBuilder():
 
         self.iterate_menus(options, menu_order)
 
-def main():
+def npc_as_dict(npc):
+    """ Return the attributes of ´npc´ as plain dicts and lists, e.g. for
+    JSON output """
+    attributes = dict(npc.__dict__)
+    attributes['skill_points'] = [table.as_dict()
+                                  for table in npc.skill_points]
+    attributes['total_skill_points'] = npc.total_skill_points.as_dict()
+    return copy.deepcopy(attributes)
+
+def render_sheet(npc):
+    """ Return the HTML character sheet of ´npc´ """
+    return html_sheet.generate(npc.__dict__, dnd.untrained, True)
+
+def write_sheet(npc, filename):
+    f = open(filename, 'w')
+    f.writelines(render_sheet(npc))
+    f.close()
+
+def run_batch(spec, count, batch_seed, out_dir, jobs=1, report_memory=False,
+              cache=None):
+    """ Generate ´count´ characters from ´spec´ and write their sheets
+    into ´out_dir´. Character i is built from dnd.derive_seed(batch_seed, i)
+    and can thus be regenerated alone later. ´jobs´ is the number of
+    worker processes; with ´report_memory´ their memory use is printed
+    after the batch. Sheets found in ´cache´ (a dnd35_cache.SheetCache)
+    are copied instead of generated """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # Character sheets refer to the style sheet by a relative path
+    css = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'sheet.css')
+    if not os.path.exists(os.path.join(out_dir, 'sheet.css')):
+        shutil.copy(css, out_dir)
+
+    pool = None
+    if jobs > 1:
+        pool = make_pool(jobs)
+    try:
+        width = len(str(count - 1))
+        sheets = iter_batch(render_batch_members, (cache,), spec, batch_seed,
+                            count, jobs=jobs, pool=pool)
+        for i, (npc, sheet) in enumerate(sheets):
+            filename = os.path.join(out_dir,
+                                    'npc_%s.html' % str(i).zfill(width))
+            with open(filename, 'w') as f:
+                f.write(sheet)
+            if npc is None:
+                print('%s: from cache' % filename)
+            else:
+                print('%s: %s %s, %s' % (filename, npc.race,
+                    html_sheet.format_class(npc.Class, npc.level),
+                    npc.alignment))
+        if report_memory and pool is not None:
+            for pid, rss, pss, private in worker_memory(pool):
+                print('worker %i: RSS %s kB, PSS %s kB, private %s kB'
+                      % (pid, rss, pss, private))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='D&D 3.5 NPC generator. Without arguments the '
+                    'character is customized interactively. Any option '
+                    'below generates characters without prompts; '
+                    'unspecified attributes are random.')
+    parser.add_argument('--class-type', choices=sorted(class_types)
+                        + ['random'], help='standard (PHB) or NPC classes')
+    parser.add_argument('--gender')
+    parser.add_argument('--race')
+    parser.add_argument('--alignment', help='e.g. "lawful good"')
+    parser.add_argument('--class', dest='class_', metavar='CLASS',
+                        help='class, or two classes for multi-class '
+                             'characters, e.g. fighter/wizard')
+    parser.add_argument('--age-type')
+    parser.add_argument('--power')
+    parser.add_argument('--level-type', help='e.g. novice, epic')
+    parser.add_argument('--count', type=int,
+                        help='number of characters to generate (default 1)')
+    parser.add_argument('--seed', help='batch seed (default random)')
+    parser.add_argument('--out-dir', default='.',
+                        help='directory for the character sheets')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes (default 1)')
+    parser.add_argument('--report-memory', action='store_true',
+                        help='print the memory use of each worker process')
+    parser.add_argument('--cache-dir',
+                        help='keep generated sheets in this directory and '
+                             'reuse them')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='size limit of --cache-dir in MB (default 256)')
+    return parser, parser.parse_args(argv)
+
+def main(argv=None):
+    parser, args = parse_args(sys.argv[1:] if argv is None else argv)
+    spec = {'class_type': args.class_type, 'gender': args.gender,
+            'race': args.race, 'alignment': args.alignment,
+            'class': args.class_, 'age_type': args.age_type,
+            'power': args.power, 'level_type': args.level_type}
+    headless = args.count is not None or args.seed is not None\
+        or any(spec.values())
+
+    if headless:
+        count = 1 if args.count is None else args.count
+        batch_seed = args.seed
+        if batch_seed is None:
+            batch_seed = dnd.random_seed()
+            print('Batch seed: %s' % batch_seed)
+        cache = None
+        if args.cache_dir:
+            cache = caches.SheetCache(args.cache_dir,
+                                           args.cache_size * 2**20)
+        try:
+            run_batch(make_spec(spec), count, batch_seed, args.out_dir,
+                      args.jobs, args.report_memory, cache)
+        except ValueError as e:
+            parser.error('invalid character specification: %s' % e)
+        return
+
     print("\nD&D 3.5 NPC Generator v%s" % __version__.strip('$'))
-    UIBuilder(False, False).generate_menu()
+    builder = NPCBuilder()
+    UIBuilder(False, False, builder.npc, builder.rng).generate_menu()
 
-    NPCBuilder().generate()
+    npc = builder.generate()
     noprint = False
 
 
-    for k in sorted(NPC.__dict__.keys()):
+    for k in sorted(npc.__dict__.keys()):
         if k == 'skill_points':
             noprint = True
         if k == 'total_skill_points':
             noprint = True
-            for q in sorted(NPC.__dict__[k]):
-                ranks = NPC.__dict__[k][q]['ranks']
-                abmod = NPC.__dict__[k][q]['ability_mod']
-                misc = NPC.__dict__[k][q]['misc_mod']
+            for q in sorted(npc.__dict__[k]):
+                ranks = npc.__dict__[k][q]['ranks']
+                abmod = npc.__dict__[k][q]['ability_mod']
+                misc = npc.__dict__[k][q]['misc_mod']
                 if ranks > 0 or q in dnd.untrained:
                     print(q + ': ' + str(ranks+abmod+misc) + ' = ' + str(ranks) + ' + ' + str(abmod) + ' + ' + str(misc))
         else:
             if not noprint:
-                print(k, NPC.__dict__[k])
+                print(k, npc.__dict__[k])
 
         noprint = False
 
-    f = open('character_sheet.html', 'w')
-    f.writelines(html_sheet.generate(NPC.__dict__, dnd.untrained, True))
-    f.close()
+    write_sheet(npc, 'character_sheet.html')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,640 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import multiprocessing
+import os
+import Queue
+import socket
+import SocketServer
+import struct
+import threading
+import traceback
+import urlparse
+import dnd35_cache as caches
+import dnd35_defs as dnd
+import dnd35_generator as generator
+
+# owwww|=================> Generation service <=================|wwwwo
+#
+#   Local HTTP/JSON service keeping the rules loaded between requests.
+#   Characters are built in a pool of worker processes forked after the
+#   rules have been loaded (see dnd35_generator.make_pool).
+#
+#   POST /npc          {"spec": {...}, "seed": 42}
+#                      -> the character as JSON
+#   POST /party        {"spec": {...}, "seed": 42, "count": 4}
+#                      -> {"seed": 42, "characters": [...]}
+#   GET  /sheet/<seed>?race=elf&class=fighter
+#                      -> the HTML character sheet
+#
+#   Spec fields are those of dnd35_generator.make_spec; missing fields
+#   and seeds are random. Party member i is built from
+#   dnd.derive_seed(seed, i), thus every member can be fetched alone as
+#   /sheet/<member seed> with the same spec.
+#
+#   Python 2.7 has no asyncio; the server handles each request in its
+#   own thread, which waits for the pool.
+#
+#   With --unix PATH the same operations are served as JSON-RPC 2.0 over
+#   a Unix domain socket instead. Each message is a 4-byte big-endian
+#   length followed by that many bytes of UTF-8 JSON:
+#
+#   {"jsonrpc": "2.0", "id": 1, "method": "generate",
+#    "params": {"spec": {...}, "seed": 42}}
+#
+#   Methods are ´generate´ and ´render´ (params spec, seed) and
+#   ´generate_batch´ (spec, seed, count, start). Requests are pipelined:
+#   a client may send any number of requests without waiting, and
+#   responses are sent as soon as they are ready, matched by ´id´.
+#   Requests are limited to MAX_BODY bytes, responses are not.
+#
+#   Specs given with --warm (e.g. 'class=fighter,level_type=adventurer')
+#   are kept in a reservoir of ready characters. Requests for them
+#   without a seed are answered from the reservoir, which is refilled
+#   in the background. GET /stats shows its hit and miss counts.
+#
+#   Identical requests arriving while one of them is being built share
+#   that build (see SingleFlight). Finished results are kept in an LRU
+#   cache (see dnd35_cache.CharacterCache) sized by --cache-entries and
+#   --cache-bytes.
+#
+# #####################################################################
+
+MAX_PARTY = 1000
+MAX_BODY = 65536
+FRAME_HEADER = struct.Struct('>I')
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+def parse_seed(seed):
+    """ Seeds given as text are numbers if they look like one, thus
+    /sheet/5 and {"seed": 5} give the same character """
+    if seed is None:
+        return dnd.random_seed()
+    if isinstance(seed, basestring):
+        try:
+            return int(seed)
+        except ValueError:
+            return seed
+    return seed
+
+def generate(spec, seed):
+    return generator.npc_as_dict(generator.build_npc(spec, seed))
+
+def render(spec, seed):
+    return generator.render_sheet(generator.build_npc(spec, seed))
+
+def generate_batch(spec, seed, count=4, start=0):
+    count = int(count)
+    if not 0 < count <= MAX_PARTY:
+        raise ValueError('count must be 1-%i' % MAX_PARTY)
+    return [generator.npc_as_dict(npc) for npc in
+            generator.build_batch_members(spec, seed, int(start), count)]
+
+rpc_methods = {'generate': generate,
+               'generate_batch': generate_batch,
+               'render': render}
+
+def call_method(method, params):
+    """ Run an RPC method in a worker. Returns (result, error); the
+    pool of Python 2.7 has no error callbacks, thus errors are returned
+    instead of raised """
+    try:
+        params = dict(params)
+        params['spec'] = generator.make_spec(params.get('spec'))
+        params['seed'] = parse_seed(params.get('seed'))
+        return rpc_methods[method](**params), None
+    except (TypeError, ValueError) as e:
+        return None, {'code': INVALID_PARAMS, 'message': str(e)}
+    except Exception as e:
+        # Any error must reach the caller, or its request never finishes
+        traceback.print_exc()
+        return None, {'code': INTERNAL_ERROR,
+                      'message': 'Internal error: %s' % e}
+
+def request_key(method, params):
+    """ Key of a request with complete ´params´. Requests of equal keys
+    have equal results """
+    params = dict(params)
+    spec = generator.spec_key(params.pop('spec'))
+    seed = params.pop('seed')
+    return (method, spec, seed, json.dumps(params, sort_keys=True),
+            dnd.RULES_VERSION)
+
+class SingleFlight(object):
+    """ Coalesce concurrent requests of the same key. Only the first
+    request is computed; requests arriving before it finishes wait for
+    it and all receive the same result object """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def submit(self, key, start, callback):
+        """ Call ´callback´ with the result for ´key´. If no request of
+        ´key´ is in flight, start(finish) is called to compute it; it
+        must call finish(result) once, from any thread """
+        with self.lock:
+            self.calls += 1
+            if key in self.waiting:
+                self.coalesced += 1
+                self.waiting[key].append(callback)
+                return
+            self.waiting[key] = [callback]
+        start(lambda result: self.finish(key, result))
+
+    def finish(self, key, result):
+        with self.lock:
+            callbacks = self.waiting.pop(key)
+        for callback in callbacks:
+            callback(result)
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'coalesced': self.coalesced,
+                    'in_flight': len(self.waiting)}
+
+def stock_character(spec):
+    """ Build a character of a random seed for the reservoir. Returns
+    None for specs no character fits """
+    try:
+        return generate(spec, parse_seed(None))
+    except ValueError:
+        return None
+    except Exception:
+        traceback.print_exc()
+        return None
+
+class Reservoir(object):
+    """ Characters built ahead of time for popular specs. Up to ´depth´
+    characters of random seeds are kept per spec, and every character
+    handed out is replaced in the background by the worker ´pool´ """
+
+    def __init__(self, pool, depth=8):
+        self.pool = pool
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.stock = {}
+        self.pending = {}
+        self.counts = collections.defaultdict(lambda: {'hits': 0,
+                                                       'misses': 0})
+
+    def add(self, spec):
+        """ Keep characters of ´spec´ in stock. Raises ValueError if no
+        character fits the spec """
+        spec = generator.make_spec(spec)
+        key = generator.spec_key(spec)
+        npc = self.pool.apply(stock_character, (spec,))
+        if npc is None:
+            raise ValueError('no character fits "%s"'
+                             % generator.format_spec(spec))
+        with self.lock:
+            if key not in self.stock:
+                self.stock[key] = collections.deque([npc])
+                self.pending[key] = 0
+            self.refill(spec, key)
+
+    def refill(self, spec, key):
+        # Called with the lock held
+        missing = self.depth - len(self.stock[key]) - self.pending[key]
+        for i in range(missing):
+            self.pending[key] += 1
+            self.pool.apply_async(stock_character, (spec,),
+                callback=lambda npc: self.restock(spec, key, npc))
+
+    def restock(self, spec, key, npc):
+        with self.lock:
+            self.pending[key] -= 1
+            # A failed build is retried by the next get, not at once
+            if npc is not None:
+                self.stock[key].append(npc)
+                self.refill(spec, key)
+
+    def get(self, spec):
+        """ Return a character of the complete specification ´spec´ as
+        a dict, or None if there is none in stock """
+        key = generator.spec_key(spec)
+        with self.lock:
+            counts = self.counts[key]
+            if not self.stock.get(key):
+                counts['misses'] += 1
+                return None
+            counts['hits'] += 1
+            npc = self.stock[key].popleft()
+            self.refill(spec, key)
+        return npc
+
+    def stats(self):
+        """ Return the stock and the hit/miss counts of each spec """
+        stats = {}
+        with self.lock:
+            for key in set(self.stock) | set(self.counts):
+                spec = generator.format_spec(dict(zip(generator.spec_fields,
+                                                      key)))
+                stats[spec] = dict(self.counts.get(key, {'hits': 0,
+                                                         'misses': 0}))
+                stats[spec]['stock'] = len(self.stock.get(key, ()))
+        return stats
+
+class WorkerPoolMixIn:
+    """ Worker pool and reservoir shared by the servers """
+
+    def start_pool(self, jobs, warm=(), depth=8, cache_entries=1024,
+                   cache_bytes=64 * 2**20):
+        self.jobs = jobs
+        self.pool = generator.make_pool(jobs)
+        self.cache = caches.CharacterCache(cache_entries, cache_bytes)
+        self.flights = SingleFlight()
+        self.reservoir = Reservoir(self.pool, depth)
+        for spec in warm:
+            self.reservoir.add(spec)
+
+    def submit(self, method, params, callback, seeded=None):
+        """ Run ´method´ in the pool and call ´callback´ with its
+        (result, error). Raises ValueError for invalid specs.
+
+        Results are cached only for seeds given by the client; nobody
+        asks for a random seed again. ´seeded´ tells if the seed in
+        ´params´ came from the client, by default if there is one """
+        params = dict(params)
+        if seeded is None:
+            seeded = params.get('seed') is not None
+        params['spec'] = generator.make_spec(params.get('spec'))
+        params['seed'] = parse_seed(params.get('seed'))
+        key = request_key(method, params)
+        if seeded:
+            result = self.cache.get(key)
+            if result is not None:
+                return callback((result, None))
+
+        def start(finish):
+            def store(outcome):
+                result, error = outcome
+                if error is None and seeded:
+                    self.cache.put(key, result)
+                finish(outcome)
+            self.pool.apply_async(call_method, (method, params),
+                                  callback=store)
+        self.flights.submit(key, start, callback)
+
+    def call(self, method, params, seeded=None):
+        """ Run ´method´ in the pool, return its (result, error). See
+        submit for ´seeded´ """
+        done = threading.Event()
+        outcome = []
+        def finish(result):
+            outcome.append(result)
+            done.set()
+        self.submit(method, params, finish, seeded)
+        done.wait()
+        return outcome[0]
+
+    def stats(self):
+        return {'reservoir': self.reservoir.stats(),
+                'coalescing': self.flights.stats(),
+                'cache': self.cache.stats()}
+
+    def stop_pool(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class GenerationServer(SocketServer.ThreadingMixIn, WorkerPoolMixIn,
+                       BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, jobs, **options):
+        self.start_pool(jobs, **options)
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.stop_pool()
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'DnD35Generator/' + generator.__version__.strip('$')
+
+    def send(self, status, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body, sort_keys=True)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def call(self, method, params, seeded=None):
+        """ Run ´method´ in the pool and return its result. Invalid
+        params raise ValueError, other errors RuntimeError """
+        result, error = self.server.call(method, params, seeded)
+        if error is None:
+            return result
+        if error['code'] == INVALID_PARAMS:
+            raise ValueError(error['message'])
+        raise RuntimeError(error['message'])
+
+    def read_json(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ValueError('Request body too large')
+        if not length:
+            return {}
+        request = json.loads(self.rfile.read(length))
+        if not isinstance(request, dict):
+            raise ValueError('Request body must be a JSON object')
+        return request
+
+    def do_POST(self):
+        try:
+            request = self.read_json()
+            spec = generator.make_spec(request.get('spec'))
+            npc = None
+            if self.path == '/npc' and request.get('seed') is None:
+                npc = self.server.reservoir.get(spec)
+            seeded = request.get('seed') is not None
+            seed = parse_seed(request.get('seed'))
+            if npc is not None:
+                self.send(200, npc)
+            elif self.path == '/npc':
+                self.send(200, self.call('generate', {'spec': spec,
+                                                      'seed': seed}, seeded))
+            elif self.path == '/party':
+                characters = self.call('generate_batch',
+                    {'spec': spec, 'seed': seed,
+                     'count': request.get('count', 4)}, seeded)
+                self.send(200, {'seed': seed, 'characters': characters})
+            else:
+                self.send(404, {'error': 'Unknown path %s' % self.path})
+        except (TypeError, ValueError) as e:
+            self.send(400, {'error': str(e)})
+        except RuntimeError as e:
+            self.send(500, {'error': str(e)})
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts[-1] == 'sheet.css':
+            css = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'sheet.css')
+            with open(css) as f:
+                self.send(200, f.read(), 'text/css')
+        elif url.path == '/stats':
+            self.send(200, self.server.stats())
+        elif len(parts) == 2 and parts[0] == 'sheet':
+            try:
+                query = urlparse.parse_qs(url.query)
+                spec = generator.make_spec(
+                    dict((k, v[-1]) for k, v in query.items()))
+                sheet = self.call('render', {'spec': spec,
+                                             'seed': parts[1]})
+                self.send(200, sheet, 'text/html')
+            except ValueError as e:
+                self.send(400, {'error': str(e)})
+            except RuntimeError as e:
+                self.send(500, {'error': str(e)})
+        else:
+            self.send(404, {'error': 'Unknown path %s' % url.path})
+
+def read_frame(sock, max_size=None):
+    """ Read one length-prefixed message from ´sock´, None at EOF.
+    Messages longer than ´max_size´ raise ValueError """
+    header = read_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, = FRAME_HEADER.unpack(header)
+    if max_size is not None and length > max_size:
+        raise ValueError('Frame too large (%i bytes, at most %i)'
+                         % (length, max_size))
+    return read_exactly(sock, length)
+
+def read_exactly(sock, size):
+    data = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        data.append(chunk)
+        size -= len(chunk)
+    return ''.join(data)
+
+def write_frame(sock, message):
+    sock.sendall(FRAME_HEADER.pack(len(message)) + message)
+
+class RPCServer(SocketServer.ThreadingMixIn, WorkerPoolMixIn,
+                SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, jobs, **options):
+        self.start_pool(jobs, **options)
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RPCHandler)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        os.remove(self.server_address)
+        self.stop_pool()
+
+class RPCHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        # Results arrive in the result thread of the pool, in any order.
+        # They are queued to a writer thread of the connection, thus a
+        # slow client never blocks the result thread
+        self.responses = Queue.Queue()
+        self.answered = threading.Condition()
+        self.unanswered = 0
+        writer = threading.Thread(target=self.write_responses)
+        writer.daemon = True
+        writer.start()
+        oversized = False
+        while True:
+            try:
+                message = read_frame(self.request, MAX_BODY)
+            except socket.error:
+                break
+            except ValueError as e:
+                # The stream cannot be framed past an oversized frame.
+                # Report it and close once the requests read before it
+                # are answered
+                with self.answered:
+                    self.unanswered += 1
+                self.respond(None, error={'code': INVALID_REQUEST,
+                                          'message': str(e)})
+                oversized = True
+                message = None
+            if message is None:
+                # Answer the requests still in flight before closing
+                with self.answered:
+                    while self.unanswered:
+                        self.answered.wait()
+                break
+            with self.answered:
+                self.unanswered += 1
+            self.dispatch(message)
+        self.responses.put(None)
+        writer.join()
+        if oversized:
+            # Closing with unread data would reset the connection and
+            # could discard the responses the client has not read yet
+            try:
+                self.request.shutdown(socket.SHUT_WR)
+                self.request.settimeout(5)
+                while self.request.recv(65536):
+                    pass
+            except socket.error:
+                pass
+
+    def write_responses(self):
+        while True:
+            message = self.responses.get()
+            if message is None:
+                return
+            try:
+                write_frame(self.request, message)
+            except socket.error:
+                pass
+
+    def respond(self, id, result=None, error=None):
+        """ Queue the response to a request. Every request dispatched is
+        responded to exactly once """
+        response = {'jsonrpc': '2.0', 'id': id}
+        if error is None:
+            response['result'] = result
+        else:
+            response['error'] = error
+        self.responses.put(json.dumps(response))
+        with self.answered:
+            self.unanswered -= 1
+            self.answered.notify()
+
+    def dispatch(self, message):
+        try:
+            request = json.loads(message)
+        except ValueError as e:
+            return self.respond(None, error={'code': PARSE_ERROR,
+                                             'message': str(e)})
+        if not isinstance(request, dict) or 'method' not in request:
+            return self.respond(None, error={'code': INVALID_REQUEST,
+                                             'message': 'Invalid request'})
+        id = request.get('id')
+        method = request['method']
+        params = request.get('params') or {}
+        if method not in rpc_methods:
+            return self.respond(id, error={'code': METHOD_NOT_FOUND,
+                'message': 'Unknown method "%s"' % method})
+        if not isinstance(params, dict):
+            return self.respond(id, error={'code': INVALID_PARAMS,
+                'message': 'params must be an object'})
+        if method == 'generate' and params.get('seed') is None:
+            try:
+                spec = generator.make_spec(params.get('spec'))
+            except ValueError as e:
+                return self.respond(id, error={'code': INVALID_PARAMS,
+                                               'message': str(e)})
+            npc = self.server.reservoir.get(spec)
+            if npc is not None:
+                return self.respond(id, npc)
+        try:
+            self.server.submit(method, params,
+                               lambda outcome: self.respond(id, *outcome))
+        except (TypeError, ValueError) as e:
+            self.respond(id, error={'code': INVALID_PARAMS,
+                                    'message': str(e)})
+
+class RPCClient(object):
+    """ Minimal client for the Unix socket server. Requests may be
+    sent ahead of reading responses """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.next_id = 0
+
+    def send(self, method, **params):
+        """ Send a request and return its id """
+        self.next_id += 1
+        write_frame(self.sock, json.dumps({'jsonrpc': '2.0',
+            'id': self.next_id, 'method': method, 'params': params}))
+        return self.next_id
+
+    def receive(self):
+        """ Return the next response """
+        message = read_frame(self.sock)
+        if message is None:
+            raise IOError('Connection closed by server')
+        return json.loads(message)
+
+    def call(self, method, **params):
+        self.send(method, **params)
+        response = self.receive()
+        if 'error' in response:
+            raise ValueError(response['error']['message'])
+        return response['result']
+
+    def close(self):
+        self.sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve D&D 3.5 NPCs over HTTP (see module comments)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8035)
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of worker processes (default: one '
+                             'per CPU)')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='serve JSON-RPC on a Unix domain socket '
+                             'instead of HTTP')
+    parser.add_argument('--warm', metavar='SPEC', action='append',
+                        default=[], help='keep characters of SPEC, e.g. '
+                        '"class=fighter,level_type=adventurer", ready; '
+                        'may be repeated')
+    parser.add_argument('--reservoir-depth', type=int, default=8,
+                        help='characters kept ready per warm spec '
+                             '(default 8)')
+    parser.add_argument('--cache-entries', type=int, default=1024,
+                        help='results kept in memory (default 1024)')
+    parser.add_argument('--cache-bytes', type=int, default=64 * 2**20,
+                        help='memory for kept results (default 64 MB)')
+    args = parser.parse_args(argv)
+
+    try:
+        options = {'warm': [generator.parse_spec(s) for s in args.warm],
+                   'depth': args.reservoir_depth,
+                   'cache_entries': args.cache_entries,
+                   'cache_bytes': args.cache_bytes}
+        if args.unix:
+            server = RPCServer(args.unix, args.jobs, **options)
+        else:
+            server = GenerationServer((args.host, args.port), args.jobs,
+                                      **options)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.unix:
+        print('Serving JSON-RPC on %s' % server.server_address)
+    else:
+        print('Serving on http://%s:%i/' % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@
 
 HIDE_CALCULATED = False
 
+# Increase whenever the sheet layout changes; cached sheets of older
+# versions are then not used
+TEMPLATE_VERSION = 1
+
 def add_plus(digit):
     if digit > 0:
         return '+' + str(digit)
@@ -26,8 +30,8 @@ def format_weight(npc):
 def format_ac_special(npc):
     bonuses = []
     asb = npc['ac_special_bonuses']
-    for t in asb.keys():
-        for b in asb[t].keys():
+    for t in sorted(asb):
+        for b in sorted(asb[t]):
             if asb[t][b] > 0:
                 bonuses.append(add_plus(asb[t][b]) + ' (' + t + ') ' + b)
     return('<br/>'.join(bonuses))
@@ -42,7 +46,7 @@ def format_langs(langs):
 def format_dr(npc):
     bonuses = []
     dr = npc['damage_reduction']
-    for t in dr.keys():
+    for t in sorted(dr):
         if dr[t] > 0:
             bonuses.append('%s/%s' % (dr[t], t))
 
@@ -52,19 +56,15 @@ def format_save_special(save, general):
     bonuses = []
     saves = [save, general]
     for x in saves:
-        for s in x.keys():
+        for s in sorted(x):
             if x[s] > 0:
                 bonuses.append(add_plus(x[s]) + ' ' +  s)
 
     return(', '.join(bonuses))
 
 def generate_skill_tables(npc, untrained, compact=True):
-    skills = npc['total_skill_points']
     table = []
-    for q in sorted(skills):
-        ranks = skills[q]['ranks']
-        abmod = skills[q]['ability_mod']
-        misc = skills[q]['misc_mod']
+    for q, ranks, abmod, misc in sorted(npc['total_skill_points'].rows()):
         if ranks > 0 or q in untrained:
             if compact:
                 table.append('{skill_name}: <b>{total}</b>'.format(